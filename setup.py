@@ -45,7 +45,8 @@ server.
         ],
     "entry_points": {
         "console_scripts": [
-            "whisper-backup = whisperbackup.whisperbackup:main"
+            "whisper-backup = whisperbackup.whisperbackup:main",
+            "whisper-backup-benchmark = whisperbackup.benchmark:main"
         ]
     }
 }
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import hashlib
+import unittest
+
+from whisperbackup.blocks import CHUNKS_NAME, blockKey, blockPrefix, \
+        blockSHA, makeRecipe, parseRecipe
+
+class RecipeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shas = [ hashlib.sha1(str(i)).hexdigest() for i in range(3) ]
+
+    def testRoundTrip(self):
+        recipe = makeRecipe("gz", 4096, 10000, self.shas)
+        self.assertEqual(parseRecipe(recipe),
+                         ("gz", 4096, 10000, self.shas, False))
+
+    def testShared(self):
+        recipe = makeRecipe("zst", 65536, 12, self.shas[:1], shared=True)
+        self.assertEqual(parseRecipe(recipe),
+                         ("zst", 65536, 12, self.shas[:1], True))
+
+    def testEmptyFile(self):
+        recipe = makeRecipe("gz", 4096, 0, [])
+        self.assertEqual(parseRecipe(recipe), ("gz", 4096, 0, [], False))
+
+    def testFormat(self):
+        self.assertEqual(makeRecipe("gz", 4096, 5, self.shas[:1]),
+                "whisper-backup-blocks\t1\ngz\t4096\t5\n%s\n" % self.shas[0])
+
+    def testUnknownFormat(self):
+        self.assertRaises(ValueError, parseRecipe, "something else\n")
+        self.assertRaises(ValueError, parseRecipe,
+                          "whisper-backup-blocks\t2\ngz\t4096\t5\n")
+
+    def testBlockKeys(self):
+        sha = self.shas[0]
+        key = blockKey(blockPrefix("p/", "p/a.b", False), sha, "gz")
+        self.assertEqual(key, "p/a.b/blocks/%s.gz" % sha)
+        self.assertEqual(blockSHA(key), sha)
+        key = blockKey(blockPrefix("p/", "p/a.b", True), sha, "gz")
+        self.assertEqual(key, "p/%s/%s.gz" % (CHUNKS_NAME, sha))
+        self.assertEqual(blockSHA(key), sha)
+        self.assertEqual(blockSHA("p/a.b/2019-01-01T00:00:00+00:00.blocks"),
+                         None)
+
+
+if __name__ == "__main__":
+    unittest.main()
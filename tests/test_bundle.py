@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import calendar
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from whisperbackup import bundle
+from whisperbackup.bundle import BUNDLES_NAME, BundleWriter, bundleKey, \
+        bundleTime, listBundles, makeLocation, parseLocation, readIndex
+from whisperbackup.disk import Disk
+
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = Disk(os.path.join(self.dir, "store"))
+        self.tail = bundle.TAIL_SIZE
+
+    def tearDown(self):
+        bundle.TAIL_SIZE = self.tail
+        shutil.rmtree(self.dir)
+
+    def makeBundle(self, count):
+        """Store a bundle of count members, return its key and a list of
+           (metric key, timestamp, content, location) of the members."""
+        key = bundleKey("p/")
+        writer = BundleWriter(key, self.dir)
+        members = []
+        for i in range(count):
+            path = os.path.join(self.dir, "member")
+            content = "compressed backup %d\n" % i * (i + 1)
+            with open(path, "wb") as fh:
+                fh.write(content)
+            k = "p/servers.host%d.cpu" % i
+            ts = "2019-01-01T00:00:%02d+00:00" % (i % 60)
+            location = writer.add(k, ts, hashlib.sha1(content).hexdigest(),
+                                  "gz", path)
+            members.append((k, ts, content, location))
+        self.assertEqual(len(writer), count)
+        self.store.put(key, writer.finish().read())
+        writer.close()
+        return key, members
+
+    def checkBundle(self, key, members):
+        size = len(self.store.get(key))
+        index = readIndex(self.store, key, size)
+        self.assertEqual(len(index), len(members))
+        for (k, ts, content, location), entry in zip(members, index):
+            self.assertEqual(entry[:4], (k, ts,
+                    hashlib.sha1(content).hexdigest(), "gz"))
+            self.assertEqual(makeLocation(key, entry[4], entry[5]), location)
+            bundleKey, offset, length = parseLocation(location)
+            self.assertEqual(bundleKey, key)
+            self.assertEqual(self.store.getRange(key, offset, length),
+                             content)
+
+    def testRoundTrip(self):
+        key, members = self.makeBundle(5)
+        self.checkBundle(key, members)
+
+    def testLargeIndex(self):
+        # An index that is not all in the first ranged GET of the tail
+        bundle.TAIL_SIZE = 64
+        key, members = self.makeBundle(20)
+        self.checkBundle(key, members)
+
+    def testListBundles(self):
+        key, members = self.makeBundle(2)
+        self.store.put("p/%s/junk.bundle" % BUNDLES_NAME, "not a bundle")
+        self.store.put("p/%s/other" % BUNDLES_NAME, "ignored")
+        found = list(listBundles(self.store, "p/"))
+        self.assertEqual([ i[0] for i in found ], [key])
+        self.assertEqual([ i[:2] for i in found[0][1] ],
+                         [ i[:2] for i in members ])
+
+    def testNotABundle(self):
+        self.store.put("p/x.bundle", "short")
+        self.assertRaises(ValueError, readIndex, self.store, "p/x.bundle", 5)
+        self.store.put("p/y.bundle", "x" * 100)
+        self.assertRaises(ValueError, readIndex, self.store, "p/y.bundle",
+                          100)
+
+    def testParseLocation(self):
+        location = makeLocation("p/%s/a.bundle" % BUNDLES_NAME, 12, 345)
+        self.assertEqual(parseLocation(location),
+                         ("p/%s/a.bundle" % BUNDLES_NAME, 12, 345))
+        # Only the last two colons separate the offset and length
+        self.assertEqual(parseLocation("s3:key:with:colons:0:1"),
+                         ("s3:key:with:colons", 0, 1))
+
+    def testBundleTime(self):
+        self.assertEqual(bundleTime(
+                "p/%s/20190102T030405-0123abcd.bundle" % BUNDLES_NAME),
+                calendar.timegm((2019, 1, 2, 3, 4, 5, 0, 0, 0)))
+        self.assertEqual(bundleTime("p/%s/junk.bundle" % BUNDLES_NAME), None)
+        key = bundleKey("p/")
+        self.assertTrue(key.startswith("p/%s/" % BUNDLES_NAME))
+        self.assertTrue(bundleTime(key) is not None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import whisper
+
+from StringIO import StringIO
+
+from whisperbackup import fill
+
+NOW = 1700000000
+
+class FillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # Both engines and whisper must agree on the time
+        self.time = time.time
+        time.time = lambda: NOW
+
+    def tearDown(self):
+        time.time = self.time
+        shutil.rmtree(self.dir)
+
+    def makeFile(self, name, archives, value):
+        """Create a whisper file with a point from value(t) in every slot
+           of every archive, or none where that returns None."""
+        path = os.path.join(self.dir, name)
+        if os.path.exists(path):
+            os.unlink(path)
+        whisper.create(path, archives)
+        points = []
+        for step, n in archives:
+            for t in range(NOW - step * n + step, NOW, step):
+                v = value(t)
+                if v is not None:
+                    points.append((t, v))
+        whisper.update_many(path, points)
+        return path
+
+    def heal(self, src, dst, numpy):
+        """Fill a copy of dst from src with one of the engines and return
+           the resulting file."""
+        path = dst + (".numpy" if numpy else ".python")
+        shutil.copy(dst, path)
+        saved = fill.numpy
+        if not numpy:
+            fill.numpy = None
+        try:
+            with open(src, "rb") as fh:
+                fill.fill_archives(StringIO(fh.read()), path, NOW)
+        finally:
+            fill.numpy = saved
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    def compareEngines(self, srcArchives, dstArchives, seed):
+        rng = random.Random(seed)
+        src = self.makeFile("src.wsp", srcArchives,
+                lambda t: None if rng.random() < 0.1 else
+                          float(rng.randint(1, 100)))
+        dst = self.makeFile("dst.wsp", dstArchives,
+                lambda t: None if rng.random() < 0.3 else
+                          float(rng.randint(200, 300)))
+        with open(dst, "rb") as fh:
+            before = fh.read()
+
+        python = self.heal(src, dst, False)
+        self.assertNotEqual(python, before)
+        self.assertEqual(self.heal(src, dst, True), python)
+
+    @unittest.skipIf(fill.numpy is None, "numpy is not installed")
+    def testSameSchema(self):
+        archives = [(60, 60), (300, 48), (3600, 30)]
+        for seed in range(5):
+            self.compareEngines(archives, archives, seed)
+
+    @unittest.skipIf(fill.numpy is None, "numpy is not installed")
+    def testCoarserDestination(self):
+        for seed in range(5):
+            self.compareEngines([(60, 60), (300, 48), (3600, 30)],
+                                [(300, 48), (3600, 30)], seed)
+
+    @unittest.skipIf(fill.numpy is None, "numpy is not installed")
+    def testFindGaps(self):
+        values = [1.0, None, 2.0, None, None, 3.0, 0.0, None, 4.0, None, None]
+        self.assertEqual(fill.find_gaps(values, 1000, 10, 10),
+                         [(1020, 1050), (1050, 1080), (1080, 1100)])
+        self.assertEqual(fill.find_gaps([1.0, 2.0, None], 1000, 10, 10), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
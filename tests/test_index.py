@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+from whisperbackup.bundle import BundleWriter, bundleKey, makeLocation
+from whisperbackup.disk import Disk
+from whisperbackup.index import INDEX_NAME, Index
+
+T1 = "2019-01-01T00:00:00+00:00"
+T2 = "2019-01-02T00:00:00+00:00"
+T3 = "2019-01-03T00:00:00+00:00"
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = Disk(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writeIndex(self, version, lines):
+        """Store an index of format version with the tab separated lines."""
+        buf = StringIO()
+        fd = gzip.GzipFile(fileobj=buf, mode="wb")
+        fd.write("whisper-backup-index\t%s\n" % version)
+        for i in lines:
+            fd.write("\t".join(i) + "\n")
+        fd.close()
+        self.store.put("p/" + INDEX_NAME, buf.getvalue())
+
+    def load(self):
+        index = Index(self.store, "p/")
+        self.assertTrue(index.load())
+        return index
+
+    def testVersion1(self):
+        self.writeIndex("1", [("a.b", T1, "sha", "10"), ("a.b", T2, "-", "-")])
+        index = self.load()
+        self.assertEqual(index.metrics["a.b"],
+                [[T1, "sha", 10, None, None], [T2, None, None, None, None]])
+
+    def testVersion2(self):
+        self.writeIndex("2", [("a.b", T1, "sha", "10", "p/b.bundle:0:10")])
+        index = self.load()
+        self.assertEqual(index.location("a.b", T1), "p/b.bundle:0:10")
+        self.assertEqual(index.algorithm("a.b", T1), None)
+
+    def testVersion3(self):
+        self.writeIndex("3", [("a.b", T2, "sha", "10", "-", "gz"),
+                              ("a.b", T1, "-", "-", "-", "-")])
+        index = self.load()
+        # Backups are kept in time order
+        self.assertEqual([ i[0] for i in index.metrics["a.b"] ], [T1, T2])
+        self.assertEqual(index.algorithm("a.b", T2), "gz")
+        self.assertEqual(index.sha1("a.b", T2), "sha")
+        self.assertEqual(index.size("a.b", T2), 10)
+        self.assertTrue(index.has("a.b", T1))
+        self.assertFalse(index.has("a.b", T3))
+
+    def testUnreadable(self):
+        index = Index(self.store, "p/")
+        self.assertFalse(index.load())
+        self.writeIndex("99", [])
+        self.assertFalse(index.load())
+        self.store.put("p/" + INDEX_NAME, "not gzip")
+        self.assertFalse(index.load())
+
+    def testRoundTrip(self):
+        self.writeIndex("1", [("a.b", T1, "sha", "10")])
+        index = self.load()
+        index.add("a.b", T1, algorithm="gz")
+        index.add("c", T2, "sha2", 5, "p/b.bundle:5:5", "zst")
+        index.save()
+        again = self.load()
+        self.assertEqual(again.metrics, index.metrics)
+        self.assertEqual(again.digest, index.digest)
+        self.assertEqual(sorted(again.search("*").keys()), ["a.b", "c"])
+        self.assertEqual(again.search("a.*"), {"a.b": ["a.b/%s" % T1]})
+
+    def testMergeLoaded(self):
+        # Another writer saves after we loaded, our changes are replayed
+        # over its index
+        self.writeIndex("3", [("a", T1, "-", "-", "-", "-"),
+                              ("b", T1, "-", "-", "-", "-")])
+        index = self.load()
+        index.add("a", T2)
+        index.remove("b", T1)
+        self.writeIndex("2", [("a", T1, "-", "-", "-"),
+                              ("b", T1, "-", "-", "-"),
+                              ("c", T3, "-", "-", "-")])
+        index.save()
+        self.assertEqual(sorted([ (m, i[0]) for m, v in
+                                  self.load().metrics.items() for i in v ]),
+                         [("a", T1), ("a", T2), ("c", T3)])
+
+    def testMergeRebuilt(self):
+        # A rebuilt index keeps what it listed and adds the backups others
+        # recorded since, except those we removed
+        self.store.put("p/a/%s.sha1" % T1, "sha")
+        self.store.put("p/a/%s.wsp.gz" % T1, "data")
+        self.store.put("p/b/%s.sha1" % T1, "sha")
+        index = Index(self.store, "p/")
+        index.rebuild("p/")
+        self.assertEqual(index.algorithm("a", T1), "gz")
+        index.remove("b", T1)
+        self.writeIndex("1", [("b", T1, "-", "-"), ("c", T2, "-", "-")])
+        index.save()
+        self.assertEqual(sorted([ (m, i[0]) for m, v in
+                                  self.load().metrics.items() for i in v ]),
+                         [("a", T1), ("c", T2)])
+
+    def testRebuildBundles(self):
+        path = os.path.join(self.dir, "member")
+        with open(path, "wb") as fh:
+            fh.write("compressed")
+        key = bundleKey("p/")
+        writer = BundleWriter(key, self.dir)
+        writer.add("p/a", T1, "sha", "gz", path)
+        self.store.put(key, writer.finish().read())
+        writer.close()
+        index = Index(self.store, "p/")
+        index.rebuild("p/")
+        self.assertEqual(index.metrics["a"],
+                [[T1, "sha", 10, makeLocation(key, 0, 10), "gz"]])
+        self.assertEqual(index.bundles(), set([key]))
+
+    def testDirty(self):
+        # A dirty index is still used, and only our own marker is cleared
+        self.writeIndex("3", [("a", T1, "-", "-", "-", "-")])
+        self.store.put("p/%s.dirty" % INDEX_NAME, "someone else")
+        index = self.load()
+        self.assertTrue(index.has("a", T1))
+        index.markDirty()
+        index.save()
+        self.assertEqual(self.store.get("p/%s.dirty" % INDEX_NAME), None)
+        index.markDirty()
+        self.store.put("p/%s.dirty" % INDEX_NAME, "someone else")
+        index.save()
+        self.assertEqual(self.store.get("p/%s.dirty" % INDEX_NAME),
+                         "someone else")
+
+
+if __name__ == "__main__":
+    unittest.main()
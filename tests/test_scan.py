@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from whisperbackup.scan import MetricGlob, scanMetrics, singleComponent
+
+class MetricGlobTest(unittest.TestCase):
+
+    def testSingleComponent(self):
+        self.assertTrue(singleComponent("servers"))
+        self.assertTrue(singleComponent("web[0-9]"))
+        self.assertFalse(singleComponent("web*"))
+        self.assertFalse(singleComponent("web?"))
+        # A class that can match the dot between components
+        self.assertFalse(singleComponent("a[!x]b"))
+        self.assertFalse(singleComponent("a[b"))
+
+    def testEnter(self):
+        glob = MetricGlob("servers.web[01].cpu")
+        self.assertTrue(glob.enter(["servers"]))
+        self.assertTrue(glob.enter(["servers", "web0"]))
+        self.assertFalse(glob.enter(["servers", "web2"]))
+        self.assertFalse(glob.enter(["carbon"]))
+        # Metrics are never deeper than the glob
+        self.assertFalse(glob.enter(["servers", "web0", "cpu"]))
+
+    def testEnterDottedDirectory(self):
+        # A directory named a.b holds metrics named a.b.*
+        glob = MetricGlob("servers.web0.cpu")
+        self.assertTrue(glob.enter(["servers.web0"]))
+        self.assertFalse(glob.enter(["servers.web1"]))
+        self.assertFalse(glob.enter(["servers.web0.cpu"]))
+        self.assertFalse(glob.enter(["servers", "web0.cpu"]))
+
+    def testEnterWildcard(self):
+        # Only the components before the first wildcard prune the walk
+        glob = MetricGlob("servers.*.cpu")
+        self.assertTrue(glob.enter(["servers", "web0", "cpu", "deep"]))
+        self.assertFalse(glob.enter(["carbon", "web0"]))
+        glob = MetricGlob("*")
+        self.assertTrue(glob.enter(["anything", "at", "all"]))
+
+    def testMatch(self):
+        self.assertTrue(MetricGlob("*").match("a.b.c"))
+        self.assertTrue(MetricGlob("a.*").match("a.b.c"))
+        self.assertFalse(MetricGlob("a.b").match("a.b.c"))
+
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for i in ["servers/web0/cpu.wsp", "servers/web0/mem.wsp",
+                  "servers/web1/cpu.wsp", "servers.web2/cpu.wsp",
+                  "carbon/agents/a/cpu.wsp", "servers/web0/notes.txt"]:
+            path = os.path.join(self.dir, i)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as fh:
+                fh.write("x")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def scan(self, glob, threads=1):
+        return sorted([ i[0] for i in scanMetrics(self.dir, glob, threads) ])
+
+    def testScan(self):
+        for threads in (1, 4):
+            self.assertEqual(self.scan("*", threads),
+                    ["carbon.agents.a.cpu", "servers.web0.cpu",
+                     "servers.web0.mem", "servers.web1.cpu",
+                     "servers.web2.cpu"])
+            self.assertEqual(self.scan("servers.*.cpu", threads),
+                    ["servers.web0.cpu", "servers.web1.cpu",
+                     "servers.web2.cpu"])
+            self.assertEqual(self.scan("servers.web2.cpu", threads),
+                    ["servers.web2.cpu"])
+            self.assertEqual(self.scan("servers.web[01].mem", threads),
+                    ["servers.web0.mem"])
+
+    def testResults(self):
+        name, path, size, mtime = list(scanMetrics(self.dir,
+                                                   "carbon.agents.a.cpu"))[0]
+        self.assertEqual(path, os.path.join(self.dir,
+                                            "carbon/agents/a/cpu.wsp"))
+        self.assertEqual(size, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
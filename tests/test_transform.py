@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+import whisper
+
+from StringIO import StringIO
+
+from whisperbackup import transform
+from whisperbackup.transform import MAGIC, MAGIC_V1, decode, encode, \
+        encodeArchive, encodeFile, parseLayout
+
+class TransformTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.window = transform.WINDOW_POINTS
+        self.numpy = transform.numpy
+
+    def tearDown(self):
+        transform.WINDOW_POINTS = self.window
+        transform.numpy = self.numpy
+        shutil.rmtree(self.dir)
+
+    def makeFile(self, archives=((60, 100), (300, 50))):
+        """Return the contents of a whisper file with some points."""
+        path = os.path.join(self.dir, "test.wsp")
+        if os.path.exists(path):
+            os.unlink(path)
+        whisper.create(path, list(archives))
+        rng = random.Random(1)
+        now = int(time.time())
+        whisper.update_many(path, [ (now - 60 * i, rng.random() * 100)
+                                    for i in range(90) if i % 3 ])
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    def testRoundTrip(self):
+        data = self.makeFile()
+        encoded = encode(data)
+        self.assertTrue(encoded.startswith(MAGIC))
+        self.assertEqual(decode(encoded), data)
+
+    def testWindows(self):
+        data = self.makeFile()
+        transform.WINDOW_POINTS = 7
+        encoded = encode(data)
+        self.assertEqual(decode(encoded), data)
+        # The streamed form is the same as the whole
+        chunks = list(encodeFile(StringIO(data), len(data)))
+        self.assertTrue(len(chunks) > 2)
+        self.assertEqual("".join(chunks), encoded)
+
+    def testPurePython(self):
+        data = self.makeFile()
+        encoded = encode(data)
+        transform.numpy = None
+        self.assertEqual(encode(data), encoded)
+        self.assertEqual(decode(encoded), data)
+
+    def testVersion1(self):
+        # WBX1 files hold each archive as a single window
+        data = self.makeFile()
+        length, points = parseLayout(data, len(data))
+        out = [MAGIC_V1, data[:length]]
+        offset = length
+        for n in points:
+            out.append(encodeArchive(data[offset:offset + 12 * n]))
+            offset += 12 * n
+        self.assertEqual(decode("".join(out)), data)
+
+    def testNotWhisper(self):
+        for data in ("", "hello world", "\x00" * 100):
+            self.assertEqual(encode(data), data)
+            self.assertEqual(decode(data), data)
+        # A file whose archives do not fill it is left alone
+        data = self.makeFile() + "trailing"
+        self.assertEqual(encode(data), data)
+
+    def testAnyBytes(self):
+        # Timestamps and values that are not a real series still survive
+        rng = random.Random(2)
+        data = self.makeFile()
+        length, points = parseLayout(data, len(data))
+        data = data[:length] + "".join([ chr(rng.randint(0, 255))
+                for i in range(len(data) - length) ])
+        self.assertEqual(decode(encode(data)), data)
+
+    def testCorrupt(self):
+        encoded = encode(self.makeFile())
+        self.assertRaises(ValueError, decode, encoded[:len(MAGIC) + 8])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# A benchmark of whisper-backup end to end.  We generate a synthetic tree
+# of whisper files from a seed, then run whisper-backup itself against the
+# simulated store in sim.py to back it up several times, changing some of
+# the metrics between runs, list it, restore it and purge metrics we
+# removed.  Each command is timed and we report files and MB per second,
+# the requests it made of the store and the peak RSS of its processes.
+
+import json
+import math
+import os
+import os.path
+import random
+import shlex
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser, make_option
+
+import whisper
+
+# whisper's point format, see whisper.py
+POINT_FORMAT = "!Ld"
+
+# Points written to each changed metric between backups
+CHANGE_POINTS = 10
+
+def parseSchemas(schemas):
+    """Return a list of whisper archive lists from a string of schemas
+       separated by semicolons, each a comma separated list of retentions
+       like 60s:1d."""
+
+    return [ [ whisper.parseRetentionDef(j) for j in i.split(",") ]
+             for i in schemas.split(";") if i ]
+
+
+def metricPath(root, i):
+    """Return the path of the whisper file of metric i under root."""
+    return os.path.join(root, "bench", "host%02d" % (i % 20),
+                        "metric%d.wsp" % i)
+
+
+def pointValue(rng, kind, base, n):
+    """Return the value of the nth point of a metric of kind."""
+    if kind == 0:
+        # Counter
+        return float(int(base) + n * 6)
+    elif kind == 1:
+        # Gauge
+        return round(base + 50 * math.sin(n / 60.0) + rng.random(), 2)
+    else:
+        # Sparse integer
+        return float(rng.choice([0, 0, 0, 1, 2]))
+
+
+def createMetric(rng, path, archives, fill, now):
+    """Create the whisper file at path with archives and fill that fraction
+       of the slots of each archive with points, written directly so large
+       trees are quick to make."""
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    whisper.create(path, archives)
+
+    kind = rng.randint(0, 2)
+    base = rng.random() * 1000
+    with open(path, "r+b") as fd:
+        for info in whisper.info(path)["archives"]:
+            step, points = info["secondsPerPoint"], info["points"]
+            start = now - now % step - (points - 1) * step
+            data = []
+            for n in range(points):
+                # The first slot is always filled as whisper finds where
+                # the archive starts from it
+                if n == 0 or rng.random() < fill:
+                    data.append(struct.pack(POINT_FORMAT, start + n * step,
+                                            pointValue(rng, kind, base, n)))
+                else:
+                    data.append(struct.pack(POINT_FORMAT, 0, 0))
+            fd.seek(info["offset"])
+            fd.write("".join(data))
+
+
+def changeMetric(rng, path, now):
+    """Write the latest points to the whisper file at path as carbon
+       would."""
+
+    step = whisper.info(path)["archives"][0]["secondsPerPoint"]
+    now = now - now % step
+    whisper.update_many(path, [ (now - n * step, rng.random() * 1000)
+                                for n in range(CHANGE_POINTS) ])
+
+
+def treeSize(paths):
+    """Return the total size in bytes of the files at paths."""
+    return sum([ os.path.getsize(i) for i in paths if os.path.exists(i) ])
+
+
+def nextSecond():
+    """Sleep until the clock ticks over to a new second.  Backups are named
+       by the second they were made in."""
+    t = int(time.time())
+    while int(time.time()) == t:
+        time.sleep(0.05)
+
+
+def runPhase(options, workdir, name, command, prefix, files, size,
+             extra=[]):
+    """Run whisper-backup command with prefix as its whisper tree, and
+       the options in extra, against the simulated store and return a dict
+       of what it did."""
+
+    stats = os.path.join(workdir, "stats.json")
+    if os.path.exists(stats):
+        os.unlink(stats)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "whisperbackup.py")
+    args = [sys.executable, script, "--nolog", "--nolock", "--nostamp",
+            "--quiet", "--bucket", os.path.join(workdir, "store"),
+            "--prefix", prefix] + shlex.split(options.options) + extra + \
+           [command, "sim", "latency=%s" % options.latency,
+            "pagesize=%d" % options.pagesize, "stats=%s" % stats]
+    if options.bandwidth:
+        args.append("bandwidth=%s" % options.bandwidth)
+
+    t = time.time()
+    with open(os.devnull, "w") as devnull:
+        p = subprocess.Popen(args, stdout=devnull)
+    pid, status, rusage = os.wait4(p.pid, 0)
+    elapsed = max(time.time() - t, 1e-6)
+    if status != 0:
+        sys.stderr.write("%s failed with exit status %d\n"
+                % (name, os.WEXITSTATUS(status)))
+        sys.exit(1)
+
+    requests = {}
+    if os.path.exists(stats):
+        with open(stats) as fd:
+            requests = json.load(fd)
+
+    # ru_maxrss is in KiB on Linux
+    return {
+        "phase": name,
+        "seconds": elapsed,
+        "files": files,
+        "bytes": size,
+        "files_per_second": files / elapsed,
+        "mb_per_second": size / elapsed / 1024 / 1024,
+        "requests": requests,
+        "peak_rss_mb": rusage.ru_maxrss / 1024.0,
+    }
+
+
+def report(results):
+    """Print a table of the results of each phase."""
+
+    print "%-9s %8s %8s %8s %7s %6s %6s %6s %6s %8s %8s" % ("Phase",
+            "Seconds", "Files/s", "MB/s", "RSS MB", "List", "Get", "Put",
+            "Delete", "MB Up", "MB Down")
+    for i in results:
+        r = i["requests"]
+        print "%-9s %8.2f %8.1f %8.2f %7.1f %6d %6d %6d %6d %8.2f %8.2f" % (
+                i["phase"], i["seconds"], i["files_per_second"],
+                i["mb_per_second"], i["peak_rss_mb"], r.get("list", 0),
+                r.get("get", 0), r.get("put", 0), r.get("delete", 0),
+                r.get("bytes_in", 0) / 1024.0 / 1024,
+                r.get("bytes_out", 0) / 1024.0 / 1024)
+
+
+def main():
+    usage = "%prog [options]"
+    options = [
+        make_option("-n", "--metrics", type="int", default=200,
+            help="Number of whisper files to generate, default 200"),
+        make_option("--schemas", type="string",
+            default="60s:1d,5m:30d;10s:6h,1m:7d,10m:1y",
+            help="Semicolon separated whisper schemas assigned to metrics "
+                 "at random, each a comma separated list of retentions, "
+                 "default %default"),
+        make_option("--fill", type="float", default=0.8,
+            help="Fraction of each archive holding points, default 0.8"),
+        make_option("--change", type="float", default=0.1,
+            help="Fraction of metrics updated between backups, default 0.1"),
+        make_option("--runs", type="int", default=2,
+            help="Number of backups to run, default 2"),
+        make_option("--removed", type="float", default=0.1,
+            help="Fraction of metrics removed before purging them, "
+                 "default 0.1"),
+        make_option("--seed", type="int", default=1,
+            help="Random seed the tree is generated from, default 1"),
+        make_option("--latency", type="float", default=0.02,
+            help="Seconds each request to the simulated store takes, "
+                 "default 0.02"),
+        make_option("--bandwidth", type="string", default="",
+            help="Bytes per second each request to the simulated store "
+                 "moves, with an optional K, M or G suffix.  Unlimited by "
+                 "default"),
+        make_option("--pagesize", type="int", default=1000,
+            help="Keys per listing request of the simulated store, "
+                 "default 1000"),
+        make_option("-o", "--options", type="string", default="",
+            help="Options passed to every whisper-backup command, for "
+                 "example \"-a zst --state-dir /tmp/state\""),
+        make_option("--workdir", type="string", default=None,
+            help="Directory to build the tree and store in, default is a "
+                 "new temporary directory removed afterwards"),
+        make_option("--json", action="store_true", default=False,
+            help="Print the results as JSON, default False"),
+    ]
+    parser = OptionParser(usage=usage, option_list=options)
+    options, args = parser.parse_args()
+
+    workdir = options.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="whisper-backup-benchmark-")
+    elif os.path.exists(os.path.join(workdir, "store")):
+        parser.error("%s already holds a benchmark" % workdir)
+
+    try:
+        tree = os.path.join(workdir, "whisper")
+        restored = os.path.join(workdir, "restored")
+        rng = random.Random(options.seed)
+        schemas = parseSchemas(options.schemas)
+        now = int(time.time())
+
+        paths = [ metricPath(tree, i) for i in range(options.metrics) ]
+        t = time.time()
+        for path in paths:
+            createMetric(rng, path, rng.choice(schemas), options.fill, now)
+        size = treeSize(paths)
+        if not options.json:
+            print "Generated %d metrics, %.1f MB in %.1f seconds" % (
+                    len(paths), size / 1024.0 / 1024, time.time() - t)
+
+        results = []
+        for run in range(options.runs):
+            if run > 0:
+                for path in rng.sample(paths,
+                        int(len(paths) * options.change)):
+                    changeMetric(rng, path, int(time.time()))
+            nextSecond()
+            results.append(runPhase(options, workdir, "backup%d" % (run + 1),
+                    "backup", tree, len(paths), size))
+
+        results.append(runPhase(options, workdir, "list", "list", tree,
+                len(paths), size))
+        results.append(runPhase(options, workdir, "restore", "restore",
+                restored, len(paths), size))
+
+        # Backups of the metrics we remove are purged straight away
+        removed = rng.sample(paths, int(len(paths) * options.removed))
+        size = treeSize(removed)
+        for path in removed:
+            os.unlink(path)
+        results.append(runPhase(options, workdir, "purge", "purge", tree,
+                len(removed), size, ["--purge", "0"]))
+    finally:
+        if options.workdir is None:
+            shutil.rmtree(workdir)
+
+    if options.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
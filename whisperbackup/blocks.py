@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Incremental backups split a whisper file into fixed size blocks.  Each
+# block is compressed and stored once under its SHA1 as
+#
+#     <metric>/blocks/<sha1>.<algorithm>
+#
+# and each backup is a small recipe object, <metric>/<timestamp>.blocks,
+# listing the SHA1 of every block of the file in order.  A backup only
+# uploads the blocks that are not already stored.
+#
+# With deduplication the blocks of every metric share one content
+# addressed chunk store under the storage path instead,
+#
+#     whisper-backup.chunks/<sha1>.<algorithm>
+#
+# so identical files, or identical regions of files, are stored once.
+
+RECIPE_VERSION = "1"
+
+# Name of the shared chunk store under the storage path
+CHUNKS_NAME = "whisper-backup.chunks"
+
+def blockPrefix(storage_path, k, shared):
+    """Return the prefix that blocks of metric key k are stored under."""
+    if shared:
+        return storage_path + CHUNKS_NAME
+    return k + "/blocks"
+
+
+def blockKey(prefix, sha, algorithm):
+    """Return the store key of the block with SHA1 sha under prefix."""
+    return "%s/%s.%s" % (prefix, sha, algorithm)
+
+
+def blockSHA(key):
+    """Return the SHA1 of the block stored at key, or None if key is not
+       a block."""
+    n = key.rfind("/")
+    if not (key[:n].endswith("/blocks") or key[:n].endswith(CHUNKS_NAME)):
+        return None
+    name = key[n+1:]
+    if "." not in name:
+        return None
+    return name[:name.find(".")]
+
+
+def makeRecipe(algorithm, blockSize, size, shas, shared=False):
+    """Return the recipe of a file of size bytes made of the blocks of
+       blockSize bytes, compressed with algorithm, with SHA1s shas.  Set
+       shared if the blocks are in the shared chunk store."""
+
+    lines = ["whisper-backup-blocks\t%s" % RECIPE_VERSION,
+             "%s\t%d\t%d" % (algorithm, blockSize, size)]
+    if shared:
+        lines[1] = lines[1] + "\tshared"
+    lines.extend(shas)
+    return "\n".join(lines) + "\n"
+
+
+def parseRecipe(data):
+    """Return the (algorithm, blockSize, size, shas, shared) tuple from the
+       recipe in the string data.  Raises ValueError if it is not a
+       recipe."""
+
+    lines = data.rstrip("\n").split("\n")
+    header = lines[0].split("\t")
+    if header[0] != "whisper-backup-blocks" or header[1:] != [RECIPE_VERSION]:
+        raise ValueError("Unknown block recipe format")
+    fields = lines[1].split("\t")
+    algorithm, blockSize, size = fields[:3]
+    shared = fields[3:] == ["shared"]
+    return algorithm, int(blockSize), int(size), lines[2:], shared
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# A bundle packs the compressed backups of many metrics into one object
+# under the storage path,
+#
+#     whisper-backup.bundles/<name>.bundle
+#
+# Members are simply concatenated, each is the same compressed file a
+# normal backup would store.  After them comes a text index, one line per
+# member: metric key, timestamp, SHA1, algorithm, offset and length.  The
+# object ends with a fixed size trailer holding the length of the index
+# and a magic string, so the index can be found with a ranged GET of the
+# tail of the object and any member fetched with another.
+
+import __main__
+import calendar
+import logging
+import os
+import struct
+import tempfile
+import time
+import uuid
+
+from stream import copyFile
+
+logger = logging.getLogger(__main__.__name__)
+
+BUNDLES_NAME = "whisper-backup.bundles"
+BUNDLE_VERSION = "1"
+TRAILER_FORMAT = "!Q8s"
+TRAILER_MAGIC = "WBBUNDLE"
+
+# How much of the end of a bundle we fetch hoping to get the whole index
+TAIL_SIZE = 64 * 1024
+
+class BundleWriter(object):
+    """Build a bundle in an anonymous temp file in the directory scratch."""
+
+    def __init__(self, key, scratch=None):
+        self.key = key
+        self.fh = tempfile.TemporaryFile(prefix="whisper-backup", dir=scratch)
+        self.members = []
+        self.size = 0
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, k, timestamp, sha, algorithm, path):
+        """Append the compressed backup in the file at path as the backup of
+           metric key k at timestamp.  Returns its location."""
+
+        with open(path, "rb") as src:
+            length = os.fstat(src.fileno()).st_size
+            self.fh.flush()
+            copyFile(src.fileno(), self.fh.fileno(), length)
+            self.fh.seek(0, os.SEEK_END)
+
+        self.members.append((k, timestamp, sha, algorithm, self.size, length))
+        self.size += length
+        return makeLocation(self.key, self.size - length, length)
+
+    def finish(self):
+        """Write the index and trailer and return the bundle as a file
+           object positioned at its start."""
+
+        index = ["whisper-backup-bundle\t%s\n" % BUNDLE_VERSION]
+        for i in self.members:
+            index.append("%s\t%s\t%s\t%s\t%d\t%d\n" % i)
+        index = "".join(index)
+
+        self.fh.seek(0, os.SEEK_END)
+        self.fh.write(index)
+        self.fh.write(struct.pack(TRAILER_FORMAT, len(index), TRAILER_MAGIC))
+        self.fh.flush()
+        self.fh.seek(0)
+        return self.fh
+
+    def close(self):
+        self.fh.close()
+
+
+def bundleKey(prefix):
+    """Return a new, unique, key for a bundle under the storage path
+       prefix."""
+    return "%s%s/%s-%s.bundle" % (prefix, BUNDLES_NAME,
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime()), uuid.uuid4().hex)
+
+
+def bundleTime(key):
+    """Return the time, in seconds since the epoch, the bundle at key was
+       started or None if its name does not say."""
+    name = key.rsplit("/", 1)[-1].split("-", 1)[0]
+    try:
+        return calendar.timegm(time.strptime(name, "%Y%m%dT%H%M%S"))
+    except ValueError:
+        return None
+
+
+def makeLocation(key, offset, length):
+    """Return the location string of a bundle member."""
+    return "%s:%d:%d" % (key, offset, length)
+
+
+def parseLocation(location):
+    """Return the (bundle key, offset, length) of a location string."""
+    key, offset, length = location.rsplit(":", 2)
+    return key, int(offset), int(length)
+
+
+def readIndex(store, key, size):
+    """Return a list of (metric key, timestamp, sha1, algorithm, offset,
+       length) tuples describing the members of the bundle at key, which
+       is size bytes long.  Raises ValueError if it is not a bundle."""
+
+    trailer = struct.calcsize(TRAILER_FORMAT)
+    tail = store.getRange(key, max(0, size - TAIL_SIZE), min(size, TAIL_SIZE))
+    if tail is None or len(tail) < trailer:
+        raise ValueError("Bundle %s is truncated" % key)
+    length, magic = struct.unpack(TRAILER_FORMAT, tail[-trailer:])
+    if magic != TRAILER_MAGIC:
+        raise ValueError("%s is not a bundle" % key)
+    if length + trailer > len(tail):
+        # A large index, fetch all of it
+        tail = store.getRange(key, size - trailer - length, length + trailer)
+
+    lines = tail[-trailer-length:-trailer].rstrip("\n").split("\n")
+    if lines[0] != "whisper-backup-bundle\t%s" % BUNDLE_VERSION:
+        raise ValueError("Unknown bundle format in %s" % key)
+
+    members = []
+    for line in lines[1:]:
+        k, ts, sha, algorithm, offset, length = line.split("\t")
+        members.append((k, ts, sha, algorithm, int(offset), int(length)))
+    return members
+
+
+def listBundles(store, prefix):
+    """Yield (bundle key, members) for each bundle under the storage path
+       prefix, where members is as returned by readIndex()."""
+
+    for key, size in store.listSizes(prefix=prefix + BUNDLES_NAME + "/"):
+        if not key.endswith(".bundle"):
+            continue
+        try:
+            yield key, readIndex(store, key, size)
+        except ValueError as e:
+            logger.warning("Skipping bad bundle: %s" % str(e))
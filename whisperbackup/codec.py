@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Picking a compression codec per whisper file.  A few slices spread over
+# the file are compressed with each candidate codec, timing each, and we
+# pick the one that should get the whole file into the store soonest:
+# the time to compress it plus the time to upload what that leaves at the
+# bandwidth we have.  A slow link favors the codec that compresses best,
+# a fast one the codec that compresses fastest.
+
+import time
+
+# We sample this many slices of this size from each whisper file, files
+# no larger than all of them together are sampled whole
+SAMPLE_SLICES = 4
+SLICE_SIZE = 16 * 1024
+
+# Uploads smaller than this are mostly request latency and tell us
+# nothing about bandwidth
+MIN_MEASURE_SIZE = 256 * 1024
+
+# How quickly the measured bandwidth follows new uploads
+BANDWIDTH_WEIGHT = 0.2
+
+def sampleData(src, size):
+    """Return a sample of the whisper file of size bytes in src, a string
+       or a file object, as a string."""
+
+    if size <= SAMPLE_SLICES * SLICE_SIZE:
+        offsets = [0]
+        length = size
+    else:
+        step = (size - SLICE_SIZE) / (SAMPLE_SLICES - 1)
+        offsets = [ i * step for i in range(SAMPLE_SLICES) ]
+        length = SLICE_SIZE
+
+    if isinstance(src, str):
+        return "".join([ src[i:i+length] for i in offsets ])
+
+    sample = []
+    for i in offsets:
+        src.seek(i)
+        sample.append(src.read(length))
+    src.seek(0)
+    return "".join(sample)
+
+
+def chooseCodec(sample, size, candidates, bandwidth, compress):
+    """Return the (algorithm, level) tuple from candidates that should
+       compress and upload size bytes like sample soonest at bandwidth bytes
+       per second.  compress(data, algorithm, level) returns data
+       compressed."""
+
+    best = None
+    for algorithm, level in candidates:
+        t = time.time()
+        n = len(compress(sample, algorithm, level))
+        elapsed = max(time.time() - t, 1e-6)
+        scale = float(size) / max(len(sample), 1)
+        cost = elapsed * scale + n * scale / bandwidth
+        if best is None or cost < best[0]:
+            best = (cost, algorithm, level)
+
+    return best[1], best[2]
+
+
+def measureBandwidth(bandwidth, size, elapsed):
+    """Return our estimate of bandwidth, in bytes per second, updated with
+       an upload of size bytes that took elapsed seconds."""
+
+    if size < MIN_MEASURE_SIZE or elapsed <= 0:
+        return bandwidth
+    return (1 - BANDWIDTH_WEIGHT) * bandwidth + BANDWIDTH_WEIGHT * size / elapsed
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Zstandard dictionaries trained on our whisper files live in the store
+# under the storage path,
+#
+#     whisper-backup.dicts/<dictionary id>.zdict
+#     whisper-backup.dicts/current
+#
+# where current holds the ID of the dictionary new backups use.  Every zst
+# frame records the ID of the dictionary it was compressed with, so a
+# restore finds the dictionary it needs from the backup itself.
+# Dictionaries are never deleted as old backups may still need them.
+
+import __main__
+import logging
+import random
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__main__.__name__)
+
+DICTS_NAME = "whisper-backup.dicts"
+
+# Size of the dictionaries we train, the zstd default
+DICT_SIZE = 112640
+
+# Whisper files are cut into samples of this size for training
+SAMPLE_SIZE = 128 * 1024
+
+# Only this much of each whisper file is sampled, which covers the header
+# and a good run of points
+FILE_SAMPLE_SIZE = 1024 * 1024
+
+def dictKey(prefix, dictID):
+    """Return the store key of the dictionary dictID."""
+    return "%s%s/%d.zdict" % (prefix, DICTS_NAME, dictID)
+
+
+def trainDictionary(paths, count, threads=0):
+    """Return a zstandard.ZstdCompressionDict trained on count of the
+       whisper files at paths chosen at random."""
+
+    t = time.time()
+    paths = random.sample(paths, min(count, len(paths)))
+    samples = []
+    for path in paths:
+        with open(path, "rb") as fh:
+            for n in range(FILE_SAMPLE_SIZE / SAMPLE_SIZE):
+                sample = fh.read(SAMPLE_SIZE)
+                if not sample:
+                    break
+                samples.append(sample)
+
+    d = zstandard.train_dictionary(DICT_SIZE, samples, threads=threads)
+    logger.info("Trained zstd dictionary %d on %d whisper files in %d seconds"
+            % (d.dict_id(), len(paths), time.time() - t))
+    return d
+
+
+def storeDictionary(store, prefix, d):
+    """Upload the dictionary d and make it the current one."""
+    store.put(dictKey(prefix, d.dict_id()), d.as_bytes())
+    store.put("%s%s/current" % (prefix, DICTS_NAME), "%d" % d.dict_id())
+
+
+def currentDictionary(store, prefix):
+    """Return the current dictionary in the store or None."""
+    dictID = store.get("%s%s/current" % (prefix, DICTS_NAME))
+    if dictID is None:
+        return None
+    return fetchDictionary(store, prefix, int(dictID))
+
+
+def fetchDictionary(store, prefix, dictID):
+    """Return the dictionary dictID from the store or None."""
+    data = store.get(dictKey(prefix, dictID))
+    if data is None:
+        return None
+    return zstandard.ZstdCompressionDict(data)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# The checksums of whole whisper files.  Each backup's ".sha1" object, the
+# canary every listing looks for, holds the checksum of the whisper file.
+# A plain SHA1 is stored as 40 hex digits, as it always has been, and any
+# other digest as "<name>:<hex digits>" so we always know how to verify a
+# backup, whatever digest the run that made it used.
+
+import hashlib
+
+try:
+    import pyblake2
+except ImportError:
+    pyblake2 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+def available():
+    """Return the names of the digests we can compute."""
+    names = ["sha1"]
+    if hasattr(hashlib, "blake2b") or pyblake2 is not None:
+        names.append("blake2b")
+    if xxhash is not None:
+        names.append("xxh64")
+        if hasattr(xxhash, "xxh3_64"):
+            names.append("xxh3")
+    return names
+
+
+def newDigest(name):
+    """Return a new hash object, with update() and hexdigest(), of the
+       digest name."""
+
+    if name == "sha1":
+        return hashlib.sha1()
+    elif name == "blake2b":
+        if hasattr(hashlib, "blake2b"):
+            return hashlib.blake2b(digest_size=32)
+        return pyblake2.blake2b(digest_size=32)
+    elif name == "xxh64":
+        return xxhash.xxh64()
+    elif name == "xxh3":
+        return xxhash.xxh3_64()
+    else:
+        raise StandardError("Unknown digest requested: %s" % name)
+
+
+def formatDigest(name, hexdigest):
+    """Return the checksum we store for hexdigest computed with name."""
+    if name == "sha1":
+        return hexdigest
+    return "%s:%s" % (name, hexdigest)
+
+
+def parseDigest(checksum):
+    """Return the (name, hexdigest) tuple of a stored checksum."""
+    if ":" in checksum:
+        return tuple(checksum.split(":", 1))
+    return "sha1", checksum
+
+
+def digestChunks(chunks, names):
+    """Return a dict of each digest in names to the checksum of the data
+       in the iterator of strings chunks, all computed in one pass."""
+
+    digests = dict([ (i, newDigest(i)) for i in names ])
+    for chunk in chunks:
+        for d in digests.values():
+            d.update(chunk)
+    return dict([ (i, formatDigest(i, d.hexdigest()))
+                  for i, d in digests.items() ])
+
+
+def verifyDigest(data, checksum):
+    """Return True if the string data has the stored checksum."""
+    name, hexdigest = parseDigest(checksum)
+    if name not in available():
+        raise StandardError("Digest %s of this backup is not available"
+                % name)
+    d = newDigest(name)
+    d.update(data)
+    return d.hexdigest() == hexdigest
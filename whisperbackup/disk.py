@@ -16,12 +16,17 @@
 #   limitations under the License.
 
 import __main__
-import glob
+import errno
 import logging
 import os
 
+from multiprocessing.pool import ThreadPool
+
 logger = logging.getLogger(__main__.__name__)
 
+# Number of threads to unlink files with in deleteMany()
+DELETE_THREADS = 8
+
 class Disk(object):
 
     def __init__(self, bucket, noop=False):
@@ -29,20 +34,41 @@ class Disk(object):
         self.bucket = bucket
         self.noop = noop
 
-    def list(self, prefix="*/"):
-        """ Return all keys in this bucket."""
+    def list(self, prefix=""):
+        """ Return all keys in this bucket that begin with prefix."""
+
+        # Keys may carry a leading slash which put() folds into the path,
+        # hand it back so keys round trip like they do in S3
+        lead = ""
+        if prefix.startswith("/"):
+            lead = "/"
+            prefix = prefix.lstrip("/")
 
-        list_rep = glob.glob(self.bucket + "/" + prefix + "/*")
-        for i in list_rep:
-            # Remove preceding bucket name and potential leading slash from returned key value
-            i =  i.replace(self.bucket, "")
-            if i[0] == '/': i = i[1:]
-            yield i
+        # Only walk the part of the tree the prefix can match
+        root = os.path.join(self.bucket, os.path.dirname(prefix))
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for f in sorted(filenames):
+                # Remove preceding bucket name from returned key value
+                i = os.path.relpath(os.path.join(dirpath, f), self.bucket)
+                if i.startswith(prefix):
+                    yield lead + i
+
+    def listSizes(self, prefix=""):
+        """Return (key, size in bytes) tuples of all keys in this bucket
+           that begin with prefix."""
+
+        for i in self.list(prefix):
+            try:
+                yield i, os.path.getsize(self.bucket + "/" + i)
+            except OSError:
+                # Removed while we walked the tree
+                continue
 
     def get(self, src):
         """Return the contents of src from disk as a string."""
 
-        if not os.path.exists(os.path.dirname(self.bucket + "/" + src)):
+        if not os.path.exists(self.bucket + "/" + src):
             return None
         k = ""
         try:
@@ -52,6 +78,15 @@ class Disk(object):
             logger.warning("Exception during get: %s" % str(e))
         return k
 
+    def getRange(self, src, offset, length):
+        """Return length bytes of src starting at offset as a string."""
+
+        if not os.path.exists(self.bucket + "/" + src):
+            return None
+        with open(self.bucket + "/" + src, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
     def put(self, dst, data):
         """Store the contents of the string data at a key named by dst
            on disk."""
@@ -69,6 +104,20 @@ class Disk(object):
                 logger.warning("Exception during put: %s" % str(e))
 
 
+    def putStream(self, dst, chunks):
+        """Store the data from the iterator of strings chunks at a key named
+           by dst on disk, writing it as it arrives."""
+
+        if self.noop:
+            logger.info("No-Op Put: %s" % dst)
+        else:
+            filename = self.bucket + "/" + dst
+            if not os.path.exists(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+
     def delete(self, src):
         """Delete the object on disk referenced by the key name src."""
 
@@ -77,3 +126,30 @@ class Disk(object):
         else:
             logger.info("Trying to delete %s" % self.bucket + "/" + src)
             os.remove(self.bucket + "/" + src)
+
+    def deleteMany(self, keys):
+        """Delete the objects on disk referenced by the key names in keys,
+           several at once.  Returns the keys that could not be deleted.
+           Keys that do not exist are not an error."""
+
+        if self.noop:
+            for i in keys:
+                logger.info("No-Op Delete: %s/%s" % (self.bucket, i))
+            return []
+
+        def unlink(src):
+            try:
+                os.remove(self.bucket + "/" + src)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return None
+                logger.warning("Exception during delete of %s: %s"
+                        % (src, str(e)))
+                return src
+
+        workers = ThreadPool(DELETE_THREADS)
+        try:
+            return [ i for i in workers.map(unlink, keys) if i is not None ]
+        finally:
+            workers.close()
+            workers.join()
@@ -23,10 +23,21 @@ try:
 except ImportError:
     HAS_OPERATOR = False
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import itertools
+import struct
 import time
 import sys
 
+# whisper's on disk layout, see whisper.py
+METADATA_FORMAT = '!2LfL'
+ARCHIVE_INFO_FORMAT = '!3L'
+POINT_FORMAT = '!Ld'
+
 def itemgetter(*items):
     if HAS_OPERATOR:
         return operator.itemgetter(*items)
@@ -43,16 +54,88 @@ def itemgetter(*items):
         return g
 
 
-def fill(src, dst, tstart, tstop):
+class HealContext(object):
+    # a whisper file read into memory once, its header parsed and its
+    # archives decoded on first use, that then serves every fill() of one
+    # heal.  src may be a path or a file object holding a whisper image,
+    # such as a backup that was just downloaded, so it needn't be on disk.
+
+    def __init__(self, src):
+        if hasattr(src, 'read'):
+            src.seek(0)
+            self.data = src.read()
+        else:
+            with open(src, 'rb') as fh:
+                self.data = fh.read()
+
+        self.header = self.read_header()
+        self.archives = sorted(self.header['archives'],
+                               key=itemgetter('retention'))
+        self.now = int(time.time())
+        self.cache = {}
+
+    def read_header(self):
+        # the same as whisper's info() but from self.data
+        (aggregationType, maxRetention, xff, archiveCount) = \
+            struct.unpack_from(METADATA_FORMAT, self.data)
+        offset = struct.calcsize(METADATA_FORMAT)
+        archives = []
+        for i in xrange(archiveCount):
+            (archiveOffset, secondsPerPoint, points) = \
+                struct.unpack_from(ARCHIVE_INFO_FORMAT, self.data, offset)
+            archives.append({
+                'offset': archiveOffset,
+                'secondsPerPoint': secondsPerPoint,
+                'points': points,
+                'retention': secondsPerPoint * points,
+                'size': points * struct.calcsize(POINT_FORMAT),
+            })
+            offset += struct.calcsize(ARCHIVE_INFO_FORMAT)
+
+        return {
+            'aggregationType': aggregationType,
+            'maxRetention': maxRetention,
+            'xFilesFactor': xff,
+            'archives': archives,
+        }
+
+    def fetch(self, archive, fromTime, untilTime):
+        # like whisper's fetch() of fromTime to untilTime, but sliced from
+        # a single decode of the whole of archive
+        if archive['offset'] not in self.cache:
+            step = archive['secondsPerPoint']
+            series = struct.unpack_from('!' + POINT_FORMAT[1:] * archive['points'],
+                                        self.data, archive['offset'])
+            # whisper only trusts a slot holding the timestamp it expects,
+            # so a lookup by timestamp skips stale points for us
+            points = dict(itertools.izip(series[0::2], series[1::2]))
+            oldest = self.now - archive['retention']
+            start = int(oldest - (oldest % step)) + step
+            end = int(self.now - (self.now % step)) + step
+            self.cache[archive['offset']] = ((start, end, step),
+                    [points.get(t) for t in xrange(start, end, step)])
+        (start, end, step), values = self.cache[archive['offset']]
+
+        fromInterval = int(fromTime - (fromTime % step)) + step
+        untilInterval = int(untilTime - (untilTime % step)) + step
+        if fromInterval == untilInterval:
+            # zero-length time range: always include the next point
+            untilInterval += step
+        fromInterval = min(max(fromInterval, start), end)
+        untilInterval = min(max(untilInterval, fromInterval), end)
+        return ((fromInterval, untilInterval, step),
+                values[(fromInterval - start) // step:
+                       (untilInterval - start) // step])
+
+
+def fill(src, dst, tstart, tstop, context=None):
     # fetch range start-stop from src, taking values from the highest
     # precision archive, thus optionally requiring multiple fetch + merges
-    srcHeader = info(src)
-
-    srcArchives = srcHeader['archives']
-    srcArchives.sort(key=itemgetter('retention'))
+    if context is None:
+        context = HealContext(src)
 
     # find oldest point in time, stored by both files
-    srcTime = int(time.time()) - srcHeader['maxRetention']
+    srcTime = context.now - context.header['maxRetention']
 
     if tstart < srcTime and tstop < srcTime:
         return
@@ -61,23 +144,24 @@ def fill(src, dst, tstart, tstop):
     # walk in time
 
     # skip forward at max 'step' points at a time
-    for archive in srcArchives:
+    for archive in context.archives:
         # skip over archives that don't have any data points
-        rtime = time.time() - archive['retention']
+        rtime = context.now - archive['retention']
         if tstop <= rtime:
             continue
 
         untilTime = tstop
         fromTime = rtime if rtime > tstart else tstart
 
-        (timeInfo, values) = fetch(src, fromTime, untilTime)
+        (timeInfo, values) = context.fetch(archive, fromTime, untilTime)
         (start, end, archive_step) = timeInfo
         pointsToWrite = list(itertools.ifilter(
             lambda points: points[1] is not None,
             itertools.izip(xrange(start, end, archive_step), values)))
         # order points by timestamp, newest first
         pointsToWrite.sort(key=lambda p: p[0], reverse=True)
-        update_many(dst, pointsToWrite)
+        if pointsToWrite:
+            update_many(dst, pointsToWrite)
 
         tstop = fromTime
 
@@ -86,7 +170,58 @@ def fill(src, dst, tstart, tstop):
             return
 
 
+def find_gaps(values, start, step, secondsPerPoint):
+    # the (tstart, tstop) ranges fill_archives() calls fill() with for
+    # the values of a fetch() starting at start, found with array
+    # operations rather than a loop over every point.  Like that loop any
+    # false value, None or 0, is missing, and runs of a single missing
+    # point are left alone unless the run ends the range.
+    missing = numpy.array(values, dtype=numpy.float64)
+    missing = numpy.isnan(missing) | (missing == 0)
+    edges = numpy.diff(numpy.concatenate(([0], missing.astype(numpy.int8),
+                                          [0])))
+    last = len(values) - 1
+    gaps = []
+    for a, b in zip(numpy.flatnonzero(edges == 1).tolist(),
+                    (numpy.flatnonzero(edges == -1) - 1).tolist()):
+        if b < last:
+            if step * (b + 1 - a) > secondsPerPoint:
+                gaps.append((start + step * (a - 1), start + step * (b + 1)))
+        elif a < last:
+            gaps.append((start + step * (a - 1), start + step * b))
+    return gaps
+
+
+def fill_archives_numpy(src, dst, startFrom):
+    # the same as fill_archives(), but finding the gaps of each dst
+    # archive with array operations.  The gaps are filled by fill(), as
+    # it is the order of its update_many() calls that decides which src
+    # point lands in a dst slot, so both engines write the same points.
+    context = HealContext(src)
+    header = info(dst)
+    archives = header['archives']
+    archives = sorted(archives, key=lambda t: t['retention'])
+
+    for archive in archives:
+        fromTime = time.time() - archive['retention']
+        if fromTime >= startFrom:
+            continue
+
+        (timeInfo, values) = fetch(dst, fromTime, startFrom)
+        (start, end, step) = timeInfo
+        for tstart, tstop in find_gaps(values, start, step,
+                                       archive['secondsPerPoint']):
+            fill(src, dst, tstart, tstop, context)
+
+        startFrom = fromTime
+
+
 def fill_archives(src, dst, startFrom):
+    if numpy is not None:
+        return fill_archives_numpy(src, dst, startFrom)
+
+    # every gap is filled from the same source, parse and fetch it once
+    context = HealContext(src)
     header = info(dst)
     archives = header['archives']
     archives = sorted(archives, key=lambda t: t['retention'])
@@ -105,10 +240,10 @@ def fill_archives(src, dst, startFrom):
             elif v and gapstart:
                 # ignore single units lost
                 if (start - gapstart) > archive['secondsPerPoint']:
-                    fill(src, dst, gapstart - step, start)
+                    fill(src, dst, gapstart - step, start, context)
                 gapstart = None
             elif gapstart and start == end - step:
-                fill(src, dst, gapstart - step, start)
+                fill(src, dst, gapstart - step, start, context)
 
             start += step
 
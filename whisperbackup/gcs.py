@@ -16,24 +16,41 @@
 #   limitations under the License.
 
 import __main__
+import itertools
 import logging
+import threading
 
 from google.cloud import storage
+from google.cloud.exceptions import NotFound
+
+from stream import regroupChunks, uploadParts
 
 logger = logging.getLogger(__main__.__name__)
 
+# A single compose request takes at most this many source objects
+MAX_COMPOSE = 32
+
+# A batch request takes at most this many calls
+MAX_BATCH = 100
+
 # Google Cloud Storage
 class GCS(object):
 
-    def __init__(self, bucket, project="", region="us", noop=False):
+    def __init__(self, bucket, project="", region="us", noop=False,
+                 partsize=8 * 1024 * 1024, parts=4, threshold=None):
         """Setup the GCS storage backend with the bucket we will use and
-           optional region."""
-        if project == "":
-            self.client = storage.Client()
-        else:
-            self.client = storage.Client(project)
+           optional region.  Objects larger than threshold bytes, which
+           defaults to partsize, are uploaded as partsize byte temporary
+           objects, up to parts at once, and composed into the final
+           object."""
+        self.project = project
+        self.client = self._client()
 
         self.noop = noop
+        self.partsize = partsize
+        self.parts = max(parts, 1)
+        self.threshold = partsize if threshold is None else threshold
+        self.local = threading.local()
 
         self.bucket = storage.Bucket(self.client, bucket)
         self.bucket.location = region
@@ -51,6 +68,11 @@ class GCS(object):
         for i in self.client.list_blobs(self.bucket, prefix=prefix):
             yield i.name
 
+    def listSizes(self, prefix=""):
+        """Return (key, size in bytes) tuples of all keys in this bucket."""
+        for i in self.client.list_blobs(self.bucket, prefix=prefix):
+            yield i.name, i.size
+
     def get(self, src):
         """Return the contents of src from this bucket as a string."""
         obj = storage.blob.Blob(src, self.bucket)
@@ -59,22 +81,145 @@ class GCS(object):
 
         return obj.download_as_string()
 
+    def getRange(self, src, offset, length):
+        """Return length bytes of src starting at offset as a string, using
+           a ranged GET."""
+        obj = storage.blob.Blob(src, self.bucket)
+        try:
+            return obj.download_as_string(start=offset,
+                                          end=offset + length - 1)
+        except NotFound:
+            return None
+
     def put(self, dst, data):
         """Store the contents of the string data at a key named by dst
            in GCS."""
 
         if self.noop:
             logger.info("No-Op Put: %s" % dst)
+        elif len(data) > self.threshold:
+            self._composite(dst, regroupChunks([data], self.partsize))
         else:
             obj = storage.blob.Blob(dst, self.bucket)
             obj.upload_from_string(data, content_type="application/octet-stream")
 
+    def putStream(self, dst, chunks):
+        """Store the data from the iterator of strings chunks at a key named
+           by dst in GCS.  Data larger than our threshold is uploaded as
+           several parts concurrently and composed into one object."""
+
+        if self.noop:
+            logger.info("No-Op Put: %s" % dst)
+            return
+
+        # Buffer up to the threshold to see if we need a composite upload
+        parts = regroupChunks(chunks, self.partsize)
+        head = []
+        size = 0
+        for i in parts:
+            head.append(i)
+            size += len(i)
+            if size > self.threshold:
+                break
+
+        if size <= self.threshold:
+            obj = storage.blob.Blob(dst, self.bucket)
+            obj.upload_from_string("".join(head),
+                    content_type="application/octet-stream")
+        else:
+            self._composite(dst, itertools.chain(head, parts))
+
+    def _client(self):
+        if self.project == "":
+            return storage.Client()
+        return storage.Client(self.project)
+
+    def _localBucket(self):
+        """Return our bucket bound to a client of the calling thread's
+           own.  Clients aren't thread safe, and a batch is collected on
+           the client, so each thread gets its own."""
+        if getattr(self.local, "client", None) is None:
+            self.local.client = self._client()
+        return self.local.client.bucket(self.bucket.name)
+
+    def _composite(self, dst, parts):
+        """Upload the iterator of strings parts as temporary objects, several
+           at once, then compose them into dst and remove the parts."""
+
+        names = {}
+        temps = []
+
+        def upload(n, data):
+            bucket = self._localBucket()
+            name = "%s.part-%05d" % (dst, n)
+            storage.blob.Blob(name, bucket).upload_from_string(data,
+                    content_type="application/octet-stream")
+            names[n] = name
+
+        try:
+            n = uploadParts(upload, parts, self.parts)
+            sources = [ self.bucket.blob(names[i]) for i in range(1, n+1) ]
+            # Compose is limited in sources, so build a tree if needed
+            while len(sources) > MAX_COMPOSE:
+                level = []
+                for i in range(0, len(sources), MAX_COMPOSE):
+                    obj = self.bucket.blob("%s.part-c%05d" % (dst, len(temps)))
+                    obj.compose(sources[i:i+MAX_COMPOSE])
+                    temps.append(obj)
+                    level.append(obj)
+                sources = level
+            obj = storage.blob.Blob(dst, self.bucket)
+            obj.content_type = "application/octet-stream"
+            obj.compose(sources)
+            logger.debug("Composite upload of %s in %d parts" % (dst, n))
+        finally:
+            parts = [ self.bucket.blob(i) for i in names.values() ] + temps
+            for i in parts:
+                try:
+                    i.delete()
+                except Exception as e:
+                    logger.warning("Could not remove part %s: %s"
+                            % (i.name, str(e)))
+
     def delete(self, src):
         """Delete the object in GCP referenced by the key name src."""
 
         if self.noop:
             logger.info("No-Op Delete: %s" % src)
         else:
-            obj = storage.blob.Blob(dst, self.bucket)
+            obj = storage.blob.Blob(src, self.bucket)
             obj.delete()
 
+    def deleteMany(self, keys):
+        """Delete the objects in GCS referenced by the key names in keys using
+           batch requests.  Returns the keys that could not be deleted."""
+
+        if self.noop:
+            for i in keys:
+                logger.info("No-Op Delete: %s" % i)
+            return []
+
+        failed = []
+        bucket = self._localBucket()
+        for n in range(0, len(keys), MAX_BATCH):
+            batch = keys[n:n+MAX_BATCH]
+            try:
+                with bucket.client.batch():
+                    for i in batch:
+                        bucket.delete_blob(i)
+            except Exception:
+                # The public batch API only reports the last error, not
+                # which deletes failed, so retry them one at a time.  A
+                # key already gone is as good as deleted.
+                for i in batch:
+                    try:
+                        bucket.delete_blob(i)
+                    except NotFound:
+                        pass
+                    except Exception as e:
+                        logger.warning("Exception during delete of %s: %s"
+                                % (i, str(e)))
+                        failed.append(i)
+
+        return failed
+
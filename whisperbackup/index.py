@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import __main__
+import gzip
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+
+from fnmatch import fnmatch
+from StringIO import StringIO
+
+from bundle import listBundles, makeLocation, parseLocation
+
+logger = logging.getLogger(__main__.__name__)
+
+INDEX_NAME = "whisper-backup.index.gz"
+INDEX_VERSION = "3"
+
+class Index(object):
+    """A single compressed object in the store listing every backup so that
+       we need not list the entire bucket to find them.
+
+       The object is a gzipped text file.  The first line is a header, each
+       following line is tab separated: metric, timestamp, SHA1, compressed
+       size, for backups packed in a bundle its location, and the
+       compression algorithm.  Unknown values are written as "-".  Version
+       1 indexes lack the location and versions 1 and 2 the algorithm.
+       Metric names are relative to the storage path, as returned by
+       search().
+
+       While a backup or purge is modifying the store a small ".dirty"
+       marker object sits beside the index.  The index is still used when
+       the marker is present, it holds every change saved so far.  A run
+       that died before saving leaves the marker behind, the backups it
+       uploaded are only found by a reindex.
+
+       Several hosts may share a storage path, so the changes we make are
+       kept and, when saving, applied to the index as it is in the store
+       then rather than as we loaded it.  This way we do not drop the
+       backups other hosts have recorded in the meantime."""
+
+    def __init__(self, store, prefix, noop=False):
+        self.store = store
+        self.key = prefix + INDEX_NAME
+        self.noop = noop
+        self.metrics = {}
+        self.usable = False
+        # True if we loaded the stored index rather than rebuilding it
+        self.loaded = False
+        # Our adds and removes since the index was loaded or rebuilt
+        self.changes = []
+        # The content of the dirty marker we wrote
+        self.marker = None
+        # The SHA1 of the index object as we last read or wrote it, None
+        # if rebuilt
+        self.digest = None
+
+    def load(self):
+        """Fetch the index from the store.  Returns True if the index exists
+           and is readable, dirty or not."""
+
+        self.metrics = {}
+        self.usable = False
+        self.loaded = False
+        self.changes = []
+        metrics = self.read()
+        if metrics is None:
+            return False
+
+        marker = self.store.get(self.key + ".dirty")
+        if marker is not None:
+            logger.info("Index %s is marked dirty by %s, using it as saved"
+                    % (self.key, marker.strip()))
+
+        self.metrics = metrics
+        self.usable = True
+        self.loaded = True
+        logger.info("Loaded index of %d metrics from store" % len(self.metrics))
+        return True
+
+    def read(self):
+        """Fetch and parse the index in the store, dirty or not.  Returns a
+           dict of metric to its list of backups or None if there is no
+           usable index."""
+
+        data = self.store.get(self.key)
+        if data is None:
+            logger.info("No index found in store at %s" % self.key)
+            return None
+
+        metrics = {}
+        try:
+            fd = gzip.GzipFile(fileobj=StringIO(data), mode="rb")
+            header = fd.readline().rstrip("\n").split("\t")
+            if header[0] != "whisper-backup-index" or \
+                    header[1] not in ("1", "2", INDEX_VERSION):
+                logger.warning("Unknown index format in %s" % self.key)
+                return None
+            for line in fd:
+                fields = line.rstrip("\n").split("\t")
+                m, ts, sha, size = fields[:4]
+                location = fields[4] if len(fields) > 4 else "-"
+                algorithm = fields[5] if len(fields) > 5 else "-"
+                metrics.setdefault(m, []).append(
+                        [ts, None if sha == "-" else sha,
+                         None if size == "-" else int(size),
+                         None if location == "-" else location,
+                         None if algorithm == "-" else algorithm])
+            fd.close()
+        except Exception as e:
+            logger.warning("Corrupt index %s: %s" % (self.key, str(e)))
+            return None
+
+        for v in metrics.values():
+            v.sort()
+        self.digest = hashlib.sha1(data).hexdigest()
+        return metrics
+
+    def rebuild(self, prefix):
+        """Populate the index from a full listing of the store under prefix
+           and the indexes of any bundles.  SHA1s and sizes of backups not
+           in bundles are unknown after a rebuild."""
+
+        logger.info("Rebuilding index from a listing of the store...")
+        self.metrics = {}
+        algorithms = {}
+        for i in self.store.list(prefix=prefix):
+            i = i[len(prefix):]
+            m = i[:i.find("/")]
+            name = i[i.find("/")+1:]
+            # The SHA1 is my canary/flag, we look for it
+            if name.endswith(".sha1"):
+                self.metrics.setdefault(m, []).append(
+                        [name[:-5], None, None, None, None])
+            elif ".wsp." in name:
+                n = name.find(".wsp.")
+                algorithms[(m, name[:n])] = name[n+5:]
+
+        for m, v in self.metrics.items():
+            for i in v:
+                i[4] = algorithms.get((m, i[0]))
+
+        for key, members in listBundles(self.store, prefix):
+            for k, ts, sha, algorithm, offset, length in members:
+                self.add(k[len(prefix):], ts, sha, length,
+                         makeLocation(key, offset, length), algorithm)
+
+        for v in self.metrics.values():
+            v.sort()
+        self.usable = True
+        self.loaded = False
+        self.changes = []
+        self.digest = None
+        logger.info("Index rebuilt with %d metrics" % len(self.metrics))
+
+    def markDirty(self):
+        """Flag the index as untrusted while we modify the store."""
+        if self.noop:
+            logger.info("No-Op: Mark index dirty: %s" % self.key)
+            return
+        self.marker = "%s %s %d %s" % (time.strftime("%Y-%m-%dT%H:%M:%S"),
+                socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        self.store.put(self.key + ".dirty", self.marker)
+
+    def merge(self):
+        """Apply our changes to the index as it is in the store now.  If we
+           loaded the stored index our changes are replayed over the stored
+           one.  If we rebuilt it ours is complete as of the rebuild, so we
+           only add the backups recorded in the store since that we have
+           not removed."""
+
+        current = self.read()
+        if current is None:
+            return
+
+        changes = self.changes
+        if self.loaded:
+            self.metrics = current
+            self.changes = []
+            for i in changes:
+                if i[0] == "add":
+                    self.add(*i[1:])
+                else:
+                    self.remove(*i[1:])
+            self.changes = changes
+            return
+
+        known = set([ (m, i[0]) for m, v in self.metrics.items() for i in v ])
+        known.update([ i[1:] for i in changes if i[0] == "remove" ])
+        for m, v in current.items():
+            for i in v:
+                if (m, i[0]) not in known:
+                    self.metrics.setdefault(m, []).append(i)
+        for v in self.metrics.values():
+            v.sort()
+
+    def save(self, merge=True):
+        """Upload the index and clear our dirty marker.  Unless merge is
+           False our changes are first merged into the index as stored, see
+           merge().  A dirty marker another writer has replaced ours with
+           is left for it to clear."""
+
+        if self.noop:
+            logger.info("No-Op: Save index: %s" % self.key)
+            return
+
+        t = time.time()
+        if merge:
+            self.merge()
+        buf = StringIO()
+        fd = gzip.GzipFile(fileobj=buf, mode="wb")
+        fd.write("whisper-backup-index\t%s\n" % INDEX_VERSION)
+        for m in sorted(self.metrics.keys()):
+            for ts, sha, size, location, algorithm in self.metrics[m]:
+                fd.write("%s\t%s\t%s\t%s\t%s\t%s\n" % (m, ts,
+                    "-" if sha is None else sha,
+                    "-" if size is None else size,
+                    "-" if location is None else location,
+                    "-" if algorithm is None else algorithm))
+        fd.close()
+
+        self.store.put(self.key, buf.getvalue())
+        self.digest = hashlib.sha1(buf.getvalue()).hexdigest()
+        marker = self.store.get(self.key + ".dirty")
+        if marker is not None and marker == self.marker:
+            self.store.delete(self.key + ".dirty")
+        elif marker is not None:
+            logger.info("Index %s is marked dirty by another writer, " \
+                        "leaving the marker" % self.key)
+        logger.info("Saved index of %d metrics (%d bytes) in %d seconds"
+                % (len(self.metrics), len(buf.getvalue()), time.time() - t))
+
+    def add(self, metric, timestamp, sha1=None, size=None, location=None,
+            algorithm=None):
+        """Record a backup of metric at timestamp.  For a backup already
+           recorded, fill in whichever of sha1, size, location and
+           algorithm are given."""
+        self.changes.append(("add", metric, timestamp, sha1, size, location,
+                             algorithm))
+        v = self.metrics.setdefault(metric, [])
+        for i in v:
+            if i[0] == timestamp:
+                if sha1 is not None:
+                    i[1] = sha1
+                if size is not None:
+                    i[2] = size
+                if location is not None:
+                    i[3] = location
+                if algorithm is not None:
+                    i[4] = algorithm
+                return
+        v.append([timestamp, sha1, size, location, algorithm])
+        v.sort()
+
+    def remove(self, metric, timestamp):
+        """Forget the backup of metric at timestamp."""
+        self.changes.append(("remove", metric, timestamp))
+        v = [ i for i in self.metrics.get(metric, []) if i[0] != timestamp ]
+        if len(v) > 0:
+            self.metrics[metric] = v
+        elif metric in self.metrics:
+            del self.metrics[metric]
+
+    def has(self, metric, timestamp):
+        """Return True if we know of a backup of metric at timestamp."""
+        for i in self.metrics.get(metric, []):
+            if i[0] == timestamp:
+                return True
+        return False
+
+    def sha1(self, metric, timestamp):
+        """Return the known SHA1 of metric at timestamp or None."""
+        for i in self.metrics.get(metric, []):
+            if i[0] == timestamp:
+                return i[1]
+        return None
+
+    def size(self, metric, timestamp):
+        """Return the stored size of metric at timestamp or None."""
+        for i in self.metrics.get(metric, []):
+            if i[0] == timestamp:
+                return i[2]
+        return None
+
+    def location(self, metric, timestamp):
+        """Return the bundle location of metric at timestamp or None."""
+        for i in self.metrics.get(metric, []):
+            if i[0] == timestamp:
+                return i[3]
+        return None
+
+    def algorithm(self, metric, timestamp):
+        """Return the compression algorithm of metric at timestamp or None
+           if unknown or an incremental backup."""
+        for i in self.metrics.get(metric, []):
+            if i[0] == timestamp:
+                return i[4]
+        return None
+
+    def bundles(self):
+        """Return the set of bundle keys holding indexed backups."""
+        bundles = set()
+        for v in self.metrics.values():
+            for i in v:
+                if i[3] is not None:
+                    bundles.add(parseLocation(i[3])[0])
+        return bundles
+
+    def search(self, glob):
+        """Return a dict shaped like search() in whisperbackup: metric names
+           matching glob mapped to a list of "metric/timestamp" paths."""
+
+        metrics = {}
+        for m, v in self.metrics.items():
+            if glob == "*" or fnmatch(m, glob):
+                metrics[m] = [ "%s/%s" % (m, i[0]) for i in v ]
+
+        return metrics
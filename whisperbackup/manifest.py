@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import __main__
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from bundle import BUNDLES_NAME, listBundles, makeLocation, parseLocation
+
+logger = logging.getLogger(__main__.__name__)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS backups (
+           metric    TEXT NOT NULL,
+           timestamp TEXT NOT NULL,
+           sha1      TEXT,
+           PRIMARY KEY (metric, timestamp))""",
+    """CREATE TABLE IF NOT EXISTS stats (
+           metric   TEXT PRIMARY KEY,
+           inode    INTEGER,
+           size     INTEGER,
+           mtime_ns INTEGER,
+           ctime_ns INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS recipes (
+           metric    TEXT NOT NULL,
+           timestamp TEXT NOT NULL,
+           recipe    TEXT,
+           PRIMARY KEY (metric, timestamp))""",
+    """CREATE TABLE IF NOT EXISTS bundled (
+           metric    TEXT NOT NULL,
+           timestamp TEXT NOT NULL,
+           location  TEXT,
+           PRIMARY KEY (metric, timestamp))""",
+    """CREATE TABLE IF NOT EXISTS codecs (
+           metric    TEXT PRIMARY KEY,
+           algorithm TEXT,
+           level     INTEGER,
+           checked   INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS meta (
+           key   TEXT PRIMARY KEY,
+           value TEXT)""",
+]
+
+class Manifest(object):
+    """A local SQLite cache of what backups exist in the object store.
+
+       Keys are the full metric keys as used in the store (including any
+       storage path) and each row is one backup timestamp of that metric
+       along with its SHA1, if known.  A SHA1 of None means we know the
+       backup exists but have not fetched its checksum yet.
+
+       Alongside the backups we keep the stat() details of each whisper
+       file as of its last backup so unchanged files need not be read,
+       and a cache of incremental backup recipes, which never change.
+       Backups packed in bundles also have their location recorded, and
+       with --algorithm auto the codec picked for each metric is kept."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        # SQLite handles must not be shared across a fork() or between
+        # threads, so each worker process and I/O thread opens its own
+        # connection on first use.
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=300,
+                                         isolation_level=None)
+            local.conn.text_factory = str
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("PRAGMA synchronous=NORMAL")
+            for i in SCHEMA:
+                local.conn.execute(i)
+            local.pid = os.getpid()
+
+        return local.conn
+
+    def close(self):
+        """Close this thread's connection.  Call before forking workers."""
+        local = self._local
+        if getattr(local, "conn", None) is not None and \
+                local.pid == os.getpid():
+            local.conn.close()
+        local.conn = None
+
+    def getMeta(self, key):
+        c = self._connect().execute("SELECT value FROM meta WHERE key = ?",
+                                    (key,))
+        row = c.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def setMeta(self, key, value):
+        self._connect().execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, value))
+
+    def backups(self, metric):
+        """Return a sorted list of (timestamp, sha1) tuples of the known
+           backups of metric."""
+        c = self._connect().execute(
+                "SELECT timestamp, sha1 FROM backups WHERE metric = ? " \
+                "ORDER BY timestamp", (metric,))
+        return c.fetchall()
+
+    def metrics(self):
+        """Return a list of all metric keys in the manifest."""
+        c = self._connect().execute(
+                "SELECT DISTINCT metric FROM backups ORDER BY metric")
+        return [ i[0] for i in c ]
+
+    def missing(self, index, prefix):
+        """Return the list of metric keys whose latest backup the Index
+           index, of the store under prefix, does not have.  Those backups
+           were removed behind our back."""
+        c = self._connect().execute(
+                "SELECT metric, MAX(timestamp) FROM backups GROUP BY metric")
+        return [ m for m, ts in c.fetchall()
+                 if not index.has(m[len(prefix):], ts) ]
+
+    def add(self, metric, timestamp, sha1, location=None):
+        """Record a backup of metric at timestamp with the given SHA1 and,
+           if packed in a bundle, location."""
+        conn = self._connect()
+        conn.execute(
+                "INSERT OR REPLACE INTO backups (metric, timestamp, sha1) " \
+                "VALUES (?, ?, ?)", (metric, timestamp, sha1))
+        if location is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO bundled (metric, timestamp, location) " \
+                "VALUES (?, ?, ?)", (metric, timestamp, location))
+
+    def bundled(self, metric):
+        """Return a dict of the timestamps of metric's backups packed in
+           bundles to their locations."""
+        c = self._connect().execute(
+                "SELECT timestamp, location FROM bundled WHERE metric = ?",
+                (metric,))
+        return dict(c.fetchall())
+
+    def remove(self, metric, timestamp):
+        """Forget the backup of metric at timestamp."""
+        conn = self._connect()
+        conn.execute(
+                "DELETE FROM backups WHERE metric = ? AND timestamp = ?",
+                (metric, timestamp))
+        conn.execute(
+                "DELETE FROM recipes WHERE metric = ? AND timestamp = ?",
+                (metric, timestamp))
+        conn.execute(
+                "DELETE FROM bundled WHERE metric = ? AND timestamp = ?",
+                (metric, timestamp))
+
+    def recipe(self, metric, timestamp):
+        """Return the cached recipe of the incremental backup of metric at
+           timestamp, or None."""
+        c = self._connect().execute(
+                "SELECT recipe FROM recipes WHERE metric = ? AND timestamp = ?",
+                (metric, timestamp))
+        row = c.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def setRecipe(self, metric, timestamp, recipe):
+        """Cache the recipe of the incremental backup of metric at
+           timestamp."""
+        self._connect().execute(
+                "INSERT OR REPLACE INTO recipes (metric, timestamp, recipe) " \
+                "VALUES (?, ?, ?)", (metric, timestamp, recipe))
+
+    def codec(self, metric):
+        """Return the (algorithm, level, checked) tuple of the codec last
+           picked for metric and the time it was picked, or None."""
+        c = self._connect().execute(
+                "SELECT algorithm, level, checked FROM codecs " \
+                "WHERE metric = ?", (metric,))
+        return c.fetchone()
+
+    def setCodec(self, metric, algorithm, level):
+        """Record the codec picked for metric now."""
+        self._connect().execute(
+                "INSERT OR REPLACE INTO codecs " \
+                "(metric, algorithm, level, checked) VALUES (?, ?, ?, ?)",
+                (metric, algorithm, level, int(time.time())))
+
+    def stat(self, metric):
+        """Return the (inode, size, mtime_ns, ctime_ns) tuple recorded for
+           metric's whisper file when last backed up, or None."""
+        c = self._connect().execute(
+                "SELECT inode, size, mtime_ns, ctime_ns FROM stats " \
+                "WHERE metric = ?", (metric,))
+        return c.fetchone()
+
+    def setStat(self, metric, st):
+        """Record the (inode, size, mtime_ns, ctime_ns) tuple st for
+           metric's whisper file."""
+        self._connect().execute(
+                "INSERT OR REPLACE INTO stats " \
+                "(metric, inode, size, mtime_ns, ctime_ns) " \
+                "VALUES (?, ?, ?, ?, ?)", (metric,) + tuple(st))
+
+    def rebuild(self, store, prefix):
+        """Repopulate the manifest from a single listing of the store under
+           prefix and the indexes of any bundles.  SHA1s of backups not in
+           bundles are not fetched here, they are filled in lazily the
+           first time a metric is backed up."""
+
+        logger.info("Rebuilding backup manifest %s from store listing..."
+                % self.path)
+        t = time.time()
+        rows = []
+        for i in store.list(prefix=prefix):
+            # The SHA1 is my canary/flag, we look for it
+            if not i.endswith(".sha1"):
+                continue
+            n = i.rfind("/")
+            if n < 0:
+                continue
+            rows.append((i[:n], i[n+1:-5], None))
+
+        bundled = []
+        for key, members in listBundles(store, prefix):
+            for k, ts, sha, algorithm, offset, length in members:
+                rows.append((k, ts, sha))
+                bundled.append((k, ts, makeLocation(key, offset, length)))
+
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM backups")
+            conn.execute("DELETE FROM bundled")
+            # We no longer know which file state the latest backups hold
+            conn.execute("DELETE FROM stats")
+            conn.executemany(
+                    "INSERT OR REPLACE INTO backups (metric, timestamp, sha1) " \
+                    "VALUES (?, ?, ?)", rows)
+            conn.executemany(
+                    "INSERT OR REPLACE INTO bundled (metric, timestamp, location) " \
+                    "VALUES (?, ?, ?)", bundled)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.setMeta("prefix", prefix)
+        self.setMeta("built", "%d" % time.time())
+        logger.info("Manifest rebuilt with %d backups in %d seconds"
+                % (len(rows), time.time() - t))
+
+    def verify(self, store, sample):
+        """Spot check up to sample random metrics in the manifest against
+           the store.  Returns False if any disagree, meaning the manifest
+           is stale and must be rebuilt."""
+
+        c = self._connect().execute(
+                "SELECT metric FROM (SELECT DISTINCT metric FROM backups) " \
+                "ORDER BY RANDOM() LIMIT ?", (sample,))
+        bundles = None
+        for (metric,) in c.fetchall():
+            local = dict(self.backups(metric))
+            remote = [ i for i in store.list(metric + "/")
+                       if i.endswith(".sha1") ]
+            remote = set([ i[len(metric)+1:-5] for i in remote ])
+            # Bundled backups have nothing under the metric to list, they
+            # are there if their bundle is
+            bundled = self.bundled(metric)
+            if len(bundled) > 0 and bundles is None:
+                bundles = set(store.list(prefix=self.getMeta("prefix")
+                                         + BUNDLES_NAME + "/"))
+            for ts, location in bundled.items():
+                if parseLocation(location)[0] in bundles:
+                    remote.add(ts)
+            if remote != set(local.keys()):
+                logger.warning("Manifest disagrees with store for %s" % metric)
+                return False
+
+            last = max(local.keys())
+            if local[last] is not None and \
+                    last not in self.bundled(metric) and \
+                    store.get("%s/%s.sha1" % (metric, last)) != local[last]:
+                logger.warning("Manifest SHA1 mismatch for %s @ %s"
+                        % (metric, last))
+                return False
+
+        return True
@@ -34,19 +34,46 @@ class NoOP(object):
         logger.debug("Call to list('%s') under no-op." % prefix)
         return []
 
+    def listSizes(self, prefix=""):
+        """Return (key, size) tuples of all keys in this bucket."""
+
+        logger.debug("Call to listSizes('%s') under no-op." % prefix)
+        return []
+
     def get(self, src):
         """Return the contents of src from S3 as a string."""
 
         logger.debug("Call to get('%s') under no-op." % src)
         return None
 
+    def getRange(self, src, offset, length):
+        """Return length bytes of src starting at offset as a string."""
+
+        logger.debug("Call to getRange('%s', %d, %d) under no-op."
+                % (src, offset, length))
+        return None
+
     def put(self, dst, data):
         """Store the contents of the string data at a key named by dst
            in S3."""
 
         logger.debug("Call to put('%s') under no-op." % dst)
 
+    def putStream(self, dst, chunks):
+        """Store the data from the iterator of strings chunks at a key named
+           by dst in S3."""
+
+        logger.debug("Call to putStream('%s') under no-op." % dst)
+        for chunk in chunks:
+            pass
+
     def delete(self, src):
         """Delete the object in S3 referenced by the key name src."""
 
         logger.debug("Call to delete('%s') under no-op." % src)
+
+    def deleteMany(self, keys):
+        """Delete the objects in S3 referenced by the key names in keys."""
+
+        logger.debug("Call to deleteMany() of %d keys under no-op." % len(keys))
+        return []
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Progress of a run and the report written at its end.  Whisper files can
+# differ in size a thousandfold so progress is weighed by bytes, with the
+# rates averaged over the last minute so the ETA follows the current pace
+# of the run.  The report totals what happened to every metric, lists the
+# slowest metrics and the errors met, and is written as JSON for whatever
+# runs us from cron to check.
+
+import datetime
+import heapq
+import json
+import logging
+import os
+import time
+
+from collections import deque
+
+# Seconds of completions the rates are averaged over
+RATE_WINDOW = 60
+
+# Errors kept in the report, the rest are only counted
+MAX_ERRORS = 1000
+
+def formatDuration(seconds):
+    """Return seconds as a H:MM:SS string."""
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+
+class Progress(object):
+
+    def __init__(self, files, size, unit="files"):
+        """Track the progress of a run over files, or other units, totalling
+           size bytes."""
+        self.unit = unit
+        self.files = files
+        self.size = size
+        self.done = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.last = self.start
+        # (time, files done, bytes done) of recent completions
+        self.samples = deque([(self.start, 0, 0)])
+
+    def update(self, size=0):
+        """Record a file of size bytes as complete."""
+        now = time.time()
+        self.done += 1
+        self.bytes += size
+        self.samples.append((now, self.done, self.bytes))
+        while len(self.samples) > 2 and self.samples[1][0] < now - RATE_WINDOW:
+            self.samples.popleft()
+
+    def rates(self):
+        """Return the moving average files per second and bytes per
+           second."""
+        t, files, size = self.samples[0]
+        elapsed = max(time.time() - t, 1e-6)
+        return (self.done - files) / elapsed, (self.bytes - size) / elapsed
+
+    def eta(self):
+        """Return the estimated seconds until we finish or None."""
+        filesRate, bytesRate = self.rates()
+        if self.size > 0 and bytesRate > 0:
+            return max(self.size - self.bytes, 0) / bytesRate
+        if filesRate > 0:
+            return max(self.files - self.done, 0) / filesRate
+        return None
+
+    def due(self, interval):
+        """Return True, at most once every interval seconds, when a
+           progress line should be logged."""
+        now = time.time()
+        if now - self.last < interval and self.done < self.files:
+            return False
+        self.last = now
+        return True
+
+    def message(self):
+        """Return a line describing our progress."""
+        filesRate, bytesRate = self.rates()
+        eta = self.eta()
+        eta = formatDuration(eta) if eta is not None else "unknown"
+        if self.size == 0:
+            # Nothing to weigh progress by
+            return "Progress: %d/%d %s (%.1f%%), %.1f %s/s, ETA %s" \
+                   % (self.done, self.files, self.unit,
+                      100.0 * self.done / max(self.files, 1), filesRate,
+                      self.unit, eta)
+        return "Progress: %d/%d %s, %.1f/%.1f MB (%.1f%%), " \
+               "%.1f %s/s, %.2f MB/s, ETA %s" \
+               % (self.done, self.files, self.unit, self.bytes / 1048576.0,
+                  self.size / 1048576.0, 100.0 * self.bytes / self.size,
+                  filesRate, self.unit, bytesRate / 1048576.0, eta)
+
+
+class ErrorCollector(logging.Handler):
+
+    def __init__(self):
+        """Collect the messages of warnings and errors logged."""
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class RunReport(object):
+
+    def __init__(self, command, slowest=10):
+        """Report on a run of command, listing the slowest metrics."""
+        self.command = command
+        self.start = time.time()
+        self.files = 0
+        self.size = 0
+        self.statuses = {}
+        self.counters = {}
+        self.slow = []
+        self.slowest = slowest
+        self.errors = []
+        self.errorCount = 0
+
+    def setTotal(self, files, size):
+        """Record the number of files and bytes the run works through."""
+        self.files = files
+        self.size = size
+
+    def add(self, metric, status, size=0, stored=0, seconds=0.0, errors=[]):
+        """Record what happened to metric: its status, such as uploaded or
+           failed, its size, the bytes stored, the seconds it took and any
+           error messages."""
+
+        totals = self.statuses.setdefault(status,
+                {"files": 0, "bytes": 0, "stored": 0})
+        totals["files"] += 1
+        totals["bytes"] += size
+        totals["stored"] += stored
+
+        item = (seconds, metric, size)
+        if len(self.slow) < self.slowest:
+            heapq.heappush(self.slow, item)
+        elif item > self.slow[0]:
+            heapq.heapreplace(self.slow, item)
+
+        for i in errors:
+            self.error(metric, i)
+
+    def count(self, name, n=1):
+        """Add n to the counter name."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def error(self, metric, message):
+        """Record the error message about metric."""
+        self.errorCount += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"metric": metric, "error": message})
+
+    def report(self, runstats=None):
+        """Return the report as a dict, with the stage timers and counters
+           of the RunStats runstats if given."""
+
+        elapsed = max(time.time() - self.start, 1e-6)
+        processed = sum([ i["files"] for i in self.statuses.values() ])
+        size = sum([ i["bytes"] for i in self.statuses.values() ])
+        report = {
+            "command": self.command,
+            "started": datetime.datetime.utcfromtimestamp(self.start)
+                    .strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+            "seconds": elapsed,
+            "files": self.files,
+            "bytes": self.size,
+            "processed": {"files": processed, "bytes": size},
+            "statuses": self.statuses,
+            "counters": self.counters,
+            "files_per_second": processed / elapsed,
+            "mb_per_second": size / elapsed / 1048576,
+            "slowest": [ {"metric": m, "seconds": t, "bytes": s}
+                         for t, m, s in sorted(self.slow, reverse=True) ],
+            "errors": self.errors,
+            "error_count": self.errorCount,
+        }
+        if runstats is not None:
+            report["stages"] = dict([ (k, {"seconds": v[0], "calls": v[1]})
+                                      for k, v in runstats.timers().items() ])
+            report["stage_counters"] = runstats.totals()
+        return report
+
+    def write(self, path, runstats=None):
+        """Write the report to path as JSON, replacing it atomically."""
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as fd:
+            json.dump(self.report(runstats), fd, indent=2, sort_keys=True)
+            fd.write("\n")
+        os.rename(tmp, path)
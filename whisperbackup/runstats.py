@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Timers and counters of a whole run.  Each stage of the work, hashing,
+# compressing, the requests made of the store and so on, adds the seconds
+# it took to a timer, and counters follow the bytes moved and the files
+# skipped or that failed.  They live in shared memory created before the
+# worker processes fork so every worker adds to the same totals.  At the
+# end of the run they can be written for the Prometheus node_exporter's
+# textfile collector or sent to Carbon.
+
+import __main__
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__main__.__name__)
+
+TIMERS = ["scan", "lock_wait", "lock_held", "read", "hash", "compress",
+          "decompress", "list", "get", "put", "delete", "heal"]
+
+COUNTERS = ["bytes_read", "bytes_uploaded", "bytes_downloaded",
+            "files_unchanged", "errors"]
+
+class RunStats(object):
+
+    def __init__(self):
+        """Create our timers and counters, all zero."""
+        self.start = time.time()
+        self.seconds = multiprocessing.Array("d", len(TIMERS))
+        self.calls = multiprocessing.Array("l", len(TIMERS))
+        self.counters = multiprocessing.Array("l", len(COUNTERS))
+
+    def add(self, name, seconds):
+        """Add a call of seconds to the timer name."""
+        i = TIMERS.index(name)
+        with self.seconds.get_lock():
+            self.seconds[i] += seconds
+            self.calls[i] += 1
+
+    def count(self, name, n=1):
+        """Add n to the counter name."""
+        with self.counters.get_lock():
+            self.counters[COUNTERS.index(name)] += n
+
+    @contextmanager
+    def time(self, name):
+        """Add the time spent in the with block to the timer name."""
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t)
+
+    def timeIterator(self, chunks, name):
+        """Yield from the iterator chunks adding the time spent producing
+           each item to the timer name as one call."""
+        elapsed = 0.0
+        try:
+            chunks = iter(chunks)
+            while True:
+                t = time.time()
+                try:
+                    chunk = next(chunks)
+                finally:
+                    elapsed += time.time() - t
+                yield chunk
+        except StopIteration:
+            return
+        finally:
+            self.add(name, elapsed)
+
+    def timers(self):
+        """Return a dict of each timer to a (seconds, calls) tuple."""
+        with self.seconds.get_lock():
+            return dict(zip(TIMERS, zip(self.seconds[:], self.calls[:])))
+
+    def totals(self):
+        """Return a dict of our counters."""
+        return dict(zip(COUNTERS, self.counters[:]))
+
+    def prometheus(self, command):
+        """Return our timers and counters for the run of command in the
+           Prometheus text format."""
+
+        labels = 'command="%s"' % command
+        lines = [
+            "# HELP whisperbackup_stage_seconds Seconds spent in each stage "
+            "of the last run, summed over all workers.",
+            "# TYPE whisperbackup_stage_seconds gauge",
+        ]
+        timers = self.timers()
+        for i in TIMERS:
+            lines.append('whisperbackup_stage_seconds{%s,stage="%s"} %f'
+                    % (labels, i, timers[i][0]))
+        lines.extend([
+            "# HELP whisperbackup_stage_calls Times each stage ran in the "
+            "last run.",
+            "# TYPE whisperbackup_stage_calls gauge",
+        ])
+        for i in TIMERS:
+            lines.append('whisperbackup_stage_calls{%s,stage="%s"} %d'
+                    % (labels, i, timers[i][1]))
+        for k, v in sorted(self.totals().items()):
+            lines.append("# TYPE whisperbackup_%s gauge" % k)
+            lines.append("whisperbackup_%s{%s} %d" % (k, labels, v))
+        lines.extend([
+            "# TYPE whisperbackup_run_seconds gauge",
+            "whisperbackup_run_seconds{%s} %f"
+                    % (labels, time.time() - self.start),
+            "# TYPE whisperbackup_last_run_timestamp_seconds gauge",
+            "whisperbackup_last_run_timestamp_seconds{%s} %d"
+                    % (labels, time.time()),
+        ])
+        return "\n".join(lines) + "\n"
+
+    def carbon(self, prefix, command):
+        """Return our timers and counters for the run of command as Carbon
+           plaintext protocol lines under prefix."""
+
+        now = int(time.time())
+        prefix = "%s.%s" % (prefix, command)
+        lines = []
+        for k, v in sorted(self.timers().items()):
+            lines.append("%s.stages.%s.seconds %f %d" % (prefix, k, v[0], now))
+            lines.append("%s.stages.%s.calls %d %d" % (prefix, k, v[1], now))
+        for k, v in sorted(self.totals().items()):
+            lines.append("%s.%s %d %d" % (prefix, k, v, now))
+        lines.append("%s.run_seconds %f %d"
+                % (prefix, time.time() - self.start, now))
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, path, command):
+        """Write our timers and counters to the file path, replacing it
+           atomically so the textfile collector never reads half of it."""
+
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as fd:
+            fd.write(self.prometheus(command))
+        os.rename(tmp, path)
+
+    def sendCarbon(self, address, prefix, command):
+        """Send our timers and counters to the Carbon plaintext listener at
+           address, a host:port string."""
+
+        host, port = address.rsplit(":", 1)
+        s = socket.create_connection((host, int(port)), timeout=30)
+        try:
+            s.sendall(self.carbon(prefix, command))
+        finally:
+            s.close()
+
+    def log(self):
+        """Log our timers and counters at debug level."""
+        for k, v in sorted(self.timers().items()):
+            if v[1] > 0:
+                logger.debug("Stage %s: %.3f seconds in %d calls"
+                        % (k, v[0], v[1]))
+        for k, v in sorted(self.totals().items()):
+            logger.debug("Counter %s: %d" % (k, v))
+
+
+class InstrumentedStore(object):
+
+    def __init__(self, store, stats):
+        """Wrap the storage backend store, timing each request to it and
+           counting the bytes moved in the RunStats stats."""
+        self.store = store
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def _timeList(self, items):
+        # Listings are generators, only time spent in them counts
+        for i in self.stats.timeIterator(items, "list"):
+            yield i
+
+    def list(self, prefix=""):
+        return self._timeList(self.store.list(prefix))
+
+    def listSizes(self, prefix=""):
+        return self._timeList(self.store.listSizes(prefix))
+
+    def get(self, src):
+        with self.stats.time("get"):
+            data = self.store.get(src)
+        if data is not None:
+            self.stats.count("bytes_downloaded", len(data))
+        return data
+
+    def getRange(self, src, offset, length):
+        with self.stats.time("get"):
+            data = self.store.getRange(src, offset, length)
+        if data is not None:
+            self.stats.count("bytes_downloaded", len(data))
+        return data
+
+    def put(self, dst, data):
+        with self.stats.time("put"):
+            self.store.put(dst, data)
+        self.stats.count("bytes_uploaded", len(data))
+
+    def putStream(self, dst, chunks):
+        # Time spent producing the chunks, compressing them for instance,
+        # is not the store's
+        upstream = [0.0]
+        size = [0]
+
+        def measure():
+            source = iter(chunks)
+            while True:
+                t = time.time()
+                try:
+                    chunk = next(source)
+                except StopIteration:
+                    return
+                finally:
+                    upstream[0] += time.time() - t
+                size[0] += len(chunk)
+                yield chunk
+
+        t = time.time()
+        try:
+            return self.store.putStream(dst, measure())
+        finally:
+            self.stats.add("put", time.time() - t - upstream[0])
+            self.stats.count("bytes_uploaded", size[0])
+
+    def delete(self, src):
+        with self.stats.time("delete"):
+            return self.store.delete(src)
+
+    def deleteMany(self, keys):
+        with self.stats.time("delete"):
+            return self.store.deleteMany(keys)
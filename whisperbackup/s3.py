@@ -17,25 +17,58 @@
 
 import boto
 import __main__
+import itertools
 import logging
+import threading
+import urlparse
 
+from boto.s3.connection import OrdinaryCallingFormat
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
+from StringIO import StringIO
+
+from stream import regroupChunks, uploadParts
 
 logger = logging.getLogger(__main__.__name__)
 
+# S3 requires all but the last part of a multipart upload to be 5 MiB or more
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# A multi-object delete request takes at most this many keys
+MAX_DELETE = 1000
+
 class S3(object):
 
-    def __init__(self, bucket, region="us-east-1", noop=False):
+    def __init__(self, bucket, region="us-east-1", noop=False,
+                 partsize=8 * 1024 * 1024, parts=4, threshold=None,
+                 endpoint=None):
         """Setup the S3 storage backend with the bucket we will use and
-           optional region."""
-        self.conn = boto.s3.connect_to_region(region)
+           optional region.  Objects larger than threshold bytes, which
+           defaults to partsize, are sent as multipart uploads of partsize
+           byte parts with up to parts of them in flight at once.  Set
+           endpoint to a URL to use an S3 compatible service other than
+           AWS."""
+        self.region = region
+        self.endpoint = endpoint
+        self.conn = self._connect()
         self.bucket = bucket
         self.noop = noop
+        self.local = threading.local()
+
+        if partsize < MIN_PART_SIZE:
+            logger.warning("S3 part size must be at least %d bytes"
+                    % MIN_PART_SIZE)
+            partsize = MIN_PART_SIZE
+        self.partsize = partsize
+        self.parts = max(parts, 1)
+        self.threshold = partsize if threshold is None else threshold
 
         b = self.conn.lookup(self.bucket)
         if not noop and b is None:
             # Create the bucket if it doesn't exist
-            self.conn.create_bucket(self.bucket, location=region)
+            # us-east-1 is the default location and may not be named
+            location = "" if region == "us-east-1" else region
+            self.conn.create_bucket(self.bucket, location=location)
 
         self.__b = self.conn.get_bucket(self.bucket)
 
@@ -44,6 +77,11 @@ class S3(object):
         for i in self.__b.list(prefix):
             yield i.key
 
+    def listSizes(self, prefix=""):
+        """Return (key, size in bytes) tuples of all keys in this bucket."""
+        for i in self.__b.list(prefix):
+            yield i.key, i.size
+
     def get(self, src):
         """Return the contents of src from S3 as a string."""
         if self.__b.get_key(src) is None:
@@ -53,17 +91,95 @@ class S3(object):
         k.key = src
         return k.get_contents_as_string()
 
+    def getRange(self, src, offset, length):
+        """Return length bytes of src starting at offset as a string, using
+           a ranged GET."""
+        if self.__b.get_key(src) is None:
+            return None
+
+        k = Key(self.__b)
+        k.key = src
+        return k.get_contents_as_string(headers={"Range": "bytes=%d-%d"
+                % (offset, offset + length - 1)})
+
     def put(self, dst, data):
         """Store the contents of the string data at a key named by dst
            in S3."""
 
         if self.noop:
             logger.info("No-Op Put: %s" % dst)
+        elif len(data) > self.threshold:
+            self._multipart(dst, regroupChunks([data], self.partsize))
         else:
             k = Key(self.__b)
             k.key = dst
             k.set_contents_from_string(data)
 
+    def putStream(self, dst, chunks):
+        """Store the data from the iterator of strings chunks at a key named
+           by dst in S3.  Data larger than our threshold is sent as a
+           multipart upload with parts uploaded concurrently."""
+
+        if self.noop:
+            logger.info("No-Op Put: %s" % dst)
+            return
+
+        # Buffer up to the threshold to see if we need a multipart upload
+        parts = regroupChunks(chunks, self.partsize)
+        head = []
+        size = 0
+        for i in parts:
+            head.append(i)
+            size += len(i)
+            if size > self.threshold:
+                break
+
+        if size <= self.threshold:
+            k = Key(self.__b)
+            k.key = dst
+            k.set_contents_from_string("".join(head))
+        else:
+            self._multipart(dst, itertools.chain(head, parts))
+
+    def _connect(self):
+        if self.endpoint is None:
+            return boto.s3.connect_to_region(self.region)
+        url = urlparse.urlparse(self.endpoint)
+        return boto.connect_s3(host=url.hostname, port=url.port,
+                is_secure=(url.scheme == "https"),
+                calling_format=OrdinaryCallingFormat())
+
+    def _localBucket(self):
+        """Return our bucket on a connection of the calling thread's own.
+           Connections aren't thread safe, so each thread gets its own."""
+        if getattr(self.local, "bucket", None) is None:
+            self.local.bucket = self._connect().get_bucket(self.bucket,
+                                                           validate=False)
+        return self.local.bucket
+
+    def _multipart(self, dst, parts):
+        """Upload the iterator of strings parts as the parts of a multipart
+           upload to dst, several at once."""
+
+        mp = self.__b.initiate_multipart_upload(dst)
+
+        def upload(n, data):
+            # Each thread re-opens the upload by its id on its own
+            # connection
+            part = MultiPartUpload(self._localBucket())
+            part.bucket_name = mp.bucket_name
+            part.key_name = mp.key_name
+            part.id = mp.id
+            part.upload_part_from_file(StringIO(data), n)
+
+        try:
+            n = uploadParts(upload, parts, self.parts)
+            mp.complete_upload()
+        except:
+            mp.cancel_upload()
+            raise
+        logger.debug("Multipart upload of %s in %d parts" % (dst, n))
+
     def delete(self, src):
         """Delete the object in S3 referenced by the key name src."""
 
@@ -73,3 +189,23 @@ class S3(object):
             k = Key(self.__b)
             k.key = src
             k.delete()
+
+    def deleteMany(self, keys):
+        """Delete the objects in S3 referenced by the key names in keys using
+           multi-object delete requests.  Returns the keys that could not
+           be deleted."""
+
+        if self.noop:
+            for i in keys:
+                logger.info("No-Op Delete: %s" % i)
+            return []
+
+        failed = []
+        for n in range(0, len(keys), MAX_DELETE):
+            result = self.__b.delete_keys(keys[n:n+MAX_DELETE], quiet=True)
+            for i in result.errors:
+                logger.warning("Exception during delete of %s: %s"
+                        % (i.key, i.message))
+                failed.append(i.key)
+
+        return failed
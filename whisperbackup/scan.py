@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Finding the whisper files of the metrics matching a glob.  The glob is
+# matched against dotted metric names but the tree is made of directories,
+# so we only walk the directories whose path, as a dotted prefix, some
+# matching metric could live under.  The leading components of the glob
+# that can only ever match one component of a metric name, those without
+# a * or ? or a character class that matches a dot, are compared against
+# the leading components of each directory's dotted path.  A directory
+# name may itself hold dots, so a directory level isn't always one
+# component.  Directories are read with scandir(), which hands
+# us the type of each entry without a stat() per file, and several
+# directories are read at once on a pool of threads.
+
+import __main__
+import fnmatch
+import logging
+import os
+import re
+import threading
+
+from Queue import Queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__main__.__name__)
+
+# A character class in a glob
+CLASS = re.compile(r"\[!?\]?[^\]]*\]")
+
+class _Entry(object):
+    # The parts of scandir()'s DirEntry we use, for when we have no
+    # scandir()
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def listEntries(path):
+    """Return a list of the entries of the directory at path like those of
+       scandir()."""
+    if scandir is not None:
+        return list(scandir(path))
+    return [ _Entry(path, i) for i in os.listdir(path) ]
+
+
+def singleComponent(pattern):
+    """Return True if the glob pattern, one dot separated component of a
+       metric glob, can only match a single component of a metric name."""
+
+    if "*" in pattern or "?" in pattern:
+        return False
+    if "[" in CLASS.sub("", pattern):
+        # A class split by a dot, or not a class at all
+        return False
+    for i in CLASS.findall(pattern):
+        if fnmatch.fnmatchcase(".", i):
+            return False
+    return True
+
+
+class MetricGlob(object):
+
+    def __init__(self, glob):
+        """Compile the metric name glob."""
+        self.glob = glob
+        self.regex = re.compile(fnmatch.translate(glob))
+
+        # The leading components we can compare against directories
+        components = glob.split(".")
+        self.components = []
+        for i in components:
+            if not singleComponent(i):
+                break
+            self.components.append(re.compile(fnmatch.translate(i)))
+
+        # Metrics have exactly as many components as the glob if all of
+        # them are single components
+        self.depth = None
+        if len(self.components) == len(components):
+            self.depth = len(components)
+
+    def match(self, name):
+        """Return True if the metric name matches the glob."""
+        return self.glob == "*" or self.regex.match(name) is not None
+
+    def enter(self, components):
+        """Return True if the directory whose path below the root of the
+           tree is the list components could hold metrics matching the
+           glob."""
+        # A directory named a.b holds metrics named a.b.*
+        components = ".".join(components).split(".")
+        if self.depth is not None and len(components) >= self.depth:
+            return False
+        for c, pattern in zip(components, self.components):
+            if pattern.match(c) is None:
+                return False
+        return True
+
+
+def scanDirectory(path, components, metricGlob):
+    """Read the directory at path, whose path below the root is the list
+       components.  Returns a list of (metric name, path, size, mtime) of
+       its whisper files matching metricGlob and a list of (components,
+       path) of the subdirectories worth walking."""
+
+    files = []
+    dirs = []
+    try:
+        entries = listEntries(path)
+    except OSError as e:
+        logger.warning("Could not read directory %s: %s" % (path, str(e)))
+        return files, dirs
+
+    for entry in entries:
+        try:
+            isDir = entry.is_dir()
+        except OSError:
+            isDir = False
+        if isDir:
+            # Like os.walk() we do not follow links to directories
+            if not entry.is_symlink() and \
+                    metricGlob.enter(components + [entry.name]):
+                dirs.append((components + [entry.name], entry.path))
+        elif entry.name.endswith(".wsp"):
+            name = ".".join(components + [entry.name[:-4]])
+            if metricGlob.match(name):
+                try:
+                    st = entry.stat()
+                    files.append((name, entry.path, st.st_size, st.st_mtime))
+                except OSError:
+                    # A dangling link, the backup will report it
+                    files.append((name, entry.path, 0, 0))
+
+    return files, dirs
+
+
+def scanMetrics(root, glob, threads=1):
+    """Yield (metric name, path, size in bytes, mtime) for each whisper file
+       under the directory root whose metric name matches glob, reading
+       directories on threads threads."""
+
+    metricGlob = MetricGlob(glob)
+    if threads <= 1:
+        stack = [([], root)]
+        while stack:
+            components, path = stack.pop()
+            files, dirs = scanDirectory(path, components, metricGlob)
+            for i in files:
+                yield i
+            stack.extend(reversed(dirs))
+        return
+
+    work = Queue()
+    results = Queue()
+    lock = threading.Lock()
+    # Directories queued or being read
+    pending = [1]
+
+    def walk():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            files, dirs = [], []
+            try:
+                files, dirs = scanDirectory(item[1], item[0], metricGlob)
+            finally:
+                with lock:
+                    pending[0] += len(dirs)
+                for i in dirs:
+                    work.put(i)
+                results.put(files)
+                with lock:
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        results.put(None)
+
+    pool = [ threading.Thread(target=walk) for i in range(threads) ]
+    for t in pool:
+        t.daemon = True
+        t.start()
+    work.put(([], root))
+
+    try:
+        while True:
+            files = results.get()
+            if files is None:
+                break
+            for i in files:
+                yield i
+    finally:
+        for t in pool:
+            work.put(None)
+        for t in pool:
+            t.join()
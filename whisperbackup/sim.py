@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# A simulated object store for benchmarking.  Objects are kept on disk like
+# the disk backend but every request is made to behave like one to a
+# remote store: each costs a round trip of latency, data moves no faster
+# than the bandwidth allows, listings arrive a page at a time and deletes
+# are batched like S3's DeleteObjects.  The requests made and bytes moved
+# are counted across all of our worker processes and may be written out
+# as JSON when the run finishes.
+
+import __main__
+import atexit
+import json
+import logging
+import multiprocessing
+import time
+
+from disk import Disk
+
+logger = logging.getLogger(__main__.__name__)
+
+# The requests we count, and the bytes moved each way
+COUNTERS = ["list", "get", "put", "delete", "bytes_in", "bytes_out"]
+
+# Keys deleted in one request by deleteMany(), as in S3
+DELETE_BATCH = 1000
+
+class Sim(Disk):
+
+    def __init__(self, bucket, noop=False, latency=0.0, bandwidth=None,
+                 pagesize=1000, stats=None):
+        """Setup the simulated store in the directory bucket.  Each request
+           takes latency seconds, data moves at bandwidth bytes per second
+           or as fast as it can if None, and listings return pagesize keys
+           per request.  If stats is given our counters are written there
+           as JSON when we exit."""
+
+        Disk.__init__(self, bucket, noop)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.pagesize = max(pagesize, 1)
+
+        # Created before we fork so the workers share them
+        self.counters = multiprocessing.Array("l", len(COUNTERS))
+
+        if stats is not None:
+            atexit.register(self.dump, stats)
+
+    def count(self, name, n=1):
+        """Add n to the counter name."""
+        with self.counters.get_lock():
+            self.counters[COUNTERS.index(name)] += n
+
+    def stats(self):
+        """Return a dict of our counters."""
+        return dict(zip(COUNTERS, self.counters[:]))
+
+    def dump(self, path):
+        """Write our counters to path as JSON."""
+        with open(path, "w") as fd:
+            json.dump(self.stats(), fd)
+
+    def request(self, name, size=0):
+        """Count and wait out a request of name moving size bytes."""
+        self.count(name)
+        delay = self.latency
+        if self.bandwidth and size:
+            delay += float(size) / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def transfer(self, size):
+        """Wait out moving size bytes of a request already made."""
+        if self.bandwidth and size:
+            time.sleep(float(size) / self.bandwidth)
+
+    def list(self, prefix=""):
+        """ Return all keys in this bucket that begin with prefix, a page
+            of keys per request."""
+
+        n = 0
+        for i in Disk.list(self, prefix):
+            if n % self.pagesize == 0:
+                self.request("list")
+            n += 1
+            yield i
+
+        if n == 0:
+            self.request("list")
+
+    def get(self, src):
+        """Return the contents of src as a string."""
+
+        data = Disk.get(self, src)
+        self.request("get", len(data) if data is not None else 0)
+        if data is not None:
+            self.count("bytes_out", len(data))
+        return data
+
+    def getRange(self, src, offset, length):
+        """Return length bytes of src starting at offset as a string."""
+
+        data = Disk.getRange(self, src, offset, length)
+        self.request("get", len(data) if data is not None else 0)
+        if data is not None:
+            self.count("bytes_out", len(data))
+        return data
+
+    def put(self, dst, data):
+        """Store the contents of the string data at a key named by dst."""
+
+        self.request("put", len(data))
+        self.count("bytes_in", len(data))
+        Disk.put(self, dst, data)
+
+    def putStream(self, dst, chunks):
+        """Store the data from the iterator of strings chunks at a key named
+           by dst, as one request moving each chunk as it arrives."""
+
+        def throttle():
+            for chunk in chunks:
+                self.transfer(len(chunk))
+                self.count("bytes_in", len(chunk))
+                yield chunk
+
+        self.request("put")
+        Disk.putStream(self, dst, throttle())
+
+    def delete(self, src):
+        """Delete the object referenced by the key name src."""
+
+        self.request("delete")
+        Disk.delete(self, src)
+
+    def deleteMany(self, keys):
+        """Delete the objects referenced by the key names in keys, a batch
+           of keys per request.  Returns the keys that could not be
+           deleted."""
+
+        keys = list(keys)
+        for i in range(0, len(keys), DELETE_BATCH):
+            self.request("delete")
+        return Disk.deleteMany(self, keys)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import collections
+import gzip
+import os
+import tempfile
+import zlib
+
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the reads we make from whisper files and snapshots when streaming
+CHUNK_SIZE = 1024 * 1024
+
+# Every compression algorithm, the suffix of the files it makes
+ALGORITHMS = ["gz", "sz", "zst"]
+
+# Algorithms whose files may be a series of independently compressed
+# blocks, gzip members or zstd frames, that standard tools still read
+SPLITTABLE = ["gz", "zst"]
+
+# Size of the independently compressed blocks of large files
+SPLIT_BLOCK_SIZE = 4 * 1024 * 1024
+
+def readChunks(fh, size=CHUNK_SIZE):
+    """Yield the contents of the file object fh in strings of at most size
+       bytes."""
+
+    while True:
+        chunk = fh.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def copyFile(src, dst, count):
+    """Copy count bytes from the file descriptor src at its current offset
+       to the file descriptor dst."""
+
+    while count > 0:
+        chunk = os.read(src, min(count, CHUNK_SIZE))
+        if not chunk:
+            return
+        os.write(dst, chunk)
+        count -= len(chunk)
+
+
+def snapshotFile(data, scratch=None, buffer_size=0):
+    """Return a file object, positioned at the start, holding the string
+       data, a whisper file read while we held its lock.  Data no larger
+       than buffer_size stays in memory, more is written to an anonymous
+       temp file in the directory scratch so the string can be freed
+       before we hash, compress and upload it.  Call this once the lock
+       is released."""
+
+    if len(data) <= buffer_size:
+        return StringIO(data)
+
+    snapshot = tempfile.TemporaryFile(prefix="whisper-backup", dir=scratch)
+    snapshot.write(data)
+    snapshot.seek(0)
+    return snapshot
+
+
+def compressChunks(chunks, algorithm, level=3, threads=0, dictionary=None):
+    """Yield the compressed form of the iterator of strings chunks using
+       algorithm, either "gz", "sz" or "zst".  The output is a complete
+       gzip file, Snappy framed stream or Zstandard frame, just as the in
+       memory path produces.  Zstandard compresses at level with threads
+       worker threads and the ZstdCompressionDict dictionary, if given."""
+
+    if algorithm == "gz":
+        # A wbits of 16 + MAX_WBITS makes zlib write gzip headers
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    elif algorithm == "sz":
+        compressor = snappy.StreamCompressor()
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+    elif algorithm == "zst":
+        if dictionary is None:
+            compressor = zstandard.ZstdCompressor(level=level,
+                                                  threads=threads)
+        else:
+            compressor = zstandard.ZstdCompressor(level=level,
+                    threads=threads, dict_data=dictionary)
+        compressor = compressor.compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    else:
+        raise StandardError("Unknown compression format requested")
+
+
+def compressSplit(chunks, algorithm, level=3, dictionary=None, threads=2,
+                  blockSize=SPLIT_BLOCK_SIZE):
+    """Yield the compressed form of the iterator of strings chunks using
+       algorithm, "gz" or "zst", as a series of blockSize blocks each
+       compressed on its own on a pool of threads, as pigz does.  The
+       output is a multi-member gzip file or a series of Zstandard frames,
+       both of which gunzip and zstd read as one.  Both compressors drop
+       the GIL so the blocks really are compressed in parallel.  At most
+       twice threads blocks are held at once."""
+
+    def compress(block):
+        return "".join(compressChunks([block], algorithm, level,
+                                      dictionary=dictionary))
+
+    workers = ThreadPool(threads)
+    inflight = collections.deque()
+    try:
+        for block in regroupChunks(chunks, blockSize):
+            inflight.append(workers.apply_async(compress, (block,)))
+            if len(inflight) >= 2 * threads:
+                yield inflight.popleft().get()
+        while len(inflight) > 0:
+            yield inflight.popleft().get()
+    finally:
+        workers.terminate()
+        workers.join()
+
+
+def decompress(data, algorithm, dictionary=None):
+    """Return the string data compressed with algorithm, either "gz", "sz"
+       or "zst", decompressed.  Data may be several gzip members or zstd
+       frames.  A zst frame compressed with a dictionary needs that
+       ZstdCompressionDict passed as dictionary.  Raises an exception if
+       data is corrupt."""
+
+    if algorithm == "gz":
+        fd = gzip.GzipFile(fileobj=StringIO(data), mode="rb")
+        blob = fd.read()
+        fd.close()
+        return blob
+    elif algorithm == "sz":
+        decompressor = snappy.StreamDecompressor()
+        blob = decompressor.decompress(data)
+        decompressor.flush()
+        return blob
+    elif algorithm == "zst":
+        # Streamed frames do not record their size, so decompress as a
+        # stream, reading on through every frame
+        if dictionary is None:
+            decompressor = zstandard.ZstdDecompressor()
+        else:
+            decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        reader = decompressor.stream_reader(StringIO(data),
+                                            read_across_frames=True)
+        return "".join(readChunks(reader))
+    else:
+        raise StandardError("Unknown compression format requested")
+
+
+def frameDictionary(data):
+    """Return the ID of the dictionary the Zstandard frame at the start of
+       the string data was compressed with, or 0 for none."""
+    return zstandard.get_frame_parameters(data).dict_id
+
+
+class Counter(object):
+    """Wrap an iterator of strings counting the bytes that pass through."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+
+def regroupChunks(chunks, size):
+    """Yield the data of the iterator of strings chunks as strings of size
+       bytes.  The last one may be shorter."""
+
+    buf = []
+    n = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        n += len(chunk)
+        while n >= size:
+            data = "".join(buf)
+            yield data[:size]
+            buf = [data[size:]]
+            n -= size
+
+    if n > 0:
+        yield "".join(buf)
+
+
+def uploadParts(upload, parts, threads):
+    """Call upload(n, data) for each string data in the iterator parts,
+       numbering them from 1, on a pool of threads.  No more than threads
+       parts are held at once.  Returns the number of parts, or raises the
+       first exception an upload raised."""
+
+    workers = ThreadPool(threads)
+    inflight = []
+    n = 0
+    try:
+        for data in parts:
+            n += 1
+            inflight.append(workers.apply_async(upload, (n, data)))
+            if len(inflight) >= threads:
+                inflight.pop(0).get()
+        for i in inflight:
+            i.get()
+    except:
+        workers.terminate()
+        raise
+    finally:
+        workers.close()
+        workers.join()
+
+    return n
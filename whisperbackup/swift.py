@@ -16,15 +16,20 @@
 #   limitations under the License.
 
 import __main__
+import json
 import logging
 import os
 import sys
+import urllib
 
 from swiftclient.client import Connection
 from swiftclient.exceptions import ClientException
 
 logger = logging.getLogger(__main__.__name__)
 
+# Objects per bulk delete request, Swift's default limit is 10000
+BULK_DELETE = 1000
+
 class Swift(object):
 
     def __init__(self, bucket, noop):
@@ -66,6 +71,17 @@ class Swift(object):
             headers, objs = self.conn.get_container(self.bucket,
                     marker=i["name"], prefix=prefix)
 
+    def listSizes(self, prefix=None):
+        """Return (key, size in bytes) tuples of all keys in this bucket."""
+
+        headers, objs = self.conn.get_container(self.bucket, prefix=prefix)
+        while objs:
+            # Handle paging
+            i = {}
+            for i in objs:
+                yield i["name"], i["bytes"]
+            headers, objs = self.conn.get_container(self.bucket,
+                    marker=i["name"], prefix=prefix)
 
     def get(self, src):
         """Return the contents of src from S3 as a string."""
@@ -77,6 +93,19 @@ class Swift(object):
             # Request failed....object doesn't exist
             return None
 
+    def getRange(self, src, offset, length):
+        """Return length bytes of src starting at offset as a string, using
+           a ranged GET."""
+
+        try:
+            headers, obj = self.conn.get_object(self.bucket, src,
+                    headers={"Range": "bytes=%d-%d"
+                             % (offset, offset + length - 1)})
+            return obj
+        except ClientException:
+            # Request failed....object doesn't exist
+            return None
+
 
     def put(self, dst, data):
         """Store the contents of the string data at a key named by dst
@@ -88,6 +117,16 @@ class Swift(object):
             self.conn.put_object(self.bucket, dst, data)
 
 
+    def putStream(self, dst, chunks):
+        """Store the data from the iterator of strings chunks at a key named
+           by dst in Swift using chunked transfer encoding."""
+
+        if self.noop:
+            logger.info("No-Op Put: %s" % dst)
+        else:
+            self.conn.put_object(self.bucket, dst, contents=chunks)
+
+
     def delete(self, src):
         """Delete the object in S3 referenced by the key name src."""
 
@@ -95,3 +134,43 @@ class Swift(object):
             logger.info("No-Op Delete: %s" % src)
         else:
             self.conn.delete_object(self.bucket, src)
+
+
+    def deleteMany(self, keys):
+        """Delete the objects in Swift referenced by the key names in keys
+           using bulk delete requests.  Returns the keys that could not be
+           deleted."""
+
+        if self.noop:
+            for i in keys:
+                logger.info("No-Op Delete: %s" % i)
+            return []
+
+        failed = []
+        for n in range(0, len(keys), BULK_DELETE):
+            batch = keys[n:n+BULK_DELETE]
+            paths = dict([ ("/%s/%s" % (self.bucket, i), i) for i in batch ])
+            try:
+                headers, body = self.conn.post_account(
+                        headers={"Content-Type": "text/plain",
+                                 "Accept": "application/json"},
+                        data="\n".join([ urllib.quote(i) for i in paths ]),
+                        query_string="bulk-delete")
+                result = json.loads(body)
+                for path, status in result.get("Errors", []):
+                    logger.warning("Exception during delete of %s: %s"
+                            % (path, status))
+                    failed.append(paths.get(urllib.unquote(path), path))
+            except ClientException as e:
+                # Bulk delete isn't enabled, do it one at a time
+                logger.debug("Bulk delete failed, falling back: %s" % str(e))
+                for i in batch:
+                    try:
+                        self.conn.delete_object(self.bucket, i)
+                    except ClientException as e:
+                        if e.http_status != 404:
+                            logger.warning("Exception during delete of %s: %s"
+                                    % (i, str(e)))
+                            failed.append(i)
+
+        return failed
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+#
+#   Copyright 2026 The whisper-backup contributors
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# A reversible transform of whisper files that makes them compress better.
+# Each archive is an array of (uint32 timestamp, float64 value) points.
+# We split the points into a column of timestamps, stored as the delta of
+# their deltas, and a column of values, each stored XORed with the value
+# before it.  Regular timestamps become zeros as do repeated values, and
+# neighbouring values mostly share their sign, exponent and top of their
+# mantissa.  Each column is then split into byte planes, all of the first
+# bytes, then all of the second bytes and so on, so those long runs of
+# zeros sit together for the compressor to find.  All arithmetic is
+# modulo 2**32 or 2**64 so any bytes at all survive the round trip.
+#
+# The transformed file is,
+#
+#     MAGIC, the whisper header verbatim, then for each window of at most
+#     WINDOW_POINTS points of each archive its timestamp planes followed
+#     by its value planes
+#
+# Windows bound the memory a streamed file needs however large its
+# archives.  The first version, WBX1, made each archive one window and is
+# still read.  A whisper file starts with its aggregation type, a small
+# big endian integer, so can never start with a magic.  Files we cannot
+# parse, or whose round trip is not exact, are left untouched and decode()
+# passes anything without a magic through.
+
+import struct
+
+from StringIO import StringIO
+
+from stream import readChunks
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "WBX2"
+
+# The magic of transformed files without windows
+MAGIC_V1 = "WBX1"
+
+# Points per window, 768 KiB of an archive
+WINDOW_POINTS = 65536
+
+# whisper's on disk layout, see whisper.py
+METADATA_FORMAT = "!2LfL"
+METADATA_SIZE = struct.calcsize(METADATA_FORMAT)
+ARCHIVE_INFO_FORMAT = "!3L"
+ARCHIVE_INFO_SIZE = struct.calcsize(ARCHIVE_INFO_FORMAT)
+POINT_SIZE = 12
+
+# More archives than this and it isn't a whisper file
+MAX_ARCHIVES = 256
+
+def parseLayout(header, size):
+    """Return the header length and the list of the number of points in each
+       archive of the whisper file of size bytes whose first bytes are
+       header, or None if it is not a whisper file whose archives follow
+       the header back to back and fill the file."""
+
+    if len(header) < METADATA_SIZE:
+        return None
+    count = struct.unpack(METADATA_FORMAT, header[:METADATA_SIZE])[3]
+    if count < 1 or count > MAX_ARCHIVES:
+        return None
+    length = METADATA_SIZE + count * ARCHIVE_INFO_SIZE
+    if len(header) < length:
+        return None
+
+    points = []
+    end = length
+    for i in range(count):
+        n = METADATA_SIZE + i * ARCHIVE_INFO_SIZE
+        offset, secondsPerPoint, number = struct.unpack(ARCHIVE_INFO_FORMAT,
+                header[n:n+ARCHIVE_INFO_SIZE])
+        if offset != end or number < 1:
+            return None
+        points.append(number)
+        end = offset + number * POINT_SIZE
+
+    if end != size:
+        return None
+    return length, points
+
+
+def _deltas(values, mask):
+    # Each value less the one before, the first less zero
+    out = [ (values[i] - values[i-1]) & mask for i in range(1, len(values)) ]
+    return values[:1] + out
+
+
+def _sums(values, mask):
+    out = []
+    total = 0
+    for i in values:
+        total = (total + i) & mask
+        out.append(total)
+    return out
+
+
+def _xors(values):
+    return values[:1] + [ values[i] ^ values[i-1]
+                          for i in range(1, len(values)) ]
+
+
+def _unxors(values):
+    out = []
+    last = 0
+    for i in values:
+        last = last ^ i
+        out.append(last)
+    return out
+
+
+def _shuffle(data, width):
+    # Byte planes of an array of width byte items
+    return "".join([ data[i::width] for i in range(width) ])
+
+
+def _unshuffle(data, width):
+    out = bytearray(len(data))
+    n = len(data) / width
+    for i in range(width):
+        out[i::width] = data[i*n:(i+1)*n]
+    return str(out)
+
+
+def encodeArchive(data):
+    """Return the transformed form of the string data, the raw points of
+       one whisper archive."""
+
+    n = len(data) / POINT_SIZE
+    if numpy is not None:
+        raw = numpy.frombuffer(data, dtype=numpy.uint8).reshape(n, POINT_SIZE)
+        t = raw[:, :4].copy().view(">u4").ravel().astype(numpy.uint32)
+        v = raw[:, 4:].copy().view(">u8").ravel().astype(numpy.uint64)
+        d = t.copy()
+        d[1:] -= t[:-1]
+        dd = d.copy()
+        dd[1:] -= d[:-1]
+        x = v.copy()
+        x[1:] ^= v[:-1]
+        return dd.astype(">u4").view(numpy.uint8).reshape(n, 4).T.tobytes() + \
+               x.astype(">u8").view(numpy.uint8).reshape(n, 8).T.tobytes()
+
+    fields = struct.unpack("!" + "LQ" * n, data)
+    t = _deltas(_deltas(list(fields[0::2]), 0xffffffff), 0xffffffff)
+    v = _xors(list(fields[1::2]))
+    return _shuffle(struct.pack("!%dL" % n, *t), 4) + \
+           _shuffle(struct.pack("!%dQ" % n, *v), 8)
+
+
+def decodeArchive(data):
+    """Return the raw points of one whisper archive from the string data
+       returned by encodeArchive()."""
+
+    n = len(data) / POINT_SIZE
+    if numpy is not None:
+        raw = numpy.frombuffer(data, dtype=numpy.uint8)
+        dd = raw[:4*n].reshape(4, n).T.copy().view(">u4").ravel()
+        x = raw[4*n:].reshape(8, n).T.copy().view(">u8").ravel()
+        t = numpy.cumsum(numpy.cumsum(dd.astype(numpy.uint32),
+                                      dtype=numpy.uint32), dtype=numpy.uint32)
+        v = numpy.bitwise_xor.accumulate(x.astype(numpy.uint64))
+        out = numpy.empty((n, POINT_SIZE), dtype=numpy.uint8)
+        out[:, :4] = t.astype(">u4").view(numpy.uint8).reshape(n, 4)
+        out[:, 4:] = v.astype(">u8").view(numpy.uint8).reshape(n, 8)
+        return out.tobytes()
+
+    t = struct.unpack("!%dL" % n, _unshuffle(data[:4*n], 4))
+    v = struct.unpack("!%dQ" % n, _unshuffle(data[4*n:], 8))
+    t = _sums(_sums(t, 0xffffffff), 0xffffffff)
+    v = _unxors(v)
+    points = [None] * (2 * n)
+    points[0::2] = t
+    points[1::2] = v
+    return struct.pack("!" + "LQ" * n, *points)
+
+
+def readWindows(fh, points):
+    """Yield the raw points of the whisper file fh, positioned at the end
+       of its header, whose archives have the list points of points, in
+       strings of at most WINDOW_POINTS points.  Each window is within one
+       archive."""
+
+    window = WINDOW_POINTS
+    for n in points:
+        for offset in range(0, n, window):
+            yield fh.read(min(window, n - offset) * POINT_SIZE)
+
+
+def encodeFile(fh, size):
+    """Yield the transformed form of the whisper file of size bytes in the
+       seekable file object fh, positioned at its start, as strings.  Every
+       window is first encoded, decoded again and checked against the
+       original.  If any round trip is not exact, or it is not a whisper
+       file, the file is yielded unchanged, as encode() does."""
+
+    header = fh.read(METADATA_SIZE + MAX_ARCHIVES * ARCHIVE_INFO_SIZE)
+    layout = parseLayout(header, size)
+    if layout is not None:
+        fh.seek(layout[0])
+        for data in readWindows(fh, layout[1]):
+            if decodeArchive(encodeArchive(data)) != data:
+                layout = None
+                break
+
+    if layout is None:
+        fh.seek(0)
+        for chunk in readChunks(fh):
+            yield chunk
+        return
+
+    length, points = layout
+    fh.seek(length)
+    yield MAGIC + header[:length]
+    for data in readWindows(fh, points):
+        yield encodeArchive(data)
+
+
+def encode(data):
+    """Return the transformed form of the whisper file in the string data,
+       or data itself if we cannot transform it."""
+
+    return "".join(encodeFile(StringIO(data), len(data)))
+
+
+def decode(data):
+    """Return the whisper file from the string data returned by encode().
+       Data that was not transformed is returned as is.  Raises ValueError
+       if data is corrupt."""
+
+    if data.startswith(MAGIC):
+        window = WINDOW_POINTS
+    elif data.startswith(MAGIC_V1):
+        window = None
+    else:
+        return data
+
+    data = data[len(MAGIC):]
+    layout = parseLayout(data, len(data))
+    if layout is None:
+        raise ValueError("Corrupt transformed whisper file")
+
+    length, points = layout
+    out = [data[:length]]
+    offset = length
+    for n in points:
+        for i in range(0, n, window or n):
+            m = min(window or n, n - i) * POINT_SIZE
+            out.append(decodeArchive(data[offset:offset + m]))
+            offset += m
+    return "".join(out)
@@ -23,11 +23,13 @@ import fcntl
 import gzip
 import hashlib
 import datetime
+import socket
 import time
 import tempfile
-import shutil
+import threading
 
-from multiprocessing import Pool
+from multiprocessing import Pool, BoundedSemaphore, Value
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
 from fnmatch import fnmatch
 from StringIO import StringIO
@@ -37,26 +39,60 @@ try:
 except ImportError:
     snappy = None
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from blocks import CHUNKS_NAME, blockKey, blockPrefix, blockSHA
+from bundle import BUNDLES_NAME, BundleWriter, bundleKey, bundleTime, \
+                   makeLocation
+from bundle import parseLocation
+from blocks import makeRecipe, parseRecipe
+from codec import chooseCodec, measureBandwidth, sampleData
+from dictionary import currentDictionary, fetchDictionary
+from digest import available, digestChunks, parseDigest, verifyDigest
+from dictionary import storeDictionary, trainDictionary
 from fill import fill_archives
+from index import Index
+from manifest import Manifest
+from progress import ErrorCollector, Progress, RunReport
+from runstats import RunStats, InstrumentedStore
+from scan import scanMetrics
+from stream import readChunks, compressChunks, decompress, regroupChunks
+from stream import ALGORITHMS, SPLITTABLE, compressSplit, frameDictionary
+from transform import encode, encodeFile, decode
+from stream import snapshotFile, Counter
 from pycronscript import CronScript
 
 import __main__
 
 logger = logging.getLogger(__main__.__name__)
 
-def listMetrics(storage_dir, storage_path, glob):
+# The zst dictionaries fetched from the store by this process, by ID
+dictionaries = {}
+
+def listMetrics(storage_dir, storage_path, glob, threads=1):
+    """Yield (key, path, size, mtime) for each whisper file under
+       storage_dir whose metric name matches glob, reading directories on
+       threads threads.  Only directories that could hold such metrics are
+       walked."""
+
     storage_dir = storage_dir.rstrip(os.sep)
 
-    for root, dirnames, filenames in os.walk(storage_dir):
-        for filename in filenames:
-            if filename.endswith(".wsp"):
-                root_path = root[len(storage_dir) + 1:]
-                m_path = os.path.join(root_path, filename)
-                m_name, m_ext = os.path.splitext(m_path)
-                m_name = m_name.replace('/', '.')
-                if glob == "*" or fnmatch(m_name, glob):
-                    # We use globbing on the metric name, not the path
-                    yield storage_path + m_name, os.path.join(root, filename)
+    # We use globbing on the metric name, not the path
+    for m_name, path, size, mtime in scanMetrics(storage_dir, glob, threads):
+        yield storage_path + m_name, path, size, mtime
+
+
+def statKey(st):
+    """Return the (inode, size, mtime_ns, ctime_ns) tuple from the stat
+       result st that we use to tell if a whisper file has changed."""
+
+    # Python 2 has no st_mtime_ns, floats are good to a microsecond
+    mtime = getattr(st, "st_mtime_ns", int(st.st_mtime * 1000000) * 1000)
+    ctime = getattr(st, "st_ctime_ns", int(st.st_ctime * 1000000) * 1000)
+    return (st.st_ino, st.st_size, mtime, ctime)
 
 
 def toPath(prefix, metric):
@@ -67,9 +103,145 @@ def toPath(prefix, metric):
     return os.path.join(prefix, m)
 
 
+def parseSize(size):
+    """Return the number of bytes in the string size, which may carry a
+       K, M or G suffix for KiB, MiB or GiB."""
+
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def compressPayload(script, chunks, codec=None, size=0):
+    """Return an iterator of the iterator of strings chunks compressed
+       with the (algorithm, level) tuple codec, by default our algorithm
+       and zst level, using our zst threads and dictionary.  Data of
+       size bytes, if larger than --parallel-threshold, is compressed in
+       blocks on several threads."""
+
+    if codec is None:
+        codec = (script.options.algorithm, script.options.zstd_level)
+    if script.parallel_threshold > 0 and size > script.parallel_threshold \
+            and codec[0] in SPLITTABLE:
+        return compressSplit(chunks, codec[0], codec[1],
+                             getattr(script, "zdict", None),
+                             script.options.parallel_threads)
+    return compressChunks(chunks, codec[0], codec[1],
+                          script.options.zstd_threads,
+                          getattr(script, "zdict", None))
+
+
+def codecCandidates(script):
+    """Return the list of (algorithm, level) codecs --algorithm auto picks
+       from, the installed ones."""
+
+    candidates = [("gz", None)]
+    if snappy is not None:
+        candidates.append(("sz", None))
+    if zstandard is not None:
+        for level in sorted(set([1, 3, script.options.zstd_level])):
+            candidates.append(("zst", level))
+    return candidates
+
+
+def pickCodec(script, k, src, size):
+    """Return the (algorithm, level) codec to compress the whisper file of
+       metric key k with, size bytes in src, a string or file object.
+       With --algorithm auto the file is sampled unless the manifest has
+       a recent enough pick."""
+
+    if script.options.algorithm != "auto":
+        return script.options.algorithm, script.options.zstd_level
+
+    if script.manifest is not None:
+        codec = script.manifest.codec(k)
+        if codec is not None and \
+                time.time() - codec[2] < script.options.codec_age * 3600:
+            return codec[0], codec[1]
+
+    codec = chooseCodec(sampleData(src, size), size, codecCandidates(script),
+            script.bandwidth.value,
+            lambda data, algorithm, level: "".join(
+                compressPayload(script, [data], (algorithm, level))))
+    logger.debug("Picked codec %s level %s for %s at %d bytes/s"
+            % (codec[0], codec[1], k, script.bandwidth.value))
+    if script.manifest is not None:
+        script.manifest.setCodec(k, codec[0], codec[1])
+    return codec
+
+
+def decompressPayload(script, data, algorithm):
+    """Return the string data compressed with algorithm decompressed,
+       fetching the zst dictionary it names from the store if need be."""
+
+    dictionary = None
+    if algorithm == "zst":
+        dictID = frameDictionary(data)
+        if dictID != 0:
+            if dictID not in dictionaries:
+                dictionaries[dictID] = fetchDictionary(script.store,
+                        script.options.storage_path, dictID)
+            dictionary = dictionaries[dictID]
+            if dictionary is None:
+                raise StandardError("Missing zstd dictionary %d in store"
+                        % dictID)
+
+    return decompress(data, algorithm, dictionary)
+
+
+def zstdDictionary(script, paths):
+    """Return the zst dictionary this backup uses.  That is a new one
+       trained on a sample of the whisper files at paths with --zstd-train,
+       or else the current one in the store, trained now if there is
+       none yet.  Returns None if training fails."""
+
+    d = None
+    if script.options.zstd_train == 0:
+        d = currentDictionary(script.store, script.options.storage_path)
+    if d is None:
+        try:
+            d = trainDictionary(paths, script.options.zstd_train or 100,
+                                script.options.zstd_threads)
+        except Exception as e:
+            # Usually too little data to train on
+            logger.warning("Unable to train a zstd dictionary, compressing " \
+                           "without one: %s" % str(e))
+            return None
+        if script.options.noop:
+            logger.info("No-Op: Store zstd dictionary %d" % d.dict_id())
+        else:
+            storeDictionary(script.store, script.options.storage_path, d)
+    logger.info("Compressing with zstd dictionary %d" % d.dict_id())
+    return d
+
+
+class PerThreadStore(object):
+
+    def __init__(self, factory):
+        """A storage backend whose connections are not thread safe, the
+           boto, swiftclient and google-cloud-storage ones, opened once
+           per thread by calling factory.  The calling thread's is opened
+           now so a bad configuration fails early."""
+        self.factory = factory
+        self.local = threading.local()
+        self.local.store = factory()
+        self.local.pid = os.getpid()
+
+    def __getattr__(self, name):
+        # Like the manifest's connections these must not be shared across
+        # a fork() either
+        local = self.local
+        if getattr(local, "store", None) is None or local.pid != os.getpid():
+            local.store = self.factory()
+            local.pid = os.getpid()
+        return getattr(local.store, name)
+
+
 def storageBackend(script):
     if len(script.args) <= 1:
-        logger.error("Storage backend must be specified, either: disk, gcs, noop, s3, or swift")
+        logger.error("Storage backend must be specified, either: disk, gcs, noop, s3, sim, or swift")
         sys.exit(1)
     if script.args[1].lower() == "disk":
         import disk
@@ -81,31 +253,159 @@ def storageBackend(script):
         import s3
         s3args = {"region": "us-east-1"}
         for i in script.args[2:]:
-            fields = i.split("=")
+            fields = i.split("=", 1)
             if len(fields) > 1:
                 s3args[fields[0]] = fields[1]
             else:
                 s3args["region"] = fields[0]
-        return s3.S3(script.options.bucket, s3args["region"], script.options.noop)
+        return PerThreadStore(lambda: s3.S3(script.options.bucket,
+            s3args["region"], script.options.noop,
+            partsize=parseSize(s3args.get("partsize", "8M")),
+            parts=int(s3args.get("parts", 4)),
+            threshold=parseSize(s3args["threshold"]) \
+                    if "threshold" in s3args else None,
+            endpoint=s3args.get("endpoint")))
+    if script.args[1].lower() == "sim":
+        import sim
+        simargs = {}
+        for i in script.args[2:]:
+            fields = i.split("=", 1)
+            if len(fields) > 1:
+                simargs[fields[0]] = fields[1]
+        return sim.Sim(script.options.bucket, script.options.noop,
+            latency=float(simargs.get("latency", 0)),
+            bandwidth=parseSize(simargs["bandwidth"]) \
+                    if "bandwidth" in simargs else None,
+            pagesize=int(simargs.get("pagesize", 1000)),
+            stats=simargs.get("stats"))
     if script.args[1].lower() == "swift":
         import swift
-        return swift.Swift(script.options.bucket, script.options.noop)
+        return PerThreadStore(lambda: swift.Swift(script.options.bucket,
+            script.options.noop))
     if script.args[1].lower() == "gcs":
         import gcs
         gcsargs = {"project": "", "region": "us"}
         for i in script.args[2:]:
-            fields = i.split("=")
+            fields = i.split("=", 1)
             if len(fields) > 1:
                 gcsargs[fields[0]] = fields[1]
             else:
                 gcsargs["region"] = fields[0]
-        return gcs.GCS(script.options.bucket, gcsargs["project"],
-            gcsargs["region"], script.options.noop)
-
-    logger.error("Invalid storage backend, must be: disk, gcs, noop, s3, or swift")
+        return PerThreadStore(lambda: gcs.GCS(script.options.bucket,
+            gcsargs["project"], gcsargs["region"], script.options.noop,
+            partsize=parseSize(gcsargs.get("partsize", "8M")),
+            parts=int(gcsargs.get("parts", 4)),
+            threshold=parseSize(gcsargs["threshold"]) \
+                    if "threshold" in gcsargs else None))
+
+    logger.error("Invalid storage backend, must be: disk, gcs, noop, s3, sim, or swift")
     sys.exit(1)
 
 
+def openStore(script):
+    """Return our storage backend with each request to it timed in our
+       run statistics."""
+    return InstrumentedStore(storageBackend(script), script.runstats)
+
+
+def openManifest(script, index=None):
+    """Return the local backup manifest for this store, or None if no state
+       directory was configured.  The manifest is rebuilt from a listing
+       of the store when new, when asked, or when a spot check finds it
+       out of date with the store.  If the consolidated Index index has
+       changed since the manifest last saw it, the manifest is also
+       rebuilt when the index no longer has the latest backup of any
+       metric, as another host's purge would leave it."""
+
+    if not script.options.state_dir:
+        return None
+
+    if not os.path.isdir(script.options.state_dir):
+        os.makedirs(script.options.state_dir)
+
+    name = "%s-%s.manifest" % (script.args[1].lower(),
+            script.options.bucket.replace(os.sep, "_"))
+    manifest = Manifest(os.path.join(script.options.state_dir, name))
+
+    if script.options.rebuild_manifest:
+        logger.info("Manifest rebuild requested")
+    elif manifest.getMeta("built") is None:
+        logger.info("No existing manifest found")
+    elif manifest.getMeta("prefix") != script.options.storage_path:
+        logger.info("Manifest was built for a different storage path")
+    elif not manifest.verify(script.store, script.options.manifest_check):
+        logger.warning("Manifest is stale compared to the store")
+    elif index is not None and index.usable and \
+            (index.digest is None or
+             index.digest != manifest.getMeta("index")) and \
+            len(manifest.missing(index, script.options.storage_path)) > 0:
+        logger.warning("Manifest has backups no longer in the index")
+    else:
+        syncManifest(manifest, index)
+        return manifest
+
+    manifest.rebuild(script.store, script.options.storage_path)
+    syncManifest(manifest, index)
+    return manifest
+
+
+def syncManifest(manifest, index):
+    """Record in the manifest the version of the index it agrees with so
+       the next run need not compare them again."""
+    if manifest is not None and index is not None and \
+            index.digest is not None:
+        manifest.setMeta("index", index.digest)
+
+
+def saveIndex(script, merge=True):
+    """Save the consolidated index, if any, and note it in the manifest."""
+    if script.index is None:
+        return
+    script.index.save(merge)
+    syncManifest(getattr(script, "manifest", None), script.index)
+
+
+def openIndex(script, modify=False):
+    """Return the consolidated index object of the store, loaded if present,
+       or None if the index is disabled.  An index that is missing or
+       corrupt is rebuilt from a listing of the store, which also finds
+       the backups packed in bundles.  If we are going to modify the store
+       the index is marked dirty until saved."""
+
+    if script.options.no_index:
+        return None
+
+    index = Index(script.store, script.options.storage_path,
+                  script.options.noop)
+    if not index.load():
+        # We merge our changes into the index, so it must start complete
+        index.rebuild(script.options.storage_path)
+    if modify:
+        index.markDirty()
+
+    return index
+
+
+def timedJob(worker, *args):
+    """Return the seconds worker(*args) took and its result."""
+    t = time.time()
+    result = worker(*args)
+    return time.time() - t, result
+
+
+def reportedJob(worker, *args):
+    """Run worker(*args) in a worker process.  Returns the seconds it took,
+       the messages of any warnings and errors it logged and its result."""
+
+    collector = ErrorCollector()
+    logger.addHandler(collector)
+    try:
+        seconds, result = timedJob(worker, *args)
+    finally:
+        logger.removeHandler(collector)
+    return seconds, collector.messages, result
+
+
 def utc():
     return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
 
@@ -114,203 +414,973 @@ def backup(script):
     # I want to modify these variables in a sub-function, this is the
     # only thing about python 2.x that makes me scream.
     data = {}
-    data['complete'] = 0
     data['length'] = 0
+    data['bundle'] = None
+    # The seconds taken and errors logged by the worker for each metric
+    # whose upload is still to come
+    data['jobs'] = {}
+    # Store paths of backups our retention policy expired, waiting to be
+    # deleted in batches
+    data['expired'] = []
 
     def init(script):
         # The script object isn't pickle-able
         globals()['script'] = script
 
-    def cb(result):
-        # Do some progress tracking when jobs complete
-        data['complete'] = data['complete'] + 1
-        if  data['complete'] % 5 == 0:
-            # Some rate limit on logging
-            logger.info("Progress: %s/%s or %f%%" \
-                    % (data['complete'], data['length'],
-                       100 * float(data['complete']) / float(data['length'])))
+    def done(k, result, seconds=0.0):
+        # Record what was changed in the store
+        m = k[len(script.options.storage_path):]
+        expired = []
+        with lock:
+            if result is not None and script.index is not None:
+                for i in result[1]:
+                    script.index.add(m, *i)
+            if result is not None:
+                data['expired'].extend(result[2])
+                if len(data['expired']) >= script.options.batch_size:
+                    expired = data['expired']
+                    data['expired'] = []
+
+            worker, errors = data['jobs'].pop(k, (0.0, []))
+            stored = 0
+            if result is None:
+                status = "failed"
+            elif len(result[1]) == 0:
+                status = "noop" if script.options.noop else "failed"
+            elif result[1][0][2] is None:
+                status = "unchanged"
+            else:
+                status = "uploaded"
+                stored = result[1][0][2]
+            if status == "failed" and len(errors) == 0:
+                errors = ["Backup failed, see the log"]
+            script.report.add(m, status, sizes[k], stored, worker + seconds,
+                              errors)
+
+            # Do some progress tracking when jobs complete
+            progress.update(sizes[k])
+            if progress.due(script.options.progress_interval):
+                logger.info(progress.message())
+
+        if len(expired) > 0:
+            retire(expired)
+
+    def retire(paths):
+        # Delete expired backups of many metrics in each batched request
+        try:
+            t = time.time()
+            removed = deleteBackups(script, paths)
+            logger.debug("Retention removal of %d backups took %.3f seconds"
+                    % (len(removed), time.time()-t))
+        except Exception as e:
+            # On an error here we want to leave files alone
+            logger.warning("Exception during delete: %s" % str(e))
+            script.runstats.count("errors")
+            return
+
+        removed = [ i.rsplit("/", 1) for i in removed ]
+        if script.manifest is not None:
+            for k, ts in removed:
+                script.manifest.remove(k, ts)
+        if script.index is not None:
+            with lock:
+                for k, ts in removed:
+                    script.index.remove(k[len(script.options.storage_path):],
+                                        ts)
+        if script.options.incremental:
+            for k in set([ k for k, ts in removed ]):
+                collectBlocks(script, k)
+
+    def cb(k, job):
+        seconds, errors, result = job
+        with lock:
+            data['jobs'][k] = (seconds, errors)
+        if result is None or result[3] is None:
+            done(k, result)
+        elif script.options.bundle > 0:
+            pack(result[3])
+        else:
+            # The worker left the store calls to the I/O threads
+            io.apply_async(timedJob, (uploadWorker, script) + result[3],
+                           callback=lambda r: done(k, r[1], r[0]))
+
+    def pack(job):
+        # Add the worker's compressed backup to the current bundle
+        k, timestamp, blobSHA, st, path, knownBackups, codec = job
+        try:
+            if data['bundle'] is None:
+                data['bundle'] = BundleWriter(
+                        bundleKey(script.options.storage_path),
+                        script.options.scratch_dir)
+                data['members'] = []
+            data['bundle'].add(k, timestamp, blobSHA, codec[0], path)
+            data['members'].append(job)
+        except Exception as e:
+            logger.warning("Exception adding %s to bundle: %s" % (k, str(e)))
+            done(k, None)
+        finally:
+            os.unlink(path)
+            script.pending.release()
+
+        if data['bundle'] is not None and \
+                len(data['bundle']) >= script.options.bundle:
+            flush()
+
+    def flush():
+        # Hand the current bundle to the I/O threads to upload
+        if data['bundle'] is not None:
+            io.apply_async(storeBundle,
+                    (script, data['bundle'], data['members']),
+                    callback=lambda results: [ done(r[0], r)
+                                               for r in results ])
+        data['bundle'] = None
+
+    # Callbacks run on both the worker pool's and I/O pool's threads
+    lock = threading.Lock()
 
     logger.info("Scanning filesystem...")
     # Unroll the generator so we can calculate length
-    jobs = [ (k, p) for k, p in listMetrics(script.options.prefix, script.options.storage_path, script.options.metrics) ]
+    with script.runstats.time("scan"):
+        found = list(listMetrics(script.options.prefix,
+                script.options.storage_path, script.options.metrics,
+                script.options.scan_threads))
+    # Start the largest whisper files first so they don't hold up the end
+    # of the run, and weigh progress by size
+    found.sort(key=lambda i: i[2], reverse=True)
+    jobs = [ (k, p) for k, p, size, mtime in found ]
+    sizes = dict([ (k, size) for k, p, size, mtime in found ])
+    del found
     data['length'] = len(jobs)
+    progress = Progress(len(jobs), sum(sizes.values()))
+    script.report.setTotal(len(jobs), progress.size)
+
+    script.zdict = None
+    if script.options.algorithm in ("zst", "auto") and \
+            script.options.zstd_dict and zstandard is not None \
+            and len(jobs) > 0:
+        # Workers inherit this
+        script.zdict = zstdDictionary(script, [ p for k, p in jobs ])
+
+    if script.options.dedup:
+        # The chunks already stored, workers inherit this.  Chunks a
+        # collection has already found unreferenced may be deleted by the
+        # next one before our recipes reference them, so those are
+        # uploaded again rather than reused, see putBlocks().
+        prefix = script.options.storage_path + CHUNKS_NAME + "/"
+        pending = script.store.get(script.options.storage_path
+                                   + CHUNKS_NAME + ".pending")
+        script.pendingChunks = set(pending.split()) \
+                if pending is not None else set()
+        script.chunks = set([ blockSHA(i)
+                for i in script.store.list(prefix=prefix) ])
+        script.chunks.difference_update(script.pendingChunks)
+        logger.info("Found %d chunks in the store, %d pending collection"
+                % (len(script.chunks), len(script.pendingChunks)))
+
+    if script.manifest is not None:
+        # Workers open their own connections
+        script.manifest.close()
+
+    io = None
+    if script.options.io_concurrency > 0 or script.options.bundle > 0:
+        threads = max(script.options.io_concurrency, 1)
+        io = ThreadPool(processes=threads)
+        # Bound the compressed backups waiting on the I/O threads
+        script.pending = BoundedSemaphore(2 * threads)
 
     workers = Pool(processes=script.options.processes,
                    initializer=init, initargs=[script])
-    logger.info("Starting backup of %d whisper files" % data['length'])
+    logger.info("Starting backup of %d whisper files, %.1f MB"
+            % (data['length'], progress.size / 1048576.0))
     for k, p in jobs:
-        workers.apply_async(backupWorker, [k, p], callback=cb)
+        workers.apply_async(reportedJob, [backupWorker, k, p],
+                            callback=lambda job, k=k: cb(k, job))
 
     workers.close()
     workers.join()
-    logger.info("Backup complete")
+    if io is not None:
+        # The last, partly full, bundle
+        flush()
+        io.close()
+        io.join()
+    if len(data['expired']) > 0:
+        retire(data['expired'])
+    statuses = script.report.statuses
+    logger.info("Backup complete -- %d uploaded, %d unchanged, %d failed"
+            % tuple([ statuses.get(i, {}).get("files", 0)
+                      for i in ("uploaded", "unchanged", "failed") ]))
 
     purge(script, { k: True for k, p in jobs })
+    saveIndex(script)
 
 
 def purge(script, localMetrics):
     """Purge backups in our store that are non-existant on local disk and
-       are more than purge days old as set in the command line options."""
+       are more than purge days old as set in the command line options.
+       Returns the number of backups removed."""
 
     # localMetrics must be a dict so we can do fast lookups
 
     if script.options.purge < 0:
-        log.debug("Purge is disabled, skipping")
-        return
+        logger.debug("Purge is disabled, skipping")
+        return 0
 
     logger.info("Beginning purge operation.")
     metrics = search(script)
     expireDate = datetime.datetime.utcnow() - datetime.timedelta(days=script.options.purge)
     expireStamp = expireDate.strftime("%Y-%m-%dT%H:%M:%S+00:00")
-    c = 0
+    expired = []
 
     # Search through the in-store metrics
     for k, v in metrics.items():
-        if k in localMetrics:
+        # localMetrics are full keys that include the storage path
+        if script.options.storage_path + k in localMetrics:
             continue
         for p in v:
             ts = p[p.find("/")+1:]
             if ts < expireStamp:
                 logger.info("Purging %s @ %s" % (k, ts))
-                try:
-                    # Delete the WSP file first, if the delete of the SHA1
-                    # causes the error, the next run will get it, rather
-                    # than just leaking the WSP storage space.
-                    t = time.time()
-                    if not script.options.noop:
-                        script.store.delete("%s%s/%s.wsp.%s"
-                                % (script.options.storage_path, k, ts,
-                                   script.options.algorithm))
-                        script.store.delete("%s%s/%s.sha1"
-                                % (script.options.storage_path, k, ts))
-                    else:
-                        # Do a list to check for 404s
-                        t = "%s%s/%s" % (k, ts)
-                        d = [ i for i in script.store.list("%s.wsp.%s" \
-                                % (t, script.options.algorithm)) ]
-                        if len(d) == 0:
-                            logger.warn("Purge: Missing file in store: %s.wsp.%s" \
-                                    % (p, script.options.algorithm))
-                        d = [ i for i in script.store.list("%s.sha1" % t) ]
-                        if len(d) == 0:
-                            logger.warn("Purge: Missing file in store: %s.sha1" % t)
-
-                    logger.debug("Purge of %s @ %s took %d seconds" % (k, ts, time.time()-t))
-                except KeyboardInterrupt:
-                    raise
-                except Exception as e:
-                    # On an error here we want to leave files alone.
-                    # This includes file not found (404) errors
-                    logger.warning("Exception during delete: %s" % str(e))
-                else:
-                    c += 1
+                expired.append((k, ts))
+    script.report.count("expired", len(expired))
+
+    if script.options.noop:
+        purgeReport(script, expired)
+        collectChunks(script)
+        collectBundles(script)
+        return 0
+
+    # Each batch is one set of delete requests, run several batches at
+    # once.  Each thread uses its own connection, see PerThreadStore.
+    batches = [ expired[n:n+script.options.batch_size]
+                for n in range(0, len(expired), script.options.batch_size) ]
+    threads = script.options.io_concurrency or script.options.processes
+    workers = ThreadPool(processes=max(min(threads, len(batches)), 1))
+    c = 0
+    purged = set()
+    progress = Progress(len(expired), 0, "backups")
+    try:
+        for batch, done in workers.imap_unordered(
+                lambda batch: (batch, purgeWorker(script, batch)), batches):
+            for k, ts in set(batch).difference(done):
+                script.report.error(k, "Failed to purge backup %s" % ts)
+            script.report.count("purged", len(done))
+            script.report.count("purge_failed", len(batch) - len(done))
+            for i in batch:
+                progress.update()
+            if progress.due(script.options.progress_interval):
+                logger.info(progress.message())
+            # The index is only touched from this thread
+            for k, ts in done:
+                if script.manifest is not None:
+                    script.manifest.remove(script.options.storage_path + k, ts)
+                if script.index is not None:
+                    script.index.remove(k, ts)
+                purged.add(script.options.storage_path + k)
+            c += len(done)
+        # Blocks no longer referenced by the remaining backups of a metric
+        b = sum(workers.map(lambda k: collectBlocks(script, k), purged))
+        if b > 0:
+            logger.info("Purge removed %d unreferenced blocks" % b)
+    finally:
+        workers.close()
+        workers.join()
+
+    collectChunks(script)
+    collectBundles(script)
 
     logger.info("Purge complete -- %d backups removed" % c)
+    return c
+
+
+def purgeWorker(script, expired):
+    """Delete the list of (metric, timestamp) backups in expired.  Returns
+       the ones that were removed."""
+
+    paths = dict([ ("%s%s/%s" % (script.options.storage_path, k, ts),
+                    (k, ts)) for k, ts in expired ])
+    t = time.time()
+    try:
+        done = deleteBackups(script, paths.keys())
+    except Exception as e:
+        # On an error here we want to leave files alone.
+        logger.warning("Exception during delete: %s" % str(e))
+        script.runstats.count("errors")
+        return []
+
+    logger.debug("Purge of %d backups took %.3f seconds"
+            % (len(done), time.time()-t))
+    return [ paths[i] for i in done ]
+
+
+def purgeReport(script, expired):
+    """Log what purging the list of (metric, timestamp) backups in expired
+       would reclaim.  Sizes come from a single listing of the store."""
+
+    sizes = dict(script.store.listSizes(prefix=script.options.storage_path))
+    objects = 0
+    size = 0
+    for k, ts in expired:
+        if script.index is not None and script.index.location(k, ts):
+            # Its bundle goes once all of the bundle has expired
+            continue
+        path = "%s%s/%s" % (script.options.storage_path, k, ts)
+        # An incremental backup has a recipe, its blocks may be shared
+        payload = "%s.wsp.*" % path
+        for i in [ "%s.wsp.%s" % (path, a) for a in ALGORITHMS ] + \
+                 [ "%s.blocks" % path ]:
+            if i in sizes:
+                payload = i
+        for i in [ payload, "%s.sha1" % path ]:
+            if i in sizes:
+                objects += 1
+                size += sizes[i]
+            else:
+                logger.warn("Purge: Missing file in store: %s" % i)
+
+    logger.info("Purge dry run -- %d metrics, %d backups, %d objects and " \
+                "%d bytes would be removed"
+                % (len(set([ k for k, ts in expired ])), len(expired),
+                   objects, size))
+
+
+def payloadKeys(script, path):
+    """Return the store keys the payload of the backup at path, a metric
+       key and timestamp, may be under.  The payload is a compressed file
+       or an incremental backup recipe.  Where the index or the manifest
+       tells us which, and the index its algorithm, we only return that
+       key, deleting the others would only ask the store for objects that
+       aren't there."""
+
+    k, ts = path.rsplit("/", 1)
+    m = k[len(script.options.storage_path):]
+    full = [ "%s.wsp.%s" % (path, a) for a in ALGORITHMS ]
+    if script.index is not None and script.index.usable:
+        if script.index.location(m, ts) is not None:
+            # Bundled, it has no objects of its own
+            return []
+        if script.index.algorithm(m, ts) is not None:
+            return [ "%s.wsp.%s" % (path, script.index.algorithm(m, ts)) ]
+    if script.manifest is not None and \
+            script.manifest.recipe(k, ts) is not None:
+        return [ "%s.blocks" % path ]
+    return full + [ "%s.blocks" % path ]
+
+
+def deleteBackups(script, paths):
+    """Delete the backups at the given store paths, each a metric key and
+       timestamp without an extension, using batched deletes.  Blocks of
+       incremental backups are left for collectBlocks().  Payloads go
+       first and a SHA1 is only removed once its payload is gone, so a
+       failure never leaves a payload without its canary for the next run
+       to find.  Returns the paths that were completely removed."""
+
+    done = []
+    for n in range(0, len(paths), script.options.batch_size):
+        batch = paths[n:n+script.options.batch_size]
+        payloads = dict([ (i, payloadKeys(script, i)) for i in batch ])
+        failed = set(script.store.deleteMany(sum(payloads.values(), [])))
+        batch = [ i for i in batch
+                  if len(failed.intersection(payloads[i])) == 0 ]
+        # A bundled backup has no SHA1 object either
+        failed = set(script.store.deleteMany([ "%s.sha1" % i for i in batch
+                                               if len(payloads[i]) > 0 ]))
+        done.extend([ i for i in batch if "%s.sha1" % i not in failed ])
+
+    return done
 
 
 def backupWorker(k, p):
+    """Backup the whisper file at path p as metric key k.  Returns a tuple
+       of k, a list of (timestamp, sha1, size) backups added to the store,
+       a list of the store paths of backups retention expired, and the
+       arguments for uploadWorker() if the store calls were left to the I/O threads."""
+
     # Inside this fuction/process 'script' is global
     logger.info("Backup: Processing %s ..." % k)
+
+    # If the file looks exactly as it did at its last backup we need not
+    # lock, read or hash it.
+    if script.manifest is not None and not script.options.paranoid:
+        try:
+            st = statKey(os.stat(p))
+        except OSError as e:
+            logger.warning("An OSError occured stating %s: %s" % (k, str(e)))
+            script.runstats.count("errors")
+            return
+        backups = script.manifest.backups(k)
+        if script.manifest.stat(k) == st and len(backups) > 0:
+            logger.info("Metric DB %s is unchanged since last backup " \
+                        "according to stat(), skipping." % k)
+            script.runstats.count("files_unchanged")
+            return k, [(backups[-1][0], backups[-1][1], None)], [], None
+
     # We acquire a file lock using the same locks whisper uses.  flock()
     # exclusive locks are cleared when the file handle is closed.  This
     # is the same practice that the whisper code uses.
     logger.debug("Locking file...")
+    blob = None
+    snapshot = None
     try:
         with open(p, "rb") as fh:
+            t = time.time()
             fcntl.flock(fh.fileno(), fcntl.LOCK_EX)  # May block
-            blob = fh.read()
+            locked = time.time()
+            # What the file looked like while we held the lock
+            st = statKey(os.fstat(fh.fileno()))
+            with script.runstats.time("read"):
+                blob = fh.read()
+            script.runstats.count("bytes_read", st[1])
             timestamp = utc()
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            script.runstats.add("lock_wait", locked - t)
+            script.runstats.add("lock_held", time.time() - locked)
+            logger.debug("Lock on %s waited %.3f seconds, held %.3f seconds"
+                    % (k, locked - t, time.time() - locked))
+        if script.options.stream:
+            # Now the lock is released, move large files aside to scratch
+            # so hashing, compressing and uploading happen from the
+            # snapshot a chunk at a time
+            snapshot = snapshotFile(blob, script.options.scratch_dir,
+                                    script.options.buffer_size)
+            blob = None
     except IOError as e:
         logger.warning("An IOError occured locking %s: %s" \
                 % (k, str(e)))
+        script.runstats.count("errors")
         return
     except Exception as e:
         logger.error("An Unknown exception occurred, skipping metric: %s"
                 % str(e))
+        script.runstats.count("errors")
         return
 
-    # SHA1 hash...have we seen this metric DB file before?
-    logger.debug("Calculating hash and searching data store...")
-    blobSHA = hashlib.sha1(blob).hexdigest()
+    # Have we seen this metric DB file before?
+    logger.debug("Searching data store...")
     knownBackups = []
-    for i in script.store.list(k+"/"):
-        if i.endswith(".sha1"):
-            knownBackups.append(i)
+    lastSHA = None
+    if script.manifest is not None:
+        # The local manifest saves us a LIST and a GET per metric
+        for ts, sha in script.manifest.backups(k):
+            knownBackups.append("%s/%s.sha1" % (k, ts))
+            lastSHA = sha
+    elif script.options.bundle > 0:
+        # Bundled backups have nothing under the metric to list, the
+        # index loaded before the workers started knows them
+        for i in script.index.metrics.get(
+                k[len(script.options.storage_path):], []):
+            knownBackups.append("%s/%s.sha1" % (k, i[0]))
+            lastSHA = i[1]
+    else:
+        for i in script.store.list(k+"/"):
+            if i.endswith(".sha1"):
+                knownBackups.append(i)
 
     knownBackups.sort()
+    if len(knownBackups) > 0 and lastSHA is None:
+        lastSHA = script.store.get(knownBackups[-1])
+        if script.manifest is not None and lastSHA is not None:
+            script.manifest.add(k, knownBackups[-1][len(k)+1:-5], lastSHA)
+
+    # Checksum the file in one pass with our digest and, if it used
+    # another, the digest of the last backup so a change of digest
+    # doesn't make every file look changed
+    logger.debug("Calculating checksum...")
+    digests = [script.options.digest]
+    if lastSHA is not None:
+        d = parseDigest(lastSHA)[0]
+        if d not in digests and d in available():
+            digests.append(d)
+    with script.runstats.time("hash"):
+        if blob is not None:
+            checksums = digestChunks([blob], digests)
+        else:
+            checksums = digestChunks(readChunks(snapshot), digests)
+    blobSHA = checksums[script.options.digest]
+
     if len(knownBackups) > 0:
         i = knownBackups[-1] # The last known backup
         logger.debug("Examining %s from data store of %d backups"
                 % (i, len(knownBackups)))
-        if script.store.get(i) == blobSHA:
+        if lastSHA is not None and lastSHA in checksums.values():
             logger.info("Metric DB %s is unchanged from last backup, " \
                         "skipping." % k)
+            script.runstats.count("files_unchanged")
+            if script.manifest is not None:
+                script.manifest.setStat(k, st)
+            if snapshot is not None:
+                snapshot.close()
             # We purposely do not check retention in this case
-            return
+            return k, [(i[len(k)+1:-5], lastSHA, None)], [], None
 
     # We're going to backup this file, compress it as a normal .gz
     # file so that it can be restored manually if needed
+    payload = None
+    codec = (script.options.algorithm, script.options.zstd_level)
     if not script.options.noop:
+        codec = pickCodec(script, k, snapshot if blob is None else blob,
+                          st[1])
+    if not script.options.noop and script.options.incremental:
+        # Blocks are hashed and compressed as they are uploaded
+        if snapshot is not None:
+            snapshot.seek(0)
+            payload = readChunks(snapshot)
+        else:
+            payload = blob
+        del blob
+    elif not script.options.noop:
         logger.debug("Compressing data...")
-        blobgz = StringIO()
-        if script.options.algorithm == "gz":
-            fd = gzip.GzipFile(fileobj=blobgz, mode="wb")
-            fd.write(blob)
-            fd.close()
-        elif script.options.algorithm == "sz":
-            compressor = snappy.StreamCompressor()
-            blobgz.write(compressor.compress(blob))
+        if snapshot is not None:
+            # Compress from the snapshot a chunk at a time
+            snapshot.seek(0)
+            if script.options.transform:
+                chunks = encodeFile(snapshot, st[1])
+            else:
+                chunks = readChunks(snapshot)
+            # Compression happens as the payload is uploaded
+            payload = script.runstats.timeIterator(
+                    compressPayload(script, chunks, codec, st[1]), "compress")
         else:
-            raise StandardError("Unknown compression format requested")
+            t = time.time()
+            if script.options.transform:
+                blob = encode(blob)
+            blobgz = StringIO()
+            if script.parallel_threshold > 0 and \
+                    len(blob) > script.parallel_threshold:
+                for chunk in compressPayload(script, [blob], codec,
+                                             len(blob)):
+                    blobgz.write(chunk)
+            elif codec[0] == "gz":
+                fd = gzip.GzipFile(fileobj=blobgz, mode="wb")
+                fd.write(blob)
+                fd.close()
+            elif codec[0] == "sz":
+                compressor = snappy.StreamCompressor()
+                blobgz.write(compressor.compress(blob))
+            elif codec[0] == "zst":
+                for chunk in compressPayload(script, [blob], codec):
+                    blobgz.write(chunk)
+            else:
+                raise StandardError("Unknown compression format requested")
+            payload = blobgz.getvalue()
+            blobgz.close()
+            script.runstats.add("compress", time.time() - t)
+        del blob
+
+    if (script.options.io_concurrency > 0 or script.options.bundle > 0) \
+            and payload is not None:
+        # Leave the store calls to the I/O threads in the parent.  The
+        # compressed data waits for them in a scratch file.  The slot and
+        # the file are only handed on if writing it succeeds.
+        script.pending.acquire()
+        path = None
+        try:
+            fd, path = tempfile.mkstemp(prefix="whisper-backup",
+                                        dir=script.options.scratch_dir)
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in [payload] if isinstance(payload, str) \
+                        else payload:
+                    fh.write(chunk)
+        except Exception as e:
+            logger.warning("Exception writing %s to scratch: %s"
+                    % (k, str(e)))
+            script.runstats.count("errors")
+            if path is not None:
+                os.unlink(path)
+            script.pending.release()
+            return
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+        return k, [], [], (k, timestamp, blobSHA, st, path, knownBackups,
+                           codec)
+
+    result = storeBackup(script, k, timestamp, blobSHA, st, payload,
+                         knownBackups, codec)
+
+    # Free Memory
+    if snapshot is not None:
+        snapshot.close()
+
+    return result + (None,)
+
+
+def uploadWorker(script, k, timestamp, blobSHA, st, path, knownBackups,
+                 codec):
+    """Store the backup of metric key k that backupWorker compressed into
+       the scratch file at path, then remove it.  Runs in an I/O thread of
+       the parent process.  Returns the same as storeBackup()."""
+
+    try:
+        with open(path, "rb") as fh:
+            return storeBackup(script, k, timestamp, blobSHA, st,
+                               readChunks(fh), knownBackups, codec)
+    finally:
+        os.unlink(path)
+        script.pending.release()
+
+
+def storeBackup(script, k, timestamp, blobSHA, st, payload, knownBackups,
+                codec):
+    """Upload the payload, a string or iterator of strings compressed with
+       the (algorithm, level) tuple codec, and SHA1 of metric key k as the
+       backup at timestamp, then enforce our retention policy on the older
+       knownBackups.  Returns a tuple of k, a list of (timestamp, sha1,
+       size, location, algorithm) backups added to the store and a list of
+       the store paths of backups retention expired."""
 
     # Grab our timestamp and assemble final upstream key location
-    logger.debug("Uploading payload as: %s/%s.wsp.%s" \
-            % (k, timestamp, script.options.algorithm))
+    algorithm = codec[0]
+    if script.options.incremental:
+        logger.debug("Uploading blocks as : %s/%s.blocks" % (k, timestamp))
+    else:
+        logger.debug("Uploading payload as: %s/%s.wsp.%s" \
+                % (k, timestamp, algorithm))
     logger.debug("Uploading SHA1 as   : %s/%s.sha1" % (k, timestamp))
+    added = []
     try:
         if not script.options.noop:
             t = time.time()
-            script.store.put("%s/%s.wsp.%s" \
-                    % (k, timestamp, script.options.algorithm), blobgz.getvalue())
+            if script.options.incremental:
+                size = putBlocks(script, k, timestamp, payload, knownBackups,
+                                 codec)
+                # The recipe records the algorithm of each block
+                algorithm = None
+            elif isinstance(payload, str):
+                script.store.put("%s/%s.wsp.%s" \
+                        % (k, timestamp, algorithm), payload)
+                size = len(payload)
+            else:
+                payload = Counter(payload)
+                script.store.putStream("%s/%s.wsp.%s" \
+                        % (k, timestamp, algorithm), payload)
+                size = payload.bytes
+            with script.bandwidth.get_lock():
+                script.bandwidth.value = measureBandwidth(
+                        script.bandwidth.value, size, time.time() - t)
             script.store.put("%s/%s.sha1" % (k, timestamp), blobSHA)
-            logger.debug("Upload of %s @ %s took %d seconds"
+            added.append((timestamp, blobSHA, size, None, algorithm))
+            if script.manifest is not None:
+                script.manifest.add(k, timestamp, blobSHA)
+                script.manifest.setStat(k, st)
+            logger.debug("Upload of %s @ %s took %.3f seconds"
                     % (k, timestamp, time.time()-t))
     except Exception as e:
         logger.warning("Exception during upload: %s" % str(e))
+        script.runstats.count("errors")
 
-    # Free Memory
-    blobgz.close()
-    del blob
+    removed = enforceRetention(script, k, knownBackups)
+    return k, added, removed
+
+
+def storeBundle(script, bundle, jobs):
+    """Upload the BundleWriter bundle holding the backups backupWorker
+       compressed for jobs, then enforce our retention policy on each of
+       their metrics.  Returns a list of results like storeBackup()."""
+
+    try:
+        t = time.time()
+        script.store.putStream(bundle.key, readChunks(bundle.finish()))
+        logger.debug("Upload of bundle %s of %d backups took %.3f seconds"
+                % (bundle.key, len(bundle), time.time()-t))
+    except Exception as e:
+        logger.warning("Exception during upload of bundle %s: %s"
+                % (bundle.key, str(e)))
+        script.runstats.count("errors", len(jobs))
+        return [ (job[0], [], []) for job in jobs ]
+    finally:
+        bundle.close()
+
+    results = []
+    for job, member in zip(jobs, bundle.members):
+        k, timestamp, blobSHA, st, path, knownBackups, codec = job
+        location = makeLocation(bundle.key, member[4], member[5])
+        if script.manifest is not None:
+            script.manifest.add(k, timestamp, blobSHA, location)
+            script.manifest.setStat(k, st)
+        removed = enforceRetention(script, k, knownBackups)
+        results.append((k, [(timestamp, blobSHA, member[5], location,
+                             codec[0])], removed))
+
+    return results
+
+
+def enforceRetention(script, k, knownBackups):
+    """Expire the oldest of the knownBackups of metric key k so that with
+       the backup just made we keep at most our retention.  Returns the
+       list of store paths of the expired backups, which the parent
+       deletes in batches with those of other metrics."""
 
     # Handle our retention policy, we keep at most X backups
+    expired = []
     while len(knownBackups) + 1 > script.options.retention:
         # The oldest (and not current) backup
-        i = knownBackups[0].replace(".sha1", "")
-        logger.info("Removing old backup: %s.wsp.%s" % (i, script.options.algorithm))
+        i = knownBackups.pop(0).replace(".sha1", "")
+        logger.info("Removing old backup: %s" % i)
         logger.debug("Removing old SHA1: %s.sha1" % i)
+        if not script.options.noop:
+            expired.append(i)
+            continue
+
+        # Do a list, we want to log if there's a 404
+        d = [ j for j in script.store.list("%s.wsp." % i) ]
+        if len(d) == 0:
+            logger.warn("Missing file in store: %s.wsp.*" % i)
+        d = [ j for j in script.store.list("%s.sha1" % i) ]
+        if len(d) == 0:
+            logger.warn("Missing file in store: %s.sha1" % i)
+
+    return expired
+
+
+def putBlocks(script, k, timestamp, payload, knownBackups, codec):
+    """Upload the whisper file in payload, a string or iterator of strings,
+       as an incremental backup of metric key k at timestamp compressing
+       blocks with the (algorithm, level) tuple codec.  Only blocks not
+       already stored are uploaded, followed by the recipe.  Returns the
+       number of bytes uploaded."""
+
+    shared = script.options.dedup
+    prefix = blockPrefix(script.options.storage_path, k, shared)
+    # Shared chunks pending collection that we uploaded again
+    recheck = {}
+    if shared:
+        # Chunks listed from the store when the run began
+        stored = script.chunks
+    else:
+        stored = set()
+    # Shared chunks are all in the listing, trust it over the last recipe
+    if not shared and len(knownBackups) > 0:
+        recipe = script.store.get(knownBackups[-1][:-5] + ".blocks")
+        if recipe is not None:
+            try:
+                recipe = parseRecipe(recipe)
+                if not recipe[4]:
+                    stored.update(recipe[3])
+            except ValueError as e:
+                logger.warning("Ignoring recipe of %s: %s"
+                        % (knownBackups[-1][:-5], str(e)))
+
+    if isinstance(payload, str):
+        payload = [payload]
+    shas = []
+    length = 0
+    size = 0
+    for block in regroupChunks(payload, script.options.block_size):
+        sha = hashlib.sha1(block).hexdigest()
+        shas.append(sha)
+        length += len(block)
+        if sha in stored:
+            continue
+        data = "".join(compressPayload(script, [block], codec))
+        script.store.put(blockKey(prefix, sha, codec[0]), data)
+        stored.add(sha)
+        size += len(data)
+        if shared and sha in script.pendingChunks:
+            recheck[blockKey(prefix, sha, codec[0])] = data
+
+    recipe = makeRecipe(codec[0], script.options.block_size,
+                        length, shas, shared)
+    script.store.put("%s/%s.blocks" % (k, timestamp), recipe)
+    # A collection that listed the recipes before ours was stored may have
+    # deleted a pending chunk we uploaded, collections from now on see it
+    # referenced
+    for key, data in recheck.items():
+        if len([ i for i in script.store.list(prefix=key) ]) == 0:
+            logger.warning("Chunk %s was collected, uploading again" % key)
+            script.store.put(key, data)
+            size += len(data)
+    if script.manifest is not None:
+        script.manifest.setRecipe(k, timestamp, recipe)
+    logger.debug("Incremental backup of %s uploaded %d bytes of blocks"
+            % (k, size))
+    return size + len(recipe)
+
+
+def getBlocks(script, k, recipe):
+    """Return the whisper file of metric key k reassembled from the blocks
+       listed in the incremental backup recipe."""
+
+    algorithm, blockSize, size, shas, shared = parseRecipe(recipe)
+    prefix = blockPrefix(script.options.storage_path, k, shared)
+    blocks = {}
+    for sha in shas:
+        if sha in blocks:
+            continue
+        data = script.store.get(blockKey(prefix, sha, algorithm))
+        if data is None:
+            raise StandardError("Missing block in store: %s"
+                    % blockKey(prefix, sha, algorithm))
+        blocks[sha] = decompressPayload(script, data, algorithm)
+        if hashlib.sha1(blocks[sha]).hexdigest() != sha:
+            raise StandardError("Corrupt block in store: %s"
+                    % blockKey(prefix, sha, algorithm))
+
+    blob = "".join([ blocks[sha] for sha in shas ])
+    if len(blob) != size:
+        raise StandardError("Reassembled %d bytes, expected %d"
+                % (len(blob), size))
+    return blob
+
+
+def readRecipes(script, keys):
+    """Return a dict of the recipe store keys in keys to their parsed
+       recipes, fetched on a pool of threads.  Recipes never change, so
+       with a local manifest each is only fetched once.  Missing or
+       unreadable recipes map to None."""
+
+    def read(key):
+        n = key.rfind("/")
+        recipe = None
+        if script.manifest is not None:
+            recipe = script.manifest.recipe(key[:n], key[n+1:-7])
+        if recipe is None:
+            recipe = script.store.get(key)
+            if recipe is not None and script.manifest is not None:
+                script.manifest.setRecipe(key[:n], key[n+1:-7], recipe)
+        if recipe is None:
+            return key, None
         try:
-            t = time.time()
-            if not script.options.noop:
-                script.store.delete("%s.wsp.%s" % (i, script.options.algorithm))
-                script.store.delete("%s.sha1" % i)
-            else:
-                # Do a list, we want to log if there's a 404
-                d = [ i for i in script.store.list("%s.wsp.%s" \
-                        % (i, script.options.algorithm)) ]
-                if len(d) == 0:
-                    logger.warn("Missing file in store: %s.wsp.%s" \
-                            % (i, script.options.algorithm))
-                d = [ i for i in script.store.list("%s.sha1" % i) ]
-                if len(d) == 0:
-                    logger.warn("Missing file in store: %s.sha1" % i)
-
-            logger.debug("Retention removal of %s took %d seconds"
-                    % (i, time.time()-t))
-        except Exception as e:
-            # On an error here we want to leave files alone
-            logger.warning("Exception during delete: %s" % str(e))
+            return key, parseRecipe(recipe)
+        except ValueError as e:
+            logger.warning("Bad recipe %s: %s" % (key, str(e)))
+            return key, None
 
-        del knownBackups[0]
+    # Each thread uses its own connection, see PerThreadStore
+    workers = ThreadPool(script.options.io_concurrency or script.options.processes)
+    try:
+        return dict(workers.map(read, keys))
+    finally:
+        workers.close()
+        workers.join()
+
+
+def collectChunks(script):
+    """Garbage collect the shared chunk store.  Every recipe in the store
+       is read to find the chunks still referenced.  A chunk is deleted
+       once it has been unreferenced at two consecutive collections, so a
+       backup that is running elsewhere has time to upload the recipe of
+       a chunk it uploaded or reused.  Returns the number deleted."""
+
+    prefix = script.options.storage_path + CHUNKS_NAME + "/"
+    pendingKey = script.options.storage_path + CHUNKS_NAME + ".pending"
+    stored = {}
+    for i in script.store.list(prefix=prefix):
+        if blockSHA(i) is not None:
+            stored.setdefault(blockSHA(i), []).append(i)
+    if len(stored) == 0:
+        return 0
+
+    logger.info("Collecting unreferenced chunks from %d in the store"
+            % len(stored))
+    keys = [ i for i in script.store.list(prefix=script.options.storage_path)
+             if i.endswith(".blocks") ]
+    referenced = set()
+    for key, recipe in readRecipes(script, keys).items():
+        if recipe is None:
+            if script.store.get(key) is not None:
+                # Unreadable but present, we can't know what is safe
+                logger.warning("Not collecting chunks, bad recipe %s" % key)
+                return 0
+            continue
+        if recipe[4]:
+            referenced.update(recipe[3])
+
+    unused = set(stored.keys()) - referenced
+    pending = script.store.get(pendingKey)
+    pending = set(pending.split()) if pending is not None else set()
+    doomed = unused.intersection(pending)
+    if script.options.noop:
+        logger.info("Chunk collection dry run -- %d unreferenced chunks, " \
+                    "%d would be removed" % (len(unused), len(doomed)))
+        return 0
+
+    failed = set(script.store.deleteMany(sum([ stored[i] for i in doomed ], [])))
+    failed = set([ blockSHA(i) for i in failed ])
+    # Chunks unreferenced for the first time wait for the next collection
+    script.store.put(pendingKey,
+            "\n".join(sorted(unused - doomed | failed)) + "\n")
+    logger.info("Collected %d unreferenced chunks, %d more pending"
+            % (len(doomed) - len(failed), len(unused - doomed | failed)))
+    return len(doomed) - len(failed)
+
+
+def collectBundles(script):
+    """Delete the bundles that hold no backup in the index.  Like chunks a
+       bundle is deleted once it has been unreferenced at two consecutive
+       collections, as a backup running elsewhere may have uploaded it but
+       not yet saved the index that references it, and bundles started
+       since this run began are never touched.  Returns the number
+       deleted."""
+
+    if script.index is None or not script.index.usable:
+        return 0
+
+    prefix = script.options.storage_path + BUNDLES_NAME + "/"
+    pendingKey = script.options.storage_path + BUNDLES_NAME + ".pending"
+    referenced = script.index.bundles()
+    unused = set()
+    for i in script.store.list(prefix=prefix):
+        if not i.endswith(".bundle") or i in referenced:
+            continue
+        started = bundleTime(i)
+        if started is None or started >= int(script.runstats.start):
+            continue
+        unused.add(i)
+
+    pending = script.store.get(pendingKey)
+    pending = set(pending.split()) if pending is not None else set()
+    if len(unused) == 0 and len(pending) == 0:
+        return 0
+    doomed = unused.intersection(pending)
+    if script.options.noop:
+        logger.info("Bundle collection dry run -- %d unreferenced bundles, " \
+                    "%d would be removed" % (len(unused), len(doomed)))
+        return 0
+
+    failed = set(script.store.deleteMany(sorted(doomed)))
+    # Bundles unreferenced for the first time wait for the next collection
+    script.store.put(pendingKey,
+            "\n".join(sorted(unused - doomed | failed)) + "\n")
+    logger.info("Removed %d bundles with no remaining backups, %d more "
+                "pending" % (len(doomed) - len(failed),
+                             len(unused - doomed | failed)))
+    return len(doomed) - len(failed)
+
+
+def collectBlocks(script, k):
+    """Delete the blocks of metric key k that no remaining incremental
+       backup references.  Returns the number of blocks deleted."""
+
+    stored = []
+    recipes = []
+    for i in script.store.list(k + "/"):
+        if blockSHA(i) is not None:
+            stored.append(i)
+        elif i.endswith(".blocks"):
+            recipes.append(i)
+    if len(stored) == 0:
+        return 0
+
+    referenced = set()
+    for i in recipes:
+        recipe = script.store.get(i)
+        if recipe is None:
+            continue
+        try:
+            recipe = parseRecipe(recipe)
+            if not recipe[4]:
+                referenced.update(recipe[3])
+        except ValueError as e:
+            # Keep everything rather than break a backup we can't read
+            logger.warning("Not collecting blocks of %s, bad recipe %s: %s"
+                    % (k, i, str(e)))
+            return 0
+
+    unused = [ i for i in stored if blockSHA(i) not in referenced ]
+    failed = script.store.deleteMany(unused)
+    logger.debug("Collected %d unreferenced blocks of %s"
+            % (len(unused) - len(failed), k))
+    return len(unused) - len(failed)
 
 
 def findBackup(script, objs, date):
@@ -345,34 +1415,38 @@ def heal(script, metric, data):
     path = toPath(script.options.prefix, metric)
     error = False
 
-    # Make a tmp file
-    fd, filename = tempfile.mkstemp(prefix="whisper-backup")
-    fd = os.fdopen(fd, "wb")
-    fd.write(data)
-    fd.close()
-
     # Figure out what to do
     if os.path.exists(path):
         logger.debug("Healing existing whisper file: %s" % path)
         try:
-            fill_archives(filename, path, time.time())
+            # Fill straight from the in memory copy of the backup
+            fill_archives(StringIO(data), path, time.time())
         except Exception as e:
             logger.warning("Exception during heal of %s will overwrite." % path)
             logger.warning(str(e))
             error = True
 
-    # Last ditch effort, we just copy the file in place
+    # Last ditch effort, we just write the file in place
     if error or not os.path.exists(path):
-        logger.debug("Copying restored DB file into place")
+        logger.debug("Writing restored DB file into place")
         try:
             os.makedirs(os.path.dirname(path))
         except os.error:
             # Directory exists
             pass
 
-        shutil.copyfile(filename, path)
-
-    os.unlink(filename)
+        # Write beside the destination and rename it into place so a
+        # reader never sees a partial whisper file
+        filename = os.path.join(os.path.dirname(path), ".%s.%d" \
+                % (os.path.basename(path), os.getpid()))
+        try:
+            with open(filename, "wb") as fd:
+                fd.write(data)
+            os.rename(filename, path)
+        except:
+            if os.path.exists(filename):
+                os.unlink(filename)
+            raise
 
 def search(script):
     """Return a hash such that all keys are metric names found in our
@@ -381,6 +1455,10 @@ def search(script):
        all present backups.  Technically, the path to the SHA1 checksum file
        but the path will not have the ".sha1" extension."""
 
+    if script.index is not None and script.index.usable:
+        logger.info("Searching store index...")
+        return script.index.search(script.options.metrics)
+
     logger.info("Searching remote file store...")
     metrics = {}
 
@@ -397,70 +1475,198 @@ def search(script):
 
 
 def restore(script):
+    data = {}
+    data['complete'] = 0
+    data['failed'] = 0
+    data['length'] = 0
+
+    def init(script):
+        # The script object isn't pickle-able
+        globals()['script'] = script
+
+    def cb(i, size, job):
+        seconds, errors, result = job
+        if not result:
+            data['failed'] = data['failed'] + 1
+            script.runstats.count("errors")
+            script.report.add(i, "failed", size, 0, seconds,
+                              errors or ["Restore failed, see the log"])
+        else:
+            script.report.add(i, "restored", size, 0, seconds, errors)
+
+        # Do some progress tracking when jobs complete
+        data['complete'] = data['complete'] + 1
+        progress.update(size)
+        if progress.due(script.options.progress_interval):
+            logger.info(progress.message())
+
     # Build a list of metrics to restore from our object store and globbing
     metrics = search(script)
 
-    # For each metric, find the date we want
+    # For each metric, find the date we want.  Progress is weighed by the
+    # stored size of each backup when the index knows it.
+    jobs = []
+    sizes = []
     for i in metrics.keys():
-        objs = metrics[i]
-        d = findBackup(script, objs, script.options.date)
+        d = findBackup(script, metrics[i], script.options.date)
+        if d is None:
+            continue
+        blobSHA = None
+        location = None
+        algorithm = None
+        size = 0
+        if script.index is not None and script.index.usable:
+            blobSHA = script.index.sha1(i, d)
+            location = script.index.location(i, d)
+            algorithm = script.index.algorithm(i, d)
+            size = script.index.size(i, d) or 0
+        jobs.append((i, d, blobSHA, location, algorithm))
+        sizes.append(size)
+    data['length'] = len(jobs)
+    progress = Progress(len(jobs), sum(sizes))
+    script.report.setTotal(len(jobs), progress.size)
+
+    workers = Pool(processes=script.options.processes,
+                   initializer=init, initargs=[script])
+    logger.info("Starting restore of %d whisper files" % data['length'])
+    for job, size in zip(jobs, sizes):
+        workers.apply_async(reportedJob, (restoreWorker,) + job,
+                callback=lambda r, i=job[0], size=size: cb(i, size, r))
+
+    workers.close()
+    workers.join()
+    logger.info("Restore complete -- %d restored, %d failed"
+            % (data['complete'] - data['failed'], data['failed']))
+
+
+def findAlgorithm(script, path):
+    """Return the compression algorithm of the backup at the store path, a
+       metric key and timestamp without an extension, from a listing, or
+       None if it has no compressed file."""
+
+    for i in script.store.list("%s.wsp." % path):
+        algorithm = i[len(path)+5:]
+        if algorithm in ALGORITHMS:
+            return algorithm
+    return None
+
+
+def restoreWorker(i, d, blobSHA, location=None, algorithm=None):
+    """Restore metric i from its backup at timestamp d.  blobSHA is the
+       SHA1 of that backup if already known, location is where it is
+       in a bundle, if packed in one, and algorithm is its compression
+       algorithm if known.  Returns True on success.
+       Errors are logged and never raised so one bad backup doesn't take
+       the rest of the restore with it."""
+
+    # Inside this fuction/process 'script' is global
+    try:
         logger.info("Restoring %s from timestamp %s" % (i, d))
 
-        blobgz  = script.store.get("%s%s/%s.wsp.%s" \
-                % (script.options.storage_path, i, d, script.options.algorithm))
-        blobSHA = script.store.get("%s%s/%s.sha1" \
-                % (script.options.storage_path, i, d))
+        path = "%s%s/%s" % (script.options.storage_path, i, d)
+        if algorithm is None and script.options.algorithm != "auto":
+            # Most likely it was made with the algorithm we were given
+            algorithm = script.options.algorithm
+        blobgz = None
+        if location is not None:
+            # Fetch just this backup from its bundle
+            blobgz = script.store.getRange(*parseLocation(location))
+        elif algorithm is not None:
+            blobgz = script.store.get("%s.wsp.%s" % (path, algorithm))
+        if blobgz is None and location is None:
+            # Find the algorithm it was really made with
+            algorithm = findAlgorithm(script, path)
+            if algorithm is not None:
+                blobgz = script.store.get("%s.wsp.%s" % (path, algorithm))
+        recipe = None
+        if blobgz is None and location is None:
+            # An incremental backup has a recipe of blocks instead
+            recipe = script.store.get("%s.blocks" % path)
+        if blobSHA is None:
+            blobSHA = script.store.get("%s.sha1" % path)
 
-        if blobgz is None:
-            logger.warning("Skipping missing file in object store: %s/%s.wsp.%s" \
-                    % (i, d, script.options.algorithm))
-            continue
+        if blobgz is None and recipe is None:
+            logger.warning("Skipping missing file in object store: %s/%s.wsp.*" \
+                    % (i, d))
+            return False
 
         # Decompress
-        blobgz = StringIO(blobgz)
-        blob = None
-        if script.options.algorithm == "gz":
-            fd = gzip.GzipFile(fileobj=blobgz, mode="rb")
-            blob = fd.read()
-            fd.close()
-        elif script.options.algorithm == "sz":
-            compressor = snappy.StreamDecompressor()
-            blob = compressor.decompress(blobgz.getvalue())
-            try:
-                compressor.flush()
-            except UncompressError as e:
-                logger.error("Corrupt file in store: %s%s/%s.wsp.sz  Error %s" \
-                        % (script.options.storage_path, i, d, str(e)))
-                continue
+        try:
+            if recipe is not None:
+                blob = getBlocks(script, script.options.storage_path + i,
+                                 recipe)
+            else:
+                with script.runstats.time("decompress"):
+                    blob = decompressPayload(script, blobgz,
+                                             algorithm or "gz")
+                    # Undo the whisper transform, if the backup has one
+                    blob = decode(blob)
+        except Exception as e:
+            logger.error("Corrupt backup in store: %s  Error %s" \
+                    % (path, str(e)))
+            return False
+        del blobgz
 
         # Verify
         if blobSHA is None:
             logger.warning("Missing SHA1 checksum file...no verification")
         else:
-            if hashlib.sha1(blob).hexdigest() != blobSHA:
+            with script.runstats.time("hash"):
+                verified = verifyDigest(blob, blobSHA)
+            if not verified:
                 logger.warning("Backup does NOT verify, skipping metric %s" \
                                % i)
-                continue
+                return False
 
-        heal(script, i, blob)
+        with script.runstats.time("heal"):
+            heal(script, i, blob)
 
         # Clean up
         del blob
-        blobgz.close()
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        logger.error("Exception during restore of %s: %s" % (i, str(e)))
+        return False
 
+    return True
 
 
 def listbackups(script):
     c = 0
-    # This list is sorted, we will use that to our advantage
-    key = None
-    for i in script.store.list():
-        if i.endswith(".wsp.%s" % script.options.algorithm):
-            if key is None or key != i:
-                key = i
-                print key[:-33]
-
-            print "\tDate: %s" % key[len(key[:-32]):-7]
+    if script.index is not None and script.index.usable:
+        for m in sorted(script.index.metrics.keys()):
+            print script.options.storage_path + m
+            for i in script.index.metrics[m]:
+                if i[4] is None:
+                    print "\tDate: %s" % i[0]
+                else:
+                    print "\tDate: %s (%s)" % (i[0], i[4])
+                c += 1
+    else:
+        # The SHA1 is my canary/flag, full and incremental backups both
+        # have it.  The compressed file names the algorithm.
+        backups = []
+        algorithms = {}
+        for i in script.store.list(prefix=script.options.storage_path):
+            n = i.rfind("/")
+            if i.endswith(".sha1"):
+                backups.append((i[:n], i[n+1:-5]))
+            elif ".wsp." in i[n:]:
+                name = i[n+1:]
+                algorithms[(i[:n], name[:name.find(".wsp.")])] = \
+                        name[name.find(".wsp.")+5:]
+
+        key = None
+        for k, ts in sorted(backups):
+            if key is None or key != k:
+                key = k
+                print key
+
+            if (k, ts) in algorithms:
+                print "\tDate: %s (%s)" % (ts, algorithms[(k, ts)])
+            else:
+                print "\tDate: %s" % ts
             c += 1
 
     print
@@ -470,8 +1676,83 @@ def listbackups(script):
         print "%s compressed whisper databases found." % c
 
 
+def stats(script):
+    """Print how much space backups take in the store and how well the
+       blocks of incremental backups deduplicate."""
+
+    full = 0
+    fullBytes = 0
+    bundles = 0
+    bundleBytes = 0
+    recipeBytes = 0
+    blockBytes = {}
+    keys = []
+    for key, size in script.store.listSizes(prefix=script.options.storage_path):
+        if blockSHA(key) is not None:
+            blockBytes[key] = size
+        elif key.endswith(".blocks"):
+            keys.append(key)
+            recipeBytes += size
+        elif ".wsp." in key[key.rfind("/"):]:
+            full += 1
+            fullBytes += size
+        elif key.endswith(".bundle"):
+            bundles += 1
+            bundleBytes += size
+
+    # The uncompressed size of every distinct block the recipes reference
+    logical = 0
+    unique = {}
+    for key, recipe in readRecipes(script, keys).items():
+        if recipe is None:
+            continue
+        algorithm, blockSize, size, shas, shared = recipe
+        prefix = blockPrefix(script.options.storage_path,
+                             key[:key.rfind("/")], shared)
+        logical += size
+        for n, sha in enumerate(shas):
+            unique[blockKey(prefix, sha, algorithm)] = \
+                    min(blockSize, size - n * blockSize)
+
+    print "Full backups:          %d using %d bytes" % (full, fullBytes)
+    print "Bundles:               %d using %d bytes" % (bundles, bundleBytes)
+    print "Incremental backups:   %d using %d bytes of recipes" \
+            % (len(keys), recipeBytes)
+    print "Logical bytes:         %d" % logical
+    print "Unique block bytes:    %d" % sum(unique.values())
+    print "Stored blocks:         %d using %d bytes" \
+            % (len(blockBytes), sum(blockBytes.values()))
+    if sum(unique.values()) > 0:
+        print "Deduplication ratio:   %.2f" \
+                % (float(logical) / sum(unique.values()))
+    if sum(blockBytes.values()) > 0:
+        print "Compression ratio:     %.2f" \
+                % (float(sum(unique.values())) / sum(blockBytes.values()))
+
+
+def reportStats(script, mode):
+    """Log our run statistics and export them as configured.  Failing to
+       export them does not fail the run."""
+
+    script.runstats.log()
+    if script.options.prometheus_file:
+        try:
+            script.runstats.writePrometheus(script.options.prometheus_file,
+                                            mode)
+        except (IOError, OSError) as e:
+            logger.warning("Could not write run statistics to %s: %s"
+                    % (script.options.prometheus_file, str(e)))
+    if script.options.carbon:
+        try:
+            script.runstats.sendCarbon(script.options.carbon,
+                                       script.options.carbon_prefix, mode)
+        except (ValueError, socket.error) as e:
+            logger.warning("Could not send run statistics to %s: %s"
+                    % (script.options.carbon, str(e)))
+
+
 def main():
-    usage = "%prog [options] backup|restore|purge|list disk|gcs|noop|s3|swift [storage args]"
+    usage = "%prog [options] backup|restore|purge|list|reindex|stats disk|gcs|noop|s3|sim|swift [storage args]"
     options = []
 
     options.append(make_option("-p", "--prefix", type="string",
@@ -495,21 +1776,180 @@ def main():
     options.append(make_option("-m", "--metrics", type="string",
         default="*",
         help="Glob pattern of metric names to backup or restore, default %default"))
+    options.append(make_option("--scan-threads", type="int",
+        default=4,
+        help="Number of threads to read the directories of the whisper " \
+             "tree with, default %default"))
     options.append(make_option("-c", "--date", type="string",
         default=utc(),
         help="String in ISO-8601 date format. The last backup before this date will be used during the restore.  Default is now or %s." % utc()))
     choices = ["gz"]
     if snappy is not None:
         choices.append("sz")
+    if zstandard is not None:
+        choices.append("zst")
+    choices.append("auto")
     options.append(make_option("-a", "--algorithm", type="choice",
         default="gz", choices=choices, dest="algorithm",
         help="Compression format to use based on installed Python modules.  " \
-             "Choices: %s" % ", ".join(choices)))
+             "Choices: %s.  Auto picks one for each whisper file, " \
+             "restore finds the format of each backup itself" \
+             % ", ".join(choices)))
+    options.append(make_option("--bandwidth", type="string",
+        default="10M",
+        help="Upload bandwidth of each worker in bytes per second, with " \
+             "an optional K, M or G suffix, that --algorithm auto starts " \
+             "from.  Uploads from the workers refine it, default %default"))
+    options.append(make_option("--codec-age", type="int",
+        default=24,
+        help="Hours the codec --algorithm auto picked for a metric is " \
+             "reused when the manifest is enabled, default %default"))
+    options.append(make_option("--zstd-level", type="int",
+        default=3,
+        help="Compression level of the zst algorithm, 1 to 22, " \
+             "default %default"))
+    options.append(make_option("--zstd-threads", type="int",
+        default=0,
+        help="Number of threads each worker compresses with when using " \
+             "the zst algorithm, 0 compresses in the worker itself, " \
+             "default %default"))
+    options.append(make_option("--zstd-dict", action="store_true",
+        default=False,
+        help="Compress zst backups with the dictionary stored in the " \
+             "bucket, training one from a sample of the whisper files " \
+             "if there is none, default %default"))
+    options.append(make_option("--zstd-train", type="int",
+        default=0,
+        help="Train a new zst dictionary on this many whisper files " \
+             "sampled at random and store it in the bucket for this and " \
+             "later backups, implies --zstd-dict, default %default"))
+    options.append(make_option("--digest", type="choice",
+        default="sha1", choices=available(),
+        help="Checksum to verify whisper files with, recorded with each " \
+             "backup so restore uses the right one.  Choices: %s, " \
+             "default %%default" % ", ".join(available())))
     options.append(make_option("--storage-path", type="string",
         default="",
         help="Path in the bucket to store the backup, default %default"))
+    options.append(make_option("--state-dir", type="string",
+        default=None,
+        help="Directory to keep a local manifest of backups in the store.  " \
+             "Avoids listing the store for every metric.  Disabled by default"))
+    options.append(make_option("--rebuild-manifest", action="store_true",
+        default=False,
+        help="Rebuild the local manifest from the store, default %default"))
+    options.append(make_option("--manifest-check", type="int",
+        default=100,
+        help="Number of metrics in the manifest to verify against the " \
+             "store before trusting it, default %default"))
+    options.append(make_option("--paranoid", action="store_true",
+        default=False,
+        help="Read and hash every whisper file even when the manifest " \
+             "says it is unchanged since its last backup, default %default"))
+    options.append(make_option("--stream", action="store_true",
+        default=False,
+        help="Hash, compress and upload whisper files a chunk at a time " \
+             "rather than holding them in memory, default %default"))
+    options.append(make_option("--buffer-size", type="int",
+        default=4 * 1024 * 1024,
+        help="When streaming, whisper files up to this many bytes are " \
+             "snapshotted in memory, larger ones are copied to the " \
+             "scratch directory, default %default"))
+    options.append(make_option("--incremental", action="store_true",
+        default=False,
+        help="Upload only the blocks of each whisper file that changed " \
+             "since its last backup, default %default"))
+    options.append(make_option("--dedup", action="store_true",
+        default=False,
+        help="Store the blocks of incremental backups of all metrics in " \
+             "one content addressed chunk store, implies --incremental, " \
+             "default %default"))
+    options.append(make_option("--block-size", type="int",
+        default=64 * 1024,
+        help="Size in bytes of the blocks of incremental backups, " \
+             "default %default"))
+    options.append(make_option("--parallel-threshold", type="string",
+        default="0",
+        help="Compress whisper files larger than this, with an optional " \
+             "K, M or G suffix, as blocks on several threads producing a " \
+             "multi-member gzip file or multi-frame zstd file.  0 " \
+             "disables, default %default"))
+    options.append(make_option("--parallel-threads", type="int",
+        default=4,
+        help="Number of threads each worker compresses the blocks of a " \
+             "large whisper file with, default %default"))
+    options.append(make_option("--transform", action="store_true",
+        default=False,
+        help="Store whisper archives as delta encoded timestamps and XOR " \
+             "encoded values before compressing, which compress much " \
+             "better.  Restore undoes this.  Default %default"))
+    options.append(make_option("--io-concurrency", type="int",
+        default=0,
+        help="Number of threads in the parent process to upload backups " \
+             "and delete old ones with, leaving the worker processes to " \
+             "hash and compress.  0 uploads from the workers.  Purge " \
+             "deletes with this many threads, or --processes if 0, " \
+             "default %default"))
+    options.append(make_option("--batch-size", type="int",
+        default=1000,
+        help="Number of objects to remove per batched delete request " \
+             "when purging or enforcing retention, default %default"))
+    options.append(make_option("--bundle", type="int",
+        default=0,
+        help="Pack the backups of this many metrics into each bundle " \
+             "object, 0 stores each backup as its own objects, " \
+             "default %default"))
+    options.append(make_option("--scratch-dir", type="string",
+        default=None,
+        help="Directory to snapshot large whisper files into when " \
+             "streaming, a tmpfs is ideal.  Default is the system temp " \
+             "directory"))
+    options.append(make_option("--no-index", action="store_true",
+        default=False,
+        help="Do not use or update the consolidated index object in the " \
+             "store, always list the store instead, default %default"))
+    options.append(make_option("--report-file", type="string",
+        default=None,
+        help="Write a JSON report of the backup, restore or purge run, " \
+             "its totals, slowest metrics and errors, to this file, " \
+             "disabled by default"))
+    options.append(make_option("--progress-interval", type="int",
+        default=10,
+        help="Seconds between progress lines, default %default"))
+    options.append(make_option("--prometheus-file", type="string",
+        default=None,
+        help="Write the time spent in each stage of the run and its " \
+             "counters to this file for the node_exporter textfile " \
+             "collector, disabled by default"))
+    options.append(make_option("--carbon", type="string",
+        default=None,
+        help="Send the time spent in each stage of the run and its " \
+             "counters to the Carbon plaintext listener at HOST:PORT, " \
+             "disabled by default"))
+    options.append(make_option("--carbon-prefix", type="string",
+        default="whisper-backup.%s" % socket.gethostname().split(".")[0],
+        help="Metric path prefix used with --carbon, default %default"))
 
     script = CronScript(usage=usage, options=options)
+    if not script.options.storage_path.endswith('/'):
+        script.options.storage_path = script.options.storage_path + '/'
+    if script.options.dedup:
+        script.options.incremental = True
+    if script.options.zstd_train > 0:
+        script.options.zstd_dict = True
+    # Shared memory created before any workers fork, uploads from the
+    # parent's I/O threads refine the estimate the workers pick codecs by
+    script.bandwidth = Value("d", parseSize(script.options.bandwidth))
+    script.parallel_threshold = parseSize(script.options.parallel_threshold)
+    if script.options.bundle > 0 and script.options.incremental:
+        logger.error("--bundle can not be used with incremental backups")
+        sys.exit(1)
+    if script.options.transform and script.options.incremental:
+        logger.error("--transform can not be used with incremental backups")
+        sys.exit(1)
+    if script.options.bundle > 0 and script.options.no_index:
+        logger.error("--bundle requires the index, remove --no-index")
+        sys.exit(1)
 
     if len(script.args) == 0:
         logger.info("whisper-backup.py - A Python script for backing up whisper " \
@@ -519,33 +1959,69 @@ def main():
         logger.info("See the README for help or use the --help option.")
         sys.exit(1)
 
+    # Created before any workers fork so they all add to it
+    script.runstats = RunStats()
+    script.report = RunReport(script.args[0].lower())
+
     mode = script.args[0].lower()
     if mode == "backup":
         with script:
             # Use splay and lockfile settings
-            script.store = storageBackend(script)
+            script.store = openStore(script)
+            script.index = openIndex(script, modify=True)
+            script.manifest = openManifest(script, script.index)
             backup(script)
     elif mode == "restore":
         with script:
             # Use splay and lockfile settings
-            script.store = storageBackend(script)
+            script.store = openStore(script)
+            script.index = openIndex(script)
             restore(script)
     elif mode == "purge":
         with script:
             # Use splay and lockfile settings
-            script.store = storageBackend(script)
-            localMetrics = listMetrics(script.options.prefix,
-                    script.options.storage_path, script.options.metrics)
-            purge(script, { k: True for k, p in localMetrics })
+            script.store = openStore(script)
+            with script.runstats.time("scan"):
+                localMetrics = list(listMetrics(script.options.prefix,
+                        script.options.storage_path, script.options.metrics,
+                        script.options.scan_threads))
+            script.index = openIndex(script, modify=True)
+            script.manifest = openManifest(script, script.index)
+            purge(script, { i[0]: True for i in localMetrics })
+            saveIndex(script)
     elif mode == "list":
         # Splay and lockfile settings make no sense here
-        script.store = storageBackend(script)
+        script.store = openStore(script)
+        script.index = openIndex(script)
         listbackups(script)
+    elif mode == "reindex":
+        with script:
+            # Use splay and lockfile settings
+            script.store = openStore(script)
+            script.index = Index(script.store, script.options.storage_path,
+                                 script.options.noop)
+            script.index.markDirty()
+            script.index.rebuild(script.options.storage_path)
+            # The listing is the truth, the old index is not merged in
+            script.index.save(merge=False)
+    elif mode == "stats":
+        # Splay and lockfile settings make no sense here
+        script.store = openStore(script)
+        script.manifest = openManifest(script)
+        stats(script)
     else:
         logger.error("Command %s unknown.  Must be one of backup, restore, " \
-                     "purge, or list." % script.args[0])
+                     "purge, list, reindex, or stats." % script.args[0])
         sys.exit(1)
 
+    reportStats(script, mode)
+    if script.options.report_file and mode in ("backup", "restore", "purge"):
+        try:
+            script.report.write(script.options.report_file, script.runstats)
+        except (IOError, OSError) as e:
+            logger.warning("Could not write the run report to %s: %s"
+                    % (script.options.report_file, str(e)))
+
 
 if __name__ == "__main__":
     main()